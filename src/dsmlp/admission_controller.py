@@ -1,30 +1,58 @@
 import logging
 import os
+from typing import Callable, Tuple
 from dsmlp.app import factory
-from flask import Flask, request
+from flask import Flask, Response, request, stream_with_context
 from flask.logging import default_handler
-from dsmlp.app.validator import Validator
+from dsmlp.app.batch import encode_line, parse_reviews, validate_batch
+from dsmlp.app.metrics import REGISTRY
+from dsmlp.app.validator import RequestDumpSampler, Validator
 
 from logging.config import dictConfig
 
 from dsmlp.ext.logger import PythonLogger
 
 
-def create_app(test_config=None):
+def create_app(test_config=None, health: Callable[[], Tuple[bool, str]] = None):
+    """`health` reports (healthy, message) for /healthz, e.g. the worker heartbeats of dsmlp-server"""
     app = Flask(__name__)
 
     logging.getLogger('waitress').setLevel(logging.INFO)
     logging.getLogger('dsmlp').setLevel(logging.DEBUG)
-    logger = PythonLogger(None)
-    validator = Validator(factory.awsed_client, factory.kube_client, logger)
+    logger = PythonLogger(None, background=True)
+    validator = Validator(factory.awsed_client, factory.kube_client, logger, factory.lookup_executor,
+                          RequestDumpSampler(int(os.getenv('LOG_REQUEST_SAMPLE_RATE', 100))), factory.decision_log,
+                          factory.id_decision_cache, factory.degraded_policies,
+                          factory.gpu_reservations)
+    # Batches are dry runs: their decisions are not logged and reserve no GPUs
+    batch_validator = Validator(factory.awsed_client, factory.kube_client, logger, factory.lookup_executor,
+                                validator.dump_sampler, None, factory.id_decision_cache, factory.degraded_policies)
 
     @app.route('/validate', methods=['POST'])
     def validate_request():
-        return validator.validate_request(request.get_json())
+        return Response(validator.validate_request_body(request.get_data()), mimetype='application/json')
+
+    @app.route('/validate/batch', methods=['POST'])
+    def validate_batch_request():
+        try:
+            reviews = parse_reviews(request.stream)
+        except ValueError as ex:
+            return Response(f"Invalid JSON array: {ex}", status=400, mimetype='text/plain')
+        results = validate_batch(batch_validator, reviews, factory.batch_executor,
+                                 window=int(os.environ.get('BATCH_VALIDATION_WINDOW', 64)))
+        return Response(stream_with_context(encode_line(result) for result in results),
+                        mimetype='application/x-ndjson')
 
     @app.route('/healthz', methods=['GET'])
-    def health():
-        return 'OK'
+    def healthz():
+        if health is None:
+            return 'OK'
+        healthy, message = health()
+        return Response(message, status=200 if healthy else 503, mimetype='text/plain')
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(REGISTRY.expose(), mimetype='text/plain; version=0.0.4')
 
     app.config.from_mapping(
         SECRET_KEY=os.getenv('SECRET_KEY')
@@ -0,0 +1,100 @@
+"""
+Validation of many AdmissionReviews in one call, for dry runs of policy changes and checks of
+pod specs ahead of time.
+
+The reviews of a batch share one LookupMemo, so each user and namespace is looked up once
+for the whole batch, and are validated concurrently. Results come back in input order, one
+per review with its `index`, as soon as they and all earlier ones are ready.
+
+Reviews are validated as dry runs: their decisions are not counted in the admission metrics
+or logged as admissions, and reserve no GPUs.
+"""
+import asyncio
+import json
+from collections import deque
+from concurrent.futures import Executor
+from typing import Any, AsyncIterator, Deque, Dict, IO, Iterable, Iterator
+
+from dsmlp.app.context import LookupMemo
+from dsmlp.app.validator import AsyncValidator, Validator
+
+
+class BatchItemError(Exception):
+    """A batch item that could not be read"""
+
+
+def parse_reviews(stream: IO[bytes]) -> Iterator[Any]:
+    """
+    AdmissionReviews from a JSON array, parsed at once (raising ValueError if it is not JSON),
+    or from newline-delimited JSON, read line by line as they are consumed. A line that is
+    not JSON is yielded as a BatchItemError.
+    """
+    first = stream.read(1)
+    while first.isspace():
+        first = stream.read(1)
+    if first == b'[':
+        return iter(json.loads(first + stream.read()))
+    return parse_lines(first, iter(stream))
+
+
+def parse_lines(first: bytes, lines: Iterator[bytes]) -> Iterator[Any]:
+    line = first + next(lines, b'') if first else b''
+    while line:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError as ex:
+                yield BatchItemError(f"invalid JSON: {ex}")
+        line = next(lines, b'')
+
+
+def validate_item(validator: Validator, index: int, item: Any, memo: LookupMemo) -> Dict[str, Any]:
+    if isinstance(item, BatchItemError):
+        return {'index': index, 'error': str(item)}
+    try:
+        return dict(validator.validate_request(item, memo, dry_run=True), index=index)
+    except Exception as ex:
+        return {'index': index, 'error': f"invalid AdmissionReview: {ex!r}"}
+
+
+def validate_batch(validator: Validator, reviews: Iterable[Any], executor: Executor = None,
+                   window: int = 64) -> Iterator[Dict[str, Any]]:
+    """Responses to `reviews` in order, validating up to `window` at a time on `executor`"""
+    memo = LookupMemo()
+    if executor is None:
+        for index, item in enumerate(reviews):
+            yield validate_item(validator, index, item, memo)
+        return
+
+    pending: Deque = deque()
+    for index, item in enumerate(reviews):
+        pending.append(executor.submit(validate_item, validator, index, item, memo))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+async def async_validate_batch(validator: AsyncValidator, reviews: Iterable[Any],
+                               window: int = 64) -> AsyncIterator[Dict[str, Any]]:
+    memo = LookupMemo()
+
+    async def validate(index: int, item: Any) -> Dict[str, Any]:
+        if isinstance(item, BatchItemError):
+            return {'index': index, 'error': str(item)}
+        try:
+            return dict(await validator.validate_request(item, memo, dry_run=True), index=index)
+        except Exception as ex:
+            return {'index': index, 'error': f"invalid AdmissionReview: {ex!r}"}
+
+    pending: Deque[asyncio.Task] = deque()
+    for index, item in enumerate(reviews):
+        pending.append(asyncio.ensure_future(validate(index, item)))
+        if len(pending) >= window:
+            yield await pending.popleft()
+    while pending:
+        yield await pending.popleft()
+
+
+def encode_line(result: Dict[str, Any]) -> bytes:
+    return json.dumps(result).encode() + b'\n'
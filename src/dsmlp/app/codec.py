@@ -0,0 +1,91 @@
+"""
+Fast decoding of AdmissionReview requests and encoding of responses.
+
+AdmissionReview.from_dict builds the nested dataclasses by reflection on every request. The
+functions here build the same dataclasses by hand from the parsed JSON, touching only the
+fields in dsmlp.app.types, and write responses from a pre-built template. Required fields are
+required here as well, so both paths accept and reject the same requests.
+"""
+import json
+from typing import Any, Dict, List, Optional, Union
+
+from dsmlp.app.types import *
+
+RESPONSE_TEMPLATE = (
+    '{"apiVersion": "admission.k8s.io/v1", "kind": "AdmissionReview", '
+    '"response": {"uid": %s, "allowed": %s, "status": {"message": %s}}}')
+
+
+def decode_review(data: Union[bytes, str, Dict[str, Any]]) -> AdmissionReview:
+    if not isinstance(data, dict):
+        data = json.loads(data)
+    return AdmissionReview(request=decode_request(data['request']))
+
+
+def decode_request(request: Dict[str, Any]) -> Request:
+    user_info = request['userInfo']
+    return Request(
+        uid=request['uid'],
+        namespace=request['namespace'],
+        object=decode_object(request['object']),
+        userInfo=UserInfo(username=user_info['username']) if user_info is not None else None,
+        dryRun=request.get('dryRun'))
+
+
+def decode_object(obj: Optional[Dict[str, Any]]) -> Optional[Object]:
+    if obj is None:
+        return None
+
+    metadata = obj['metadata']
+    return Object(
+        metadata=ObjectMeta(labels=metadata['labels'], name=metadata.get('name')) if metadata is not None else None,
+        spec=decode_pod_spec(obj['spec']))
+
+
+def decode_pod_spec(spec: Optional[Dict[str, Any]]) -> Optional[PodSpec]:
+    if spec is None:
+        return None
+
+    security_context = spec.get('securityContext')
+    if security_context is not None:
+        security_context = PodSecurityContext(
+            runAsUser=security_context.get('runAsUser'),
+            runAsGroup=security_context.get('runAsGroup'),
+            fsGroup=security_context.get('fsGroup'),
+            supplementalGroups=security_context.get('supplementalGroups'))
+
+    return PodSpec(
+        containers=decode_containers(spec['containers']),
+        initContainers=decode_containers(spec.get('initContainers')),
+        securityContext=security_context,
+        priorityClassName=spec.get('priorityClassName'))
+
+
+def decode_containers(containers: Optional[List[Dict[str, Any]]]) -> Optional[List[Container]]:
+    if containers is None:
+        return None
+
+    decoded = []
+    for container in containers:
+        security_context = container.get('securityContext')
+        if security_context is not None:
+            security_context = SecurityContext(
+                runAsUser=security_context.get('runAsUser'),
+                runAsGroup=security_context.get('runAsGroup'))
+
+        resources = container.get('resources')
+        if resources is not None:
+            resources = ResourceRequirements(requests=resources.get('requests'), limits=resources.get('limits'))
+
+        decoded.append(Container(securityContext=security_context, resources=resources))
+
+    return decoded
+
+
+def encode_response(response: Dict[str, Any]) -> bytes:
+    """Encode a response built by Validator.admission_response"""
+    body = response['response']
+    return (RESPONSE_TEMPLATE % (
+        json.dumps(body['uid']),
+        'true' if body['allowed'] else 'false',
+        json.dumps(body['status']['message']))).encode()
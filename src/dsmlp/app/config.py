@@ -1,3 +1,4 @@
 GPU_LABEL = "nvidia.com/gpu"
 GPU_LIMIT_ANNOTATION = 'gpu-limit'
-LOW_PRIORITY_CLASS = "low"
\ No newline at end of file
+LOW_PRIORITY_CLASS = "low"
+TERMINAL_POD_PHASES = ("Succeeded", "Failed")
@@ -0,0 +1,183 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Executor, Future
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dsmlp.app.metrics import DEPENDENCY_SECONDS
+from dsmlp.app.types import Request
+from dsmlp.plugin.awsed import AsyncAwsedClient, AwsedClient, ListTeamsResponse, UserResponse
+from dsmlp.plugin.kube import AsyncKubeClient, KubeClient, Namespace
+
+# Lookup name -> (dependency, client method)
+LOOKUPS: Dict[str, Tuple[str, str]] = {
+    'user': ('awsed', 'describe_user'),
+    'teams': ('awsed', 'list_user_teams'),
+    'gpu_quota': ('awsed', 'get_user_gpu_quota'),
+    'namespace': ('kube', 'get_namespace'),
+    'gpus_in_namespace': ('kube', 'get_gpus_in_namespace'),
+}
+
+
+@dataclass
+class LookupRecord:
+    name: str
+    key: str
+    seconds: float
+    error: Optional[str] = None
+
+
+class LookupMemo:
+    """Lookups by (name, key). Contexts sharing a memo, e.g. of one batch, make each lookup once."""
+
+    def __init__(self) -> None:
+        self.futures: Dict[Tuple[str, str], Future] = {}
+        self.lock = threading.Lock()
+
+
+class AdmissionContext:
+    """
+    Remote facts about a single admission, shared by all component validators.
+
+    Each lookup is made at most once per context (or per memo, if one is given) and its timing
+    is recorded in `records` of the context that made it. With an executor, `prefetch` starts
+    lookups concurrently ahead of validation. The validator records how long each stage of
+    the admission took in `timings`.
+    """
+
+    def __init__(self, request: Request, awsed: AwsedClient, kube: Optional[KubeClient] = None,
+                 executor: Optional[Executor] = None, memo: Optional[LookupMemo] = None) -> None:
+        self.request = request
+        self.clients = {'awsed': awsed, 'kube': kube}
+        self.executor = executor
+        self.records: List[LookupRecord] = []
+        self.timings: Dict[str, float] = {}
+        # Validators skipped because a dependency was unavailable
+        self.skipped: List[str] = []
+        # Decisions taken from a cache instead of the lookups they stand for, and other state
+        # a decision depends on, by name; logged with the lookups so the request replays the same
+        self.cached: Dict[str, object] = {}
+        # A dry run, e.g. an item of a batch: its decision is not counted, logged or acted on
+        self.dry_run = False
+        memo = memo if memo is not None else LookupMemo()
+        self._futures = memo.futures
+        self._lock = memo.lock
+
+    def user(self) -> UserResponse:
+        return self.lookup('user', self.request.namespace)
+
+    def teams(self) -> ListTeamsResponse:
+        return self.lookup('teams', self.request.namespace)
+
+    def gpu_quota(self) -> Optional[int]:
+        return self.lookup('gpu_quota', self.request.namespace)
+
+    def namespace(self) -> Namespace:
+        return self.lookup('namespace', self.request.namespace)
+
+    def gpus_in_namespace(self) -> int:
+        return self.lookup('gpus_in_namespace', self.request.namespace)
+
+    def prefetch(self, names: Iterable[str] = LOOKUPS) -> None:
+        if self.executor is None:
+            return
+
+        for name in names:
+            future = self._claim(name, self.request.namespace)
+            if future is not None:
+                self.executor.submit(self._run, name, self.request.namespace, future)
+
+    def results(self) -> Dict[str, Tuple[object, Optional[Exception]]]:
+        """
+        The (result, error) of each completed lookup of this request's namespace, and of each
+        value in `cached`, by name
+        """
+        with self._lock:
+            futures = list(self._futures.items())
+
+        results = {name: (None, future.exception()) if future.exception() is not None else (future.result(), None)
+                   for (name, key), future in futures if key == self.request.namespace and future.done()}
+        results.update((name, (decision, None)) for name, decision in self.cached.items())
+        return results
+
+    def lookup(self, name: str, key: str):
+        future = self._claim(name, key)
+        if future is not None:
+            self._run(name, key, future)
+        else:
+            future = self._futures[(name, key)]
+
+        return future.result()
+
+    def _claim(self, name: str, key: str) -> Optional[Future]:
+        """Returns a new future if the caller should make the lookup, None if it is already made"""
+        with self._lock:
+            if (name, key) in self._futures:
+                return None
+            future = Future()
+            self._futures[(name, key)] = future
+            return future
+
+    def _run(self, name: str, key: str, future: Future) -> None:
+        dependency, method = LOOKUPS[name]
+        start = time.perf_counter()
+        try:
+            result = getattr(self.clients[dependency], method)(key)
+        except Exception as ex:
+            self._complete(name, key, start, future, error=ex)
+            return
+
+        self._complete(name, key, start, future, result)
+
+    def _complete(self, name: str, key: str, start: float, future: Future, result=None,
+                  error: Optional[Exception] = None) -> None:
+        record = LookupRecord(name=name, key=key, seconds=time.perf_counter() - start,
+                              error=repr(error) if error is not None else None)
+        with self._lock:
+            self.records.append(record)
+        dependency, method = LOOKUPS[name]
+        DEPENDENCY_SECONDS.observe(record.seconds, (dependency, method, 'ok' if error is None else 'error'))
+
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+
+class AsyncAdmissionContext(AdmissionContext):
+    """
+    AdmissionContext backed by async clients.
+
+    Lookups are awaited concurrently by `resolve` before validation; the component validators
+    then read the results synchronously without blocking the event loop.
+    """
+
+    def __init__(self, request: Request, awsed: AsyncAwsedClient, kube: AsyncKubeClient,
+                 memo: Optional[LookupMemo] = None) -> None:
+        super().__init__(request, awsed, kube, memo=memo)
+
+    async def resolve(self, names: Iterable[str] = LOOKUPS) -> None:
+        await asyncio.gather(*(self._resolve(name, self.request.namespace) for name in names))
+
+    async def _resolve(self, name: str, key: str) -> None:
+        future = self._claim(name, key)
+        if future is None:
+            # Made by another context of the memo: wait for it, validators must not block
+            made = self._futures[(name, key)]
+            if not made.done():
+                await asyncio.wait([asyncio.wrap_future(made)])
+            return
+
+        dependency, method = LOOKUPS[name]
+        start = time.perf_counter()
+        try:
+            result = await getattr(self.clients[dependency], method)(key)
+        except Exception as ex:
+            self._complete(name, key, start, future, error=ex)
+            return
+
+        self._complete(name, key, start, future, result)
+
+    def _run(self, name: str, key: str, future: Future) -> None:
+        future.set_exception(RuntimeError(f"{name} lookup was not resolved before validation"))
@@ -1,8 +1,200 @@
-from dsmlp.ext.awsed import ExternalAwsedClient
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from dsmlp.app import metrics
+from dsmlp.app.reservations import GpuReservations
+from dsmlp.ext.cache import TTLCache
+from dsmlp.ext.awsed import CachingAwsedClient, ExternalAwsedClient
+from dsmlp.ext.awsed_replica import AwsedReplica
+from dsmlp.ext.breaker import CircuitBreaker, Guard, GuardedAwsedClient, is_kube_failure
+from dsmlp.ext.decision_log import FileDecisionLog
+from dsmlp.ext.informer import NamespaceCache, PodGpuLedger
 from dsmlp.ext.kube import DefaultKubeClient
+from dsmlp.ext.kube_api import KubeApiProvider
+from dsmlp.ext.shm_cache import SharedCacheAwsedClient, SharedCacheKubeClient, SharedTable
+from dsmlp.ext.snapshot import (LookupSnapshot, SnapshotAwsedClient, SnapshotKubeClient, warm_cache,
+                                warm_namespace_cache, warm_replica)
 
 
 class AppFactory:
     def __init__(self):
-        self.awsed_client = ExternalAwsedClient()
-        self.kube_client = DefaultKubeClient()
+        self.degraded_policies = {
+            'awsed': os.environ.get('AWSED_DEGRADED_POLICY', 'cache').lower(),
+            'kube': os.environ.get('KUBE_DEGRADED_POLICY', 'cache').lower(),
+        }
+        self.snapshot = self.create_snapshot()
+        self.shared_table = self.create_shared_table()
+        self.gpu_reservations = self.create_gpu_reservations()
+        self.kube_client = self.create_kube_client()
+        self.awsed_client = self.create_awsed_client()
+        self.lookup_executor = self.create_lookup_executor()
+        self.batch_executor = self.create_batch_executor()
+        self.decision_log = self.create_decision_log()
+        self.id_decision_cache = self.create_id_decision_cache()
+
+    def create_awsed_client(self):
+        external = client = GuardedAwsedClient(ExternalAwsedClient(timeout=self.call_timeout('awsed')),
+                                               self.create_guard('awsed'))
+        if self.snapshot is not None:
+            external = client = SnapshotAwsedClient(client, self.snapshot,
+                                                    fallback=self.degraded_policies['awsed'] != 'deny')
+        if os.environ.get('AWSED_CACHE_ENABLED', 'true').lower() == 'true':
+            if self.shared_table is not None:
+                client = self.create_shared_awsed_cache(client)
+            else:
+                client = self.create_awsed_cache(client)
+
+        if os.environ.get('AWSED_REPLICA_ENABLED', 'false').lower() == 'true':
+            client = AwsedReplica(
+                external,
+                lambda: self.kube_client.list_namespace_names(label_selector='k8s-sync'),
+                fallback=client,
+                sync_period=float(os.environ.get('AWSED_REPLICA_SYNC_PERIOD', 5)),
+                batch_size=int(os.environ.get('AWSED_REPLICA_BATCH_SIZE', 50)),
+                relist_period=float(os.environ.get('AWSED_REPLICA_RELIST_PERIOD', 300)),
+                workers=int(os.environ.get('AWSED_REPLICA_WORKERS', 8)),
+                max_age=float(os.environ.get(
+                    'AWSED_REPLICA_MAX_AGE', 600 if self.degraded_policies['awsed'] == 'deny' else 3600)))
+            metrics.register_cache('awsed-replica', client)
+            if self.snapshot is not None:
+                warm_replica(client, self.snapshot)
+
+        return client
+
+    def create_awsed_cache(self, client):
+        client = CachingAwsedClient(
+            client,
+            user_ttl=float(os.environ.get('AWSED_CACHE_USER_TTL', 300)),
+            teams_ttl=float(os.environ.get('AWSED_CACHE_TEAMS_TTL', 300)),
+            quota_ttl=float(os.environ.get('AWSED_CACHE_QUOTA_TTL', 60)),
+            maxsize=int(os.environ.get('AWSED_CACHE_SIZE', 4096)),
+            stale_ttl=float(os.environ.get('AWSED_CACHE_STALE_TTL', 3600))
+            if self.degraded_policies['awsed'] != 'deny' else 0,
+            negative_ttl=float(os.environ.get('AWSED_CACHE_NEGATIVE_TTL', 10)))
+        for kind, cache in (('user', client.users), ('teams', client.teams), ('gpu_quota', client.quotas)):
+            metrics.register_cache(cache.name, cache)
+            if self.snapshot is not None:
+                warm_cache(cache, self.snapshot, kind)
+
+        return client
+
+    def create_shared_awsed_cache(self, client):
+        client = SharedCacheAwsedClient(
+            client,
+            self.shared_table,
+            user_ttl=float(os.environ.get('AWSED_CACHE_USER_TTL', 300)),
+            teams_ttl=float(os.environ.get('AWSED_CACHE_TEAMS_TTL', 300)),
+            quota_ttl=float(os.environ.get('AWSED_CACHE_QUOTA_TTL', 60)),
+            stale_ttl=float(os.environ.get('AWSED_CACHE_STALE_TTL', 3600))
+            if self.degraded_policies['awsed'] != 'deny' else 0,
+            negative_ttl=float(os.environ.get('AWSED_CACHE_NEGATIVE_TTL', 10)))
+        metrics.register_cache(client.cache.name, client.cache)
+        return client
+
+    def create_kube_client(self):
+        api_provider = KubeApiProvider(
+            pool_size=int(os.environ.get('KUBE_CONNECTION_POOL_SIZE', 16)),
+            qps=float(os.environ.get('KUBE_QPS', 50)),
+            burst=int(os.environ.get('KUBE_BURST', 100)),
+            request_timeout=float(os.environ.get('KUBE_REQUEST_TIMEOUT', 10)))
+        pod_observer = self.gpu_reservations.observe if self.gpu_reservations is not None else None
+        client = DefaultKubeClient(api_provider=api_provider, pod_observer=pod_observer,
+                                   request_timeout=self.call_timeout('kube'),
+                                   guard=self.create_guard('kube', is_failure=is_kube_failure),
+                                   raw_reads=os.environ.get('KUBE_RAW_READS', 'false').lower() == 'true')
+        resync_period = float(os.environ.get('KUBE_INFORMER_RESYNC_PERIOD', 300))
+        if os.environ.get('KUBE_NAMESPACE_CACHE_ENABLED', 'false').lower() == 'true':
+            client.namespace_cache = NamespaceCache(client.get_policy_api, resync_period=resync_period)
+            metrics.register_cache('namespaces', client.namespace_cache)
+            if self.snapshot is not None:
+                warm_namespace_cache(client.namespace_cache, self.snapshot)
+        if os.environ.get('KUBE_GPU_LEDGER_ENABLED', 'false').lower() == 'true':
+            client.gpu_ledger = PodGpuLedger(client.get_policy_api, pod_observer=pod_observer,
+                                            resync_period=resync_period)
+            metrics.register_cache('pod-gpus', client.gpu_ledger)
+        namespace_cache = client.namespace_cache
+        if self.snapshot is not None:
+            client = SnapshotKubeClient(client, self.snapshot, fallback=self.degraded_policies['kube'] != 'deny')
+        if self.shared_table is not None and namespace_cache is None:
+            client = SharedCacheKubeClient(
+                client,
+                self.shared_table,
+                namespace_ttl=float(os.environ.get('SHARED_CACHE_NAMESPACE_TTL', 60)),
+                stale_ttl=float(os.environ.get('AWSED_CACHE_STALE_TTL', 3600))
+                if self.degraded_policies['kube'] != 'deny' else 0)
+            metrics.register_cache(client.cache.name, client.cache)
+
+        return client
+
+    def create_gpu_reservations(self):
+        timeout = float(os.environ.get('GPU_RESERVATION_TIMEOUT', 60))
+        if timeout <= 0:
+            return None
+
+        reservations = GpuReservations(timeout)
+        metrics.register_cache('gpu-reservations', reservations)
+        return reservations
+
+    def create_guard(self, dependency: str, **kwargs):
+        prefix = dependency.upper()
+        breaker = CircuitBreaker(
+            dependency,
+            failure_threshold=int(os.environ.get(f'{prefix}_BREAKER_THRESHOLD', 5)),
+            reset_timeout=float(os.environ.get(f'{prefix}_BREAKER_RESET', 30)))
+        guard = Guard(breaker, timeout=self.call_timeout(dependency),
+                      workers=int(os.environ.get(f'{prefix}_CALL_WORKERS', 32)), **kwargs)
+        metrics.register_guard(dependency, guard)
+        return guard
+
+    def call_timeout(self, dependency: str) -> float:
+        return float(os.environ.get(f'{dependency.upper()}_CALL_TIMEOUT', 5))
+
+    def create_snapshot(self):
+        path = os.environ.get('SNAPSHOT_PATH')
+        if not path:
+            return None
+
+        snapshot = LookupSnapshot(path, max_age=float(os.environ.get('SNAPSHOT_MAX_AGE', 86400)))
+        snapshot.load()
+        snapshot.start(interval=float(os.environ.get('SNAPSHOT_INTERVAL', 60)))
+        return snapshot
+
+    def create_shared_table(self):
+        path = os.environ.get('SHARED_CACHE_PATH')
+        if not path:
+            return None
+
+        return SharedTable(path, slots=int(os.environ.get('SHARED_CACHE_SLOTS', 16384)),
+                           slot_size=int(os.environ.get('SHARED_CACHE_SLOT_SIZE', 2048)))
+
+    def create_lookup_executor(self):
+        workers = int(os.environ.get('VALIDATOR_LOOKUP_WORKERS', 0))
+        if workers <= 0:
+            return None
+
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="lookup")
+
+    def create_batch_executor(self):
+        workers = int(os.environ.get('BATCH_VALIDATION_WORKERS', 8))
+        if workers <= 0:
+            return None
+
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch")
+
+    def create_decision_log(self):
+        path = os.environ.get('DECISION_LOG_PATH')
+        if not path:
+            return None
+
+        return FileDecisionLog(path, queue_size=int(os.environ.get('DECISION_LOG_QUEUE_SIZE', 10000)))
+
+    def create_id_decision_cache(self):
+        ttl = float(os.environ.get('ID_DECISION_CACHE_TTL', 30))
+        if ttl <= 0:
+            return None
+
+        # Decisions are never refreshed in the background: the loader belongs to the request
+        cache = TTLCache('id-decisions', ttl, maxsize=int(os.environ.get('ID_DECISION_CACHE_SIZE', 4096)),
+                         background_refresh=False)
+        metrics.register_cache(cache.name, cache)
+        return cache
@@ -1,6 +1,6 @@
 from dataclasses import dataclass
 import json
-from typing import List, Optional
+from typing import Iterable, List, Optional
 
 from dataclasses_json import dataclass_json
 from dsmlp.plugin.awsed import AwsedClient, UnsuccessfulRequest
@@ -10,16 +10,30 @@ from dsmlp.plugin.kube import KubeClient, NotFound
 import jsonify
 
 from dsmlp.plugin.logger import Logger
+from dsmlp.app.context import AdmissionContext
+from dsmlp.app.metrics import LOOKUPS_AVOIDED
+from dsmlp.app.reservations import GpuReservations
 from dsmlp.app.types import *
 from dsmlp.app.config import *
 
 
+# Name of the GPUs reserved in the namespace in AdmissionContext.cached, logged so replay counts them
+GPUS_RESERVED = 'gpus_reserved'
+
+
 class GPUValidator(ComponentValidator):
 
-    def __init__(self, awsed: AwsedClient, kube: KubeClient, logger: Logger) -> None:
+    def __init__(self, awsed: AwsedClient, kube: KubeClient, logger: Logger,
+                 reservations: GpuReservations = None) -> None:
+        """
+        With reservations, the GPUs of admitted pods count against the quota until they show
+        up in the namespace's pod list. GPUValidator must then run last, as it reserves when
+        its own check passes.
+        """
         self.awsed = awsed
         self.kube = kube
         self.logger = logger
+        self.reservations = reservations
 
     def calculate_utilized_gpu(self, request: Request):
         # Calculate the number of GPUs requested for kube client
@@ -55,32 +69,76 @@ class GPUValidator(ComponentValidator):
             
         return default_gpu_quota
 
-    def validate_pod(self, request: Request):
+    LOOKUPS = ('namespace', 'gpus_in_namespace', 'gpu_quota')
+
+    def is_exempt(self, request: Request) -> bool:
+        """Low priority pods and pods without GPUs (which may run over the cap) are not checked"""
+        priority = request.object.spec.priorityClassName
+        if priority is not None and priority == LOW_PRIORITY_CLASS:
+            return True
+        return self.calculate_utilized_gpu(request=request) == 0
+
+    def required_lookups(self, request: Request, context: AdmissionContext = None) -> Optional[Iterable[str]]:
+        if self.is_exempt(request):
+            return ()
+        if self.reservations is not None:
+            # Read under the namespace's lock instead, see validate_pod
+            return ('namespace', 'gpu_quota')
+        return self.LOOKUPS
+
+    def validate_pod(self, request: Request, context: AdmissionContext = None):
         """
         Validate pods for namespaces with the 'k8s-sync' label
         """
+        if context is None:
+            context = AdmissionContext(request, self.awsed, self.kube)
 
-        # Low priority pods pass through
-        priority = request.object.spec.priorityClassName
-        if priority is not None and priority == LOW_PRIORITY_CLASS:
+        # Local checks first: most pods need no lookups at all
+        if self.is_exempt(request):
+            for name in self.LOOKUPS:
+                LOOKUPS_AVOIDED.inc((name,))
             return
-        
-        # initialized namespace, gpu_quota from awsed, and curr_gpus
-        namespace = self.kube.get_namespace(request.namespace)
-        curr_gpus = self.kube.get_gpus_in_namespace(request.namespace)
-        awsed_gpu_quota = self.awsed.get_user_gpu_quota(request.namespace)
-        
-        # check utilized gpu
+
         utilized_gpus = self.calculate_utilized_gpu(request=request)
-        
+
+        # initialized namespace, gpu_quota from awsed, and curr_gpus
+        namespace = context.namespace()
+        try:
+            awsed_gpu_quota = context.gpu_quota()
+        except UnsuccessfulRequest as ex:
+            # Without an AWSEd quota, the namespace's quota applies
+            self.logger.info("GPU quota lookup failed", reason=str(ex), uid=request.uid)
+            awsed_gpu_quota = None
+
         # request gpu_quota from method
         gpu_quota = self.determine_gpu_quota(awsed_gpu_quota, namespace.gpu_quota)
-        
-        # Short circuit if no GPUs requested (permits overcap) or return
-        if utilized_gpus == 0:
+
+        if self.reservations is None:
+            self.check_quota(utilized_gpus, context.gpus_in_namespace(), gpu_quota)
             return
+
+        with self.reservations.lock(request.namespace):
+            # Usage is read after the admissions before this one reserved: a pod list made earlier
+            # could miss a pod whose reservation a newer list has already released
+            curr_gpus = context.gpus_in_namespace()
+            reserved = self.reservations.reserved(request.namespace)
+            context.cached[GPUS_RESERVED] = reserved
+            self.check_quota(utilized_gpus, curr_gpus + reserved, gpu_quota)
+            if request.dryRun or context.dry_run:
+                # The pod will not be created
+                return
+            self.reservations.reserve(request.namespace, self.pod_name(request), utilized_gpus)
+
+    def check_quota(self, utilized_gpus: int, curr_gpus: int, gpu_quota: int):
         # Check if the total number of utilized GPUs exceeds the GPU quota
         if utilized_gpus + curr_gpus > gpu_quota:
             raise ValidationFailure(
                 f"GPU quota exceeded. Wanted {utilized_gpus} but with {curr_gpus} already in use, "
-                f"the quota of {gpu_quota} would be exceeded.")
\ No newline at end of file
+                f"the quota of {gpu_quota} would be exceeded.")
+
+    def pod_name(self, request: Request) -> str:
+        # Validating webhooks see generated names; fall back to the admission uid, released on timeout
+        metadata = request.object.metadata
+        if metadata is not None and metadata.name:
+            return metadata.name
+        return request.uid
\ No newline at end of file
@@ -1,104 +1,203 @@
 from dataclasses import dataclass
 import json
-from typing import List, Optional
+from typing import Hashable, List, Optional
 
 from dataclasses_json import dataclass_json
-from dsmlp.plugin.awsed import AwsedClient, UnsuccessfulRequest
+from dsmlp.plugin.awsed import AwsedClient, ListTeamsResponse, UnsuccessfulRequest
 from dsmlp.plugin.console import Console
 from dsmlp.plugin.course import ConfigProvider
 from dsmlp.plugin.kube import KubeClient, NotFound
 import jsonify
 
 from dsmlp.plugin.logger import Logger
+from dsmlp.app.context import AdmissionContext
+from dsmlp.app.metrics import LOOKUPS_AVOIDED
+from dsmlp.app.policy import PolicyCache, UserPolicy
 from dsmlp.app.types import *
+from dsmlp.ext.cache import TTLCache
+
+
+def id_fingerprint(request: Request) -> Hashable:
+    """
+    The fields of a pod IDValidator inspects, so pods of the same namespace with the same
+    fingerprint get the same ID decision. Names, images and the like are left out.
+    """
+    spec = request.object.spec
+    labels = request.object.metadata.labels if request.object.metadata is not None else None
+    pod_context = spec.securityContext
+    if pod_context is not None:
+        pod_context = (pod_context.runAsUser, pod_context.runAsGroup, pod_context.fsGroup,
+                       tuple(pod_context.supplementalGroups) if pod_context.supplementalGroups is not None else None)
+
+    def containers(containers: Optional[List[Container]]):
+        if containers is None:
+            return None
+        return tuple((c.securityContext.runAsUser, c.securityContext.runAsGroup)
+                     if c.securityContext is not None else None for c in containers)
+
+    return (request.namespace,
+            labels.get('dsmlp/course') if labels is not None else None,
+            pod_context,
+            containers(spec.containers),
+            containers(spec.initContainers))
+
+
+def sets_group(spec: PodSpec) -> bool:
+    """Whether any gid is set on the pod or its containers, so the user's teams must be known"""
+    pod_context = spec.securityContext
+    if pod_context is not None and (pod_context.runAsGroup is not None or pod_context.fsGroup is not None
+                                    or pod_context.supplementalGroups):
+        return True
+
+    for containers in (spec.containers, spec.initContainers):
+        for container in containers or ():
+            if container.securityContext is not None and container.securityContext.runAsGroup is not None:
+                return True
+    return False
+
+
+# Name of a decision taken from the decision cache in AdmissionContext.cached: the denial, or None
+CACHED_DECISION = 'id_decision'
+
+NOT_CACHED = object()
+
+# Stands in for the teams of a user whose pod sets no gids; no gid is ever checked against it
+NO_TEAMS = ListTeamsResponse(teams=[])
 
 
 class IDValidator(ComponentValidator):
 
-    def __init__(self, awsed: AwsedClient, logger: Logger) -> None:
+    def __init__(self, awsed: AwsedClient, logger: Logger, decision_cache: TTLCache = None) -> None:
+        """
+        With a decision cache, the decision for a pod is reused for pods whose id_fingerprint
+        matches, without looking up the user again. Denials are cached as well.
+        """
         self.awsed = awsed
         self.logger = logger
-
-    def validate_pod(self, request: Request):
+        self.decision_cache = decision_cache
+        self.policies = PolicyCache()
+
+    def required_lookups(self, request: Request, context: AdmissionContext = None) -> Optional[Iterable[str]]:
+        if self.decision_cache is not None:
+            if context is None:
+                if id_fingerprint(request) in self.decision_cache:
+                    return ()
+            else:
+                # Decided once: the entry may expire before validate_pod, which then uses this
+                decision = self.decision_cache.peek(id_fingerprint(request), NOT_CACHED)
+                if decision is not NOT_CACHED:
+                    context.cached[CACHED_DECISION] = decision
+                    return ()
+        return ('user', 'teams') if sets_group(request.object.spec) else ('user',)
+
+    def validate_pod(self, request: Request, context: AdmissionContext = None):
         """
         Validate pods for namespaces with the 'k8s-sync' label
         """
+        if context is None:
+            context = AdmissionContext(request, self.awsed)
+
+        if self.decision_cache is None:
+            self.validate_identity(request, context)
+            return
+
+        if CACHED_DECISION in context.cached:
+            denial = context.cached[CACHED_DECISION]
+        else:
+            loaded = []
+
+            def load():
+                loaded.append(True)
+                return self.denial(request, context)
+
+            denial = self.decision_cache.get(id_fingerprint(request), load)
+            if not loaded:
+                # Cached, or loaded by a concurrent admission: no lookups were made for this one
+                context.cached[CACHED_DECISION] = denial
+        if CACHED_DECISION in context.cached:
+            LOOKUPS_AVOIDED.inc(('user',))
+            LOOKUPS_AVOIDED.inc(('teams',))
+        if denial is not None:
+            raise ValidationFailure(denial)
+
+    def denial(self, request: Request, context: AdmissionContext) -> Optional[str]:
+        try:
+            self.validate_identity(request, context)
+        except ValidationFailure as ex:
+            return ex.message
+        return None
+
+    def validate_identity(self, request: Request, context: AdmissionContext):
         username = request.namespace
 #        namespace = self.kube.get_namespace(request.namespace)
 
 #        if 'k8s-sync' in namespace.labels:
-        user = self.awsed.describe_user(username)
+        user = context.user()
         if not user:
             raise ValidationFailure(
                 f"namespace: no AWSEd user found with username {username}")
-        allowed_uid = user.uid
-        allowed_courses = user.enrollments
-
-        team_response = self.awsed.list_user_teams(username)
-        allowed_gids = [team.gid for team in team_response.teams]
-        allowed_gids.append(0)
-        allowed_gids.append(100)
 
         metadata = request.object.metadata
         spec = request.object.spec
 
+        if sets_group(spec):
+            teams = context.teams()
+        else:
+            teams = NO_TEAMS
+            LOOKUPS_AVOIDED.inc(('teams',))
+        policy = self.policies.get(user, teams)
+
         if metadata is not None and metadata.labels is not None:
-            self.validate_course_enrollment(allowed_courses, metadata.labels)
+            self.validate_course_enrollment(policy, metadata.labels)
 
-        self.validate_pod_security_context(
-            allowed_uid, allowed_gids, spec.securityContext)
-        self.validate_containers(allowed_uid, allowed_gids, spec)
+        self.validate_pod_security_context(policy, spec.securityContext)
+        self.validate_containers(policy, spec)
 
-    def validate_course_enrollment(self, allowed_courses: List[str], labels: Dict[str, str]):
+    def validate_course_enrollment(self, policy: UserPolicy, labels: Dict[str, str]):
         if not 'dsmlp/course' in labels:
             return
-        if not labels['dsmlp/course'] in allowed_courses:
+        if not labels['dsmlp/course'] in policy.enrollments:
             raise ValidationFailure(
-                f"metadata.labels: dsmlp/course must be in range {allowed_courses}")
+                f"metadata.labels: dsmlp/course must be in range {policy.enrollments_message}")
 
     def validate_pod_security_context(
             self,
-            authorized_uid: int,
-            allowed_teams: List[int],
+            policy: UserPolicy,
             securityContext: PodSecurityContext):
 
         if securityContext is None:
             return
 
-        if securityContext.runAsUser is not None and authorized_uid != securityContext.runAsUser:
+        if securityContext.runAsUser is not None and policy.uid != securityContext.runAsUser:
             raise ValidationFailure(
-                f"spec.securityContext: uid must be in range [{authorized_uid}]")
+                f"spec.securityContext: uid must be in range [{policy.uid}]")
 
-        if securityContext.runAsGroup is not None and securityContext.runAsGroup not in allowed_teams:
+        if securityContext.runAsGroup is not None and securityContext.runAsGroup not in policy.gids:
             raise ValidationFailure(
-                f"spec.securityContext: gid must be in range {allowed_teams}")
+                f"spec.securityContext: gid must be in range {policy.gids_message}")
 
-        if securityContext.fsGroup is not None and securityContext.fsGroup not in allowed_teams:
+        if securityContext.fsGroup is not None and securityContext.fsGroup not in policy.gids:
             raise ValidationFailure(
-                f"spec.securityContext: gid must be in range {allowed_teams}")
+                f"spec.securityContext: gid must be in range {policy.gids_message}")
 
         if securityContext.supplementalGroups is not None:
-            for sgroup in securityContext.supplementalGroups:
-                if not sgroup in allowed_teams:
-                    raise ValidationFailure(
-                        f"spec.securityContext: gid must be in range {allowed_teams}")
+            if not policy.gids.issuperset(securityContext.supplementalGroups):
+                raise ValidationFailure(
+                    f"spec.securityContext: gid must be in range {policy.gids_message}")
 
     def validate_containers(
             self,
-            authorized_uid: int,
-            allowed_teams: List[int],
+            policy: UserPolicy,
             spec: PodSpec
     ):
         """
         Validate the security context of containers and initContainers
         """
-        self.validate_security_contexts(
-            authorized_uid, allowed_teams, spec.containers, "containers")
-        self.validate_security_contexts(
-            authorized_uid, allowed_teams, spec.initContainers, "initContainers")
+        self.validate_security_contexts(policy, spec.containers, "containers")
+        self.validate_security_contexts(policy, spec.initContainers, "initContainers")
 
     def validate_security_contexts(
-            self, authorized_uid: int, allowed_teams: List[int],
+            self, policy: UserPolicy,
             containers: List[Container],
             context: str):
         """
@@ -113,23 +212,21 @@ class IDValidator(ComponentValidator):
             if securityContext is None:
                 continue
 
-            self.validate_security_context(
-                authorized_uid, allowed_teams, securityContext, f"{context}[{i}]")
+            self.validate_security_context(policy, securityContext, f"{context}[{i}]")
 
     def validate_security_context(
             self,
-            authorized_uid: int,
-            allowed_teams: List[int],
+            policy: UserPolicy,
             securityContext: SecurityContext,
             context: str):
 
-        if securityContext.runAsUser is not None and authorized_uid != securityContext.runAsUser:
+        if securityContext.runAsUser is not None and policy.uid != securityContext.runAsUser:
             raise ValidationFailure(
-                f"spec.{context}.securityContext: uid must be in range [{authorized_uid}]")
+                f"spec.{context}.securityContext: uid must be in range [{policy.uid}]")
 
-        if securityContext.runAsGroup is not None and securityContext.runAsGroup not in allowed_teams:
+        if securityContext.runAsGroup is not None and securityContext.runAsGroup not in policy.gids:
             raise ValidationFailure(
-                f"spec.{context}.securityContext: gid must be in range {allowed_teams}")
+                f"spec.{context}.securityContext: gid must be in range {policy.gids_message}")
 
     def admission_response(self, uid, allowed, message):
         return {
@@ -0,0 +1,262 @@
+"""
+In-process metrics exposed in the Prometheus text format at /metrics.
+
+Counters and histograms are aggregated per thread: each thread only ever writes its own shard,
+so recording takes no lock. Shards are summed when metrics are scraped, and the shards of
+threads that have exited are folded into a retired total, so thread churn does not grow them.
+"""
+import bisect
+import threading
+from copy import copy
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+Labels = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List['Metric'] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: 'Metric') -> None:
+        with self._lock:
+            self._metrics.append(metric)
+
+    def unregister(self, metric: 'Metric') -> None:
+        with self._lock:
+            self._metrics.remove(metric)
+
+    def expose(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def format_labels(labelnames: Sequence[str], labels: Labels, extra: str = None) -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(labelnames, labels)]
+    if extra is not None:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional[Registry] = REGISTRY) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: List[Tuple[threading.Thread, dict]] = []
+        # Totals of the shards of exited threads, only written under the lock
+        self._retired: dict = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError()
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = {}
+            with self._lock:
+                self._retire()
+                self._shards.append((threading.current_thread(), shard))
+            self._local.shard = shard
+            return shard
+
+    def _retire(self) -> None:
+        """Fold the shards of exited threads into the retired totals; called with the lock held"""
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                self._merge(self._retired, shard.items())
+        self._shards = live
+
+    def _merge(self, totals: dict, items: Iterable[tuple]) -> None:
+        raise NotImplementedError()
+
+    def _collect(self) -> List[List[tuple]]:
+        with self._lock:
+            self._retire()
+            shards = [shard for _, shard in self._shards]
+            # Copying a dict is atomic under the GIL, so this never sees a shard mid-resize
+            collected = [list(shard.items()) for shard in shards]
+            collected.append([(labels, copy(value)) for labels, value in self._retired.items()])
+        return collected
+
+    def _totals(self) -> dict:
+        totals: dict = {}
+        for items in self._collect():
+            self._merge(totals, items)
+        return totals
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, labels: Labels = (), amount: float = 1) -> None:
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _merge(self, totals: Dict[Labels, float], items: Iterable[Tuple[Labels, float]]) -> None:
+        for labels, value in items:
+            totals[labels] = totals.get(labels, 0) + value
+
+    def values(self) -> Dict[Labels, float]:
+        return self._totals()
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in sorted(self.values().items()):
+            yield f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}"
+
+
+class Gauge(Counter):
+    """A gauge moved with inc/dec, e.g. requests in flight"""
+    type = 'gauge'
+
+    def dec(self, labels: Labels = (), amount: float = 1) -> None:
+        self.inc(labels, -amount)
+
+
+class GaugeFunc(Metric):
+    """A gauge whose values are read from a callback at scrape time"""
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str],
+                 func: Callable[[], Dict[Labels, Optional[float]]], registry: Optional[Registry] = REGISTRY) -> None:
+        super().__init__(name, documentation, labelnames, registry)
+        self.func = func
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in sorted(self.func().items()):
+            if value is not None:
+                yield f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}"
+
+
+class CounterFunc(GaugeFunc):
+    """A counter whose values are read from a callback at scrape time"""
+    type = 'counter'
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Optional[Registry] = REGISTRY) -> None:
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, labels: Labels = ()) -> None:
+        shard = self._shard()
+        counts = shard.get(labels)
+        if counts is None:
+            # One slot per bucket, one for +Inf, then the sum
+            counts = shard[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def _merge(self, totals: Dict[Labels, List[float]], items: Iterable[Tuple[Labels, List[float]]]) -> None:
+        for labels, counts in items:
+            total = totals.setdefault(labels, [0] * len(counts))
+            for i, count in enumerate(list(counts)):
+                total[i] += count
+
+    def values(self) -> Dict[Labels, List[float]]:
+        return self._totals()
+
+    def samples(self) -> Iterable[str]:
+        for labels, counts in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="%s"' % ('+Inf' if bound == float('inf') else format_value(bound))
+                yield f"{self.name}_bucket{format_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labelnames, labels)} {format_value(counts[-1])}"
+            yield f"{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}"
+
+
+STAGE_SECONDS = Histogram(
+    'dsmlp_stage_seconds', "Time spent in each stage of an admission", ['stage'])
+DEPENDENCY_SECONDS = Histogram(
+    'dsmlp_dependency_seconds', "Latency of AWSEd and Kubernetes lookups", ['dependency', 'method', 'outcome'])
+ADMISSIONS = Counter(
+    'dsmlp_admissions_total', "Admission decisions", ['decision', 'reason'])
+IN_FLIGHT = Gauge(
+    'dsmlp_admissions_in_flight', "Admissions currently being validated")
+LOOKUPS_AVOIDED = Counter(
+    'dsmlp_lookups_avoided_total', "Lookups a validator did not need for a pod", ['lookup'])
+
+
+CACHES: Dict[str, object] = {}
+
+
+def register_cache(name: str, cache) -> None:
+    """
+    Expose the counters of a cache. Any of hits, misses, stale_hits, refreshes, evictions and
+    sync_errors present on the cache are reported, as well as its size and, for caches synced
+    in the background, age() and lag().
+    """
+    CACHES[name] = cache
+
+
+def cache_values(attribute: str) -> Callable[[], Dict[Labels, Optional[float]]]:
+    return lambda: {(name,): getattr(cache, attribute) for name, cache in list(CACHES.items())
+                    if hasattr(cache, attribute)}
+
+
+for _attribute in ('hits', 'misses', 'stale_hits', 'refreshes', 'evictions', 'sync_errors'):
+    CounterFunc(f'dsmlp_cache_{_attribute}_total', f"Cache {_attribute.replace('_', ' ')}", ['cache'],
+                cache_values(_attribute))
+GaugeFunc('dsmlp_cache_entries', "Entries held by each cache", ['cache'],
+          lambda: {(name,): len(cache) for name, cache in list(CACHES.items()) if hasattr(cache, '__len__')})
+GaugeFunc('dsmlp_cache_age_seconds', "Seconds since a watch cache was last confirmed against the API server",
+          ['cache'], lambda: {(name,): cache.age() for name, cache in list(CACHES.items()) if hasattr(cache, 'age')})
+GaugeFunc('dsmlp_cache_lag_seconds', "Seconds since the least recently synced entry of a replica was fetched",
+          ['cache'], lambda: {(name,): cache.lag() for name, cache in list(CACHES.items()) if hasattr(cache, 'lag')})
+
+
+GUARDS: Dict[str, object] = {}
+BREAKER_STATES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+
+def register_guard(dependency: str, guard) -> None:
+    """Expose the circuit breaker state, rejections, timeouts and saturations of a dependency Guard"""
+    GUARDS[dependency] = guard
+
+
+GaugeFunc('dsmlp_breaker_state', "Circuit breaker state per dependency (0 closed, 1 half open, 2 open)",
+          ['dependency'], lambda: {(name,): BREAKER_STATES[guard.breaker.state] for name, guard in list(GUARDS.items())})
+CounterFunc('dsmlp_breaker_opens_total', "Times the circuit breaker of a dependency opened", ['dependency'],
+            lambda: {(name,): guard.breaker.opens for name, guard in list(GUARDS.items())})
+CounterFunc('dsmlp_breaker_rejections_total', "Calls rejected by an open circuit breaker", ['dependency'],
+            lambda: {(name,): guard.breaker.rejections for name, guard in list(GUARDS.items())})
+CounterFunc('dsmlp_dependency_timeouts_total', "Dependency calls abandoned after their timeout", ['dependency'],
+            lambda: {(name,): guard.timeouts for name, guard in list(GUARDS.items())})
+CounterFunc('dsmlp_dependency_saturations_total', "Dependency calls refused because every worker was busy",
+            ['dependency'], lambda: {(name,): guard.saturations for name, guard in list(GUARDS.items())})
@@ -0,0 +1,66 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import FrozenSet, Tuple
+
+from dsmlp.plugin.awsed import ListTeamsResponse, UserResponse
+
+# Groups every user may run as, in addition to their teams
+DEFAULT_GIDS = (0, 100)
+
+
+@dataclass(frozen=True)
+class UserPolicy:
+    """
+    What a user's pods may run as, compiled once from their AWSEd data. The allowed ids are
+    kept as sets for membership checks and rendered once, in AWSEd order, for denial messages.
+    """
+    uid: int
+    gids: FrozenSet[int]
+    enrollments: FrozenSet[str]
+    gids_message: str
+    enrollments_message: str
+
+    @classmethod
+    def compile(cls, user: UserResponse, teams: ListTeamsResponse) -> 'UserPolicy':
+        gids = [team.gid for team in teams.teams]
+        gids.extend(DEFAULT_GIDS)
+        return cls(uid=user.uid, gids=frozenset(gids), enrollments=frozenset(user.enrollments),
+                   gids_message=str(gids), enrollments_message=str(user.enrollments))
+
+
+class PolicyCache:
+    """
+    Compiled policies keyed on the identity of the AWSEd responses they were compiled from.
+    While the AWSEd caches keep returning the same objects, the policy is reused; a reloaded
+    user or team list is a new object and gets a new policy.
+    """
+
+    def __init__(self, maxsize: int = 4096) -> None:
+        self.maxsize = maxsize
+        self._entries: 'OrderedDict[Tuple[int, int], Tuple[UserResponse, ListTeamsResponse, UserPolicy]]' = \
+            OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user: UserResponse, teams: ListTeamsResponse) -> UserPolicy:
+        key = (id(user), id(teams))
+        with self._lock:
+            entry = self._entries.get(key)
+            # The entry holds the responses, so their ids cannot be reused while it is cached
+            if entry is not None and entry[0] is user and entry[1] is teams:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+
+        policy = UserPolicy.compile(user, teams)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = (user, teams, policy)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return policy
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,87 @@
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+
+class NamespaceReservations:
+    def __init__(self) -> None:
+        # Held by admissions from reading usage to reserving
+        self.lock = threading.Lock()
+        # Guards `pods`; observers take only this one, so a listing made while an admission
+        # holds `lock` (e.g. on a lookup thread) can still release
+        self.pods_lock = threading.Lock()
+        # Pod name -> (GPUs, reserved at, expiry)
+        self.pods: Dict[str, Tuple[int, float, float]] = {}
+
+
+class GpuReservations:
+    """
+    GPUs of pods admitted by this process that may not be visible in the pod list yet.
+
+    GPUValidator adds the reserved GPUs of a namespace to its current usage and reserves the
+    GPUs of every pod it admits. It holds the namespace's lock from reading the usage to
+    reserving, so each admission counts the pods of the admissions before it, either in the
+    usage or as reservations. A reservation is released when the pod is observed in a pod list
+    started after the reservation was made, or in a watch, or after `timeout` seconds.
+
+    Times are read from `clock`; listings report their start on the same clock.
+    """
+
+    def __init__(self, timeout: float = 60, clock: Callable[[], float] = time.monotonic) -> None:
+        self.timeout = timeout
+        self.clock = clock
+        self._namespaces: Dict[str, NamespaceReservations] = {}
+        self._lock = threading.Lock()
+        self.reserved_total = 0
+        self.observed_total = 0
+        self.expired_total = 0
+
+    def namespace(self, namespace: str) -> NamespaceReservations:
+        reservations = self._namespaces.get(namespace)
+        if reservations is None:
+            with self._lock:
+                reservations = self._namespaces.setdefault(namespace, NamespaceReservations())
+        return reservations
+
+    def lock(self, namespace: str) -> threading.Lock:
+        return self.namespace(namespace).lock
+
+    def reserved(self, namespace: str) -> int:
+        """GPUs reserved in a namespace. The caller holds the namespace's lock."""
+        reservations = self.namespace(namespace)
+        now = self.clock()
+        with reservations.pods_lock:
+            expired = [pod for pod, (_, _, expires_at) in reservations.pods.items() if expires_at <= now]
+            for pod in expired:
+                del reservations.pods[pod]
+            self.expired_total += len(expired)
+            return sum(gpus for gpus, _, _ in reservations.pods.values())
+
+    def reserve(self, namespace: str, pod: str, gpus: int) -> None:
+        """Reserve GPUs for an admitted pod. The caller holds the namespace's lock."""
+        reservations = self.namespace(namespace)
+        now = self.clock()
+        with reservations.pods_lock:
+            reservations.pods[pod] = (gpus, now, now + self.timeout)
+        self.reserved_total += 1
+
+    def observe(self, namespace: str, pods: Iterable[str], listed_at: Optional[float] = None) -> None:
+        """
+        Release the reservations of pods visible in the namespace's pod list. A list started at
+        `listed_at` (default: now) releases only the reservations made before it started: an
+        older list may show an earlier pod of the same name, not the admitted one.
+        """
+        reservations = self._namespaces.get(namespace)
+        if reservations is None or not reservations.pods:
+            return
+
+        listed_at = listed_at if listed_at is not None else self.clock()
+        with reservations.pods_lock:
+            for pod in pods:
+                reservation = reservations.pods.get(pod)
+                if reservation is not None and reservation[1] <= listed_at:
+                    del reservations.pods[pod]
+                    self.observed_total += 1
+
+    def __len__(self) -> int:
+        return sum(len(reservations.pods) for reservations in list(self._namespaces.values()))
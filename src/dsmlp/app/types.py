@@ -1,6 +1,6 @@
 
 from dataclasses import dataclass
-from typing import List, Optional, Dict
+from typing import Iterable, List, Optional, Dict
 from dataclasses_json import dataclass_json
 from abc import ABCMeta, abstractmethod
 
@@ -47,6 +47,7 @@ class PodSpec:
 @dataclass
 class ObjectMeta:
     labels: Dict[str, str]
+    name: Optional[str] = None
 
 
 @dataclass_json
@@ -69,6 +70,8 @@ class Request:
     namespace: str
     object: Object
     userInfo: UserInfo
+    # Dry-run admissions are not persisted
+    dryRun: Optional[bool] = None
 
 
 @dataclass_json
@@ -79,9 +82,23 @@ class AdmissionReview:
 class ValidationFailure(Exception):
     def __init__(self, message: str) -> None:
         self.message = message
+        # Name of the component validator that denied the pod
+        self.validator: Optional[str] = None
         super().__init__(self.message)
         
 class ComponentValidator:
     @abstractmethod
-    def validate_pod(self, request: Request):
-        pass
\ No newline at end of file
+    def validate_pod(self, request: Request, context: 'AdmissionContext' = None):
+        """
+        Raise ValidationFailure if the pod must be denied. Remote lookups go through the
+        context so they are shared with the other validators of the same admission.
+        """
+        pass
+
+    def required_lookups(self, request: Request, context: 'AdmissionContext' = None) -> Optional[Iterable[str]]:
+        """
+        Names of the AdmissionContext lookups validate_pod will make for this request, so they
+        can be prefetched. None if unknown. Anything decided here that validate_pod relies on
+        is kept on the context, if given.
+        """
+        return None
@@ -1,6 +1,10 @@
+import asyncio
+from concurrent.futures import Executor
 from dataclasses import dataclass
+import itertools
 import json
-from typing import Dict, List, Optional
+import time
+from typing import Dict, Iterable, List, Optional
 
 from dataclasses_json import dataclass_json
 from dsmlp.plugin.awsed import AwsedClient, UnsuccessfulRequest
@@ -9,50 +13,186 @@ from dsmlp.plugin.course import ConfigProvider
 from dsmlp.plugin.kube import KubeClient, NotFound
 import jsonify
 
-from dsmlp.plugin.logger import Logger
+from dsmlp.ext.cache import TTLCache
+from dsmlp.plugin.decision_log import DecisionLog
+from dsmlp.plugin.errors import DependencyUnavailable
+from dsmlp.plugin.logger import LazyJson, Logger
 from abc import ABCMeta, abstractmethod
 from dsmlp.app.id_validator import IDValidator
 from dsmlp.app.gpu_validator import GPUValidator
+from dsmlp.app.codec import decode_review, encode_response
+from dsmlp.app.context import LOOKUPS, AdmissionContext, AsyncAdmissionContext, LookupMemo
+from dsmlp.app.reservations import GpuReservations
+from dsmlp.app.metrics import ADMISSIONS, IN_FLIGHT, STAGE_SECONDS
+from dsmlp.plugin.awsed import AsyncAwsedClient
+from dsmlp.plugin.kube import AsyncKubeClient
 from dsmlp.app.types import *
 
+
+# What to do when a dependency is unavailable and no cached answer is left
+DEGRADED_POLICIES = ('cache', 'allow', 'deny')
+
+
+class RequestDumpSampler:
+    """
+    Decides which requests are dumped in full at DEBUG: every denied request, and one in
+    `every` allowed requests (none if `every` is 0).
+    """
+
+    def __init__(self, every: int = 100) -> None:
+        self.every = every
+        self._counter = itertools.count()
+
+    def should_dump(self, allowed: bool) -> bool:
+        if not allowed:
+            return True
+        return self.every > 0 and next(self._counter) % self.every == 0
+
+
 class Validator:
-    def __init__(self, awsed: AwsedClient, kube: KubeClient, logger: Logger) -> None:
+    def __init__(self, awsed: AwsedClient, kube: KubeClient, logger: Logger, executor: Executor = None,
+                 dump_sampler: RequestDumpSampler = None, decision_log: DecisionLog = None,
+                 id_decision_cache: TTLCache = None, degraded_policies: Dict[str, str] = None,
+                 gpu_reservations: GpuReservations = None) -> None:
+        """
+        If an executor is given, the remote lookups of each request are made concurrently on it
+        before the component validators run. If a decision log is given, every decision is
+        appended to it. The ID decision cache is passed to IDValidator and the GPU reservations
+        to GPUValidator.
+
+        `degraded_policies` maps 'awsed' and 'kube' to what happens when a validator cannot
+        reach that dependency: with 'allow' the validator is skipped, with 'cache' or 'deny' the
+        pod is denied. ('cache' and 'deny' differ in whether stale cached answers are served
+        first, which is configured on the clients.)
+        """
         self.awsed = awsed
+        self.kube = kube
         self.logger = logger
-        self.component_validators = [IDValidator(awsed, logger), GPUValidator(awsed, kube, logger)]
+        self.executor = executor
+        self.dump_sampler = dump_sampler if dump_sampler is not None else RequestDumpSampler()
+        self.decision_log = decision_log
+        self.degraded_policies = degraded_policies if degraded_policies is not None else {}
+        self.gpu_validator = GPUValidator(awsed, kube, logger, gpu_reservations)
+        self.component_validators = [IDValidator(awsed, logger, id_decision_cache), self.gpu_validator]
+
+    def validate_request(self, admission_review_json, memo: LookupMemo = None, dry_run: bool = False):
+        """
+        Validate a decoded AdmissionReview. Requests given the same memo share their lookups.
+        The decision of a dry run is not counted in ADMISSIONS, logged or recorded, and
+        reserves no GPUs.
+        """
+        IN_FLIGHT.inc()
+        try:
+            start = time.perf_counter()
+            review: AdmissionReview = decode_review(admission_review_json)
+            context = self.create_context(review.request, memo)
+            context.dry_run = dry_run
+            self.record_stage(context, 'decode', time.perf_counter() - start)
+
+            response = self.review_request(review, context)
+            self.record_stage(context, 'total', time.perf_counter() - start)
+        finally:
+            IN_FLIGHT.dec()
+
+        self.dump_request(admission_review_json, response)
+        self.log_decision(admission_review_json, response, context)
+        return response
+
+    def record_stage(self, context: AdmissionContext, stage: str, seconds: float):
+        context.timings[stage] = seconds
+        STAGE_SECONDS.observe(seconds, (stage,))
+
+    def dump_request(self, admission_review_json, response):
+        if self.logger.is_debug_enabled() and self.dump_sampler.should_dump(response['response']['allowed']):
+            self.logger.debug("request", uid=response['response']['uid'], body=LazyJson(admission_review_json))
+
+    def log_decision(self, admission_review_json, response, context: AdmissionContext):
+        if self.decision_log is not None and not context.dry_run:
+            self.decision_log.record(admission_review_json, response, context.timings, context.results())
+
+    def validate_request_body(self, body: bytes) -> bytes:
+        """
+        Validate a raw AdmissionReview and return the encoded response
+        """
+        response = self.validate_request(json.loads(body))
 
-    def validate_request(self, admission_review_json):
-        self.logger.debug("request=" + json.dumps(admission_review_json, indent=2))
-        review: AdmissionReview = AdmissionReview.from_dict(admission_review_json)
+        start = time.perf_counter()
+        encoded = encode_response(response)
+        STAGE_SECONDS.observe(time.perf_counter() - start, ('encode',))
+        return encoded
 
+    def review_request(self, review: AdmissionReview, context: AdmissionContext):
         try:
-            return self.handle_request(review.request)
+            return self.handle_request(review.request, context)
+        except DependencyUnavailable as ex:
+            return self.degraded_response(review.request, ex, context)
         except Exception as ex:
             self.logger.exception(ex)
-            self.logger.info(
-                f"Denied request username={review.request.userInfo.username} namespace={review.request.namespace} reason=Error uid={review.request.uid}")
+            self.report_decision(review.request, context, ('error', type(ex).__name__), reason="Error")
 
             return self.admission_response(review.request.uid, False, f"Error")
 
-    def handle_request(self, request: Request):
-        self.logger.info(
-            f"Validating request username={request.userInfo.username} namespace={request.namespace} uid={request.uid}")
+    def degraded_response(self, request: Request, ex: DependencyUnavailable, context: AdmissionContext = None):
+        self.report_decision(request, context, ('denied', f"{ex.dependency}-unavailable"), reason=str(ex))
+        return self.admission_response(request.uid, False, f"{ex.dependency} is unavailable, try again later")
+
+    def handle_request(self, request: Request, context: AdmissionContext = None):
+        self.logger.info("Validating request", username=request.userInfo.username,
+                         namespace=request.namespace, uid=request.uid)
+        if context is None:
+            context = self.create_context(request)
 
         try:
-            self.validate_pod(request)
+            self.validate_pod(request, context)
         except ValidationFailure as ex:
-            self.logger.info(
-                f"Denied request username={request.userInfo.username} namespace={request.namespace} reason={ex.message} uid={request.uid}")
+            self.report_decision(request, context, ('denied', ex.validator or ''), reason=ex.message)
 
             return self.admission_response(request.uid, False, f"{ex.message}")
 
-        self.logger.info(
-            f"Allowed request username={request.userInfo.username} namespace={request.namespace} uid={request.uid}")
+        self.report_decision(request, context, ('allowed', 'degraded' if context.skipped else ''))
         return self.admission_response(request.uid, True, "Allowed")
 
-    def validate_pod(self, request: Request):
+    def report_decision(self, request: Request, context: Optional[AdmissionContext], labels, **fields):
+        """Log a decision and count it in ADMISSIONS by (decision, reason), unless it is a dry run"""
+        if context is not None and context.dry_run:
+            return
+        self.logger.info("Allowed request" if labels[0] == 'allowed' else "Denied request",
+                         username=request.userInfo.username, namespace=request.namespace, **fields, uid=request.uid)
+        ADMISSIONS.inc(labels)
+
+    def validate_pod(self, request: Request, context: AdmissionContext = None):
+        if context is None:
+            context = self.create_context(request)
+        context.prefetch(self.required_lookups(request, context))
+
+        for component_validator in self.component_validators:
+            name = type(component_validator).__name__
+            start = time.perf_counter()
+            try:
+                component_validator.validate_pod(request, context)
+            except ValidationFailure as ex:
+                ex.validator = name
+                raise
+            except DependencyUnavailable as ex:
+                if self.degraded_policies.get(ex.dependency, 'cache') != 'allow':
+                    raise
+                self.logger.info("Skipped validator", validator=name, reason=str(ex), uid=request.uid)
+                context.skipped.append(name)
+            finally:
+                self.record_stage(context, name, time.perf_counter() - start)
+
+    def required_lookups(self, request: Request, context: AdmissionContext = None) -> Iterable[str]:
+        names = set()
         for component_validator in self.component_validators:
-            component_validator.validate_pod(request)
+            required = component_validator.required_lookups(request, context)
+            if required is None:
+                return LOOKUPS
+            names.update(required)
+
+        return [name for name in LOOKUPS if name in names]
+
+    def create_context(self, request: Request, memo: LookupMemo = None) -> AdmissionContext:
+        return AdmissionContext(request, self.awsed, self.kube, self.executor, memo)
 
     def admission_response(self, uid, allowed, message):
         return {
@@ -65,4 +205,49 @@ class Validator:
                     "message": message
                 }
             }
-        }
\ No newline at end of file
+        }
+
+
+class AsyncValidator(Validator):
+    """
+    Validator for the asyncio entry point. All lookups of a request are awaited concurrently,
+    then the component validators run against the results.
+
+    With GPU reservations, the GPUs in use are looked up last, and the admissions of a namespace
+    take turns from that lookup to their reservation, as GPUValidator requires.
+    """
+
+    def __init__(self, awsed: AsyncAwsedClient, kube: AsyncKubeClient, logger: Logger,
+                 decision_log: DecisionLog = None, degraded_policies: Dict[str, str] = None,
+                 gpu_reservations: GpuReservations = None, id_decision_cache: TTLCache = None) -> None:
+        super().__init__(None, None, logger, decision_log=decision_log, id_decision_cache=id_decision_cache,
+                         degraded_policies=degraded_policies, gpu_reservations=gpu_reservations)
+        self.async_awsed = awsed
+        self.async_kube = kube
+        self._namespace_locks: Dict[str, asyncio.Lock] = {}
+
+    async def validate_request(self, admission_review_json, memo: LookupMemo = None, dry_run: bool = False):
+        IN_FLIGHT.inc()
+        try:
+            start = time.perf_counter()
+            review: AdmissionReview = decode_review(admission_review_json)
+            context = AsyncAdmissionContext(review.request, self.async_awsed, self.async_kube, memo)
+            context.dry_run = dry_run
+            self.record_stage(context, 'decode', time.perf_counter() - start)
+
+            lookups_start = time.perf_counter()
+            await context.resolve(self.required_lookups(review.request, context))
+            self.record_stage(context, 'lookups', time.perf_counter() - lookups_start)
+            if self.gpu_validator.reservations is not None and not self.gpu_validator.is_exempt(review.request):
+                async with self._namespace_locks.setdefault(review.request.namespace, asyncio.Lock()):
+                    await context.resolve(('gpus_in_namespace',))
+                    response = self.review_request(review, context)
+            else:
+                response = self.review_request(review, context)
+            self.record_stage(context, 'total', time.perf_counter() - start)
+        finally:
+            IN_FLIGHT.dec()
+
+        self.dump_request(admission_review_json, response)
+        self.log_decision(admission_review_json, response, context)
+        return response
@@ -0,0 +1,105 @@
+import io
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from dsmlp.app import factory
+from dsmlp.app.batch import async_validate_batch, encode_line, parse_reviews
+from dsmlp.app.codec import encode_response
+from dsmlp.app.metrics import REGISTRY
+from dsmlp.app.validator import AsyncValidator, RequestDumpSampler
+from dsmlp.ext.aio import ExecutorAwsedClient, ExecutorKubeClient
+from dsmlp.ext.logger import PythonLogger
+
+
+def create_app(validator: AsyncValidator = None, batch_validator: AsyncValidator = None):
+    """
+    ASGI entry point. Serve with an ASGI server, e.g.
+
+        uvicorn --factory dsmlp.asgi:create_app --host 0.0.0.0 --port 8080
+    """
+    logging.getLogger('dsmlp').setLevel(logging.DEBUG)
+
+    if validator is None:
+        executor = ThreadPoolExecutor(
+            max_workers=int(os.environ.get('ASYNC_LOOKUP_WORKERS', 64)), thread_name_prefix="lookup")
+        validator = AsyncValidator(
+            ExecutorAwsedClient(factory.awsed_client, executor),
+            ExecutorKubeClient(factory.kube_client, executor),
+            PythonLogger(None, background=True),
+            factory.decision_log,
+            factory.degraded_policies,
+            factory.gpu_reservations,
+            factory.id_decision_cache)
+        validator.dump_sampler = RequestDumpSampler(int(os.getenv('LOG_REQUEST_SAMPLE_RATE', 100)))
+        if batch_validator is None:
+            # Batches are dry runs: their decisions are not logged and reserve no GPUs
+            batch_validator = AsyncValidator(validator.async_awsed, validator.async_kube, validator.logger,
+                                             degraded_policies=factory.degraded_policies)
+            batch_validator.dump_sampler = validator.dump_sampler
+    if batch_validator is None:
+        batch_validator = validator
+    batch_window = int(os.environ.get('BATCH_VALIDATION_WINDOW', 64))
+
+    async def app(scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await lifespan(receive, send)
+            return
+
+        method, path = scope['method'], scope['path']
+        if path == '/validate' and method == 'POST':
+            body = await read_body(receive)
+            response = await validator.validate_request(json.loads(body))
+            await respond(send, 200, encode_response(response), b'application/json')
+        elif path == '/validate/batch' and method == 'POST':
+            body = await read_body(receive)
+            try:
+                reviews = parse_reviews(io.BytesIO(body))
+            except ValueError as ex:
+                await respond(send, 400, f"Invalid JSON array: {ex}".encode(), b'text/plain')
+                return
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [(b'content-type', b'application/x-ndjson')],
+            })
+            async for result in async_validate_batch(batch_validator, reviews, batch_window):
+                await send({'type': 'http.response.body', 'body': encode_line(result), 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        elif path == '/healthz' and method == 'GET':
+            await respond(send, 200, b'OK', b'text/plain')
+        elif path == '/metrics' and method == 'GET':
+            await respond(send, 200, REGISTRY.expose().encode(), b'text/plain; version=0.0.4')
+        else:
+            await respond(send, 404, b'Not Found', b'text/plain')
+
+    return app
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+async def respond(send, status: int, body: bytes, content_type: bytes):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type), (b'content-length', str(len(body)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
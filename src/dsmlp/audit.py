@@ -0,0 +1,263 @@
+"""
+Audits the pods running on the cluster against the admission policy and reports those that
+would be denied if they were created now, e.g. after a team change or a quota reduction.
+
+    dsmlp-audit                                   # pods of k8s-sync namespaces
+    dsmlp-audit --page-size 1000 --workers 16 > violations.ndjson
+    dsmlp-audit --namespace-selector ''           # every namespace
+
+Violations are written to stdout as they are found, one JSON object per line, and a summary
+to stderr. The exit status is 1 if any pod violates the policy.
+
+Pods that have not terminated are listed across all namespaces a page at a time. The API
+server returns them ordered by namespace, so each namespace is evaluated as soon as its last
+pod is read, on a pool of workers. The lookups a page needs are started as the page is read,
+so AWSEd is queried in bulk ahead of evaluation. Only the pods of the namespaces being
+evaluated are held, so memory stays bounded however many pods the cluster runs.
+
+IDValidator checks every pod. For GPUValidator, pods are replayed in creation order as
+admissions: a pod is reported if it would exceed the quota given the GPUs of the pods created
+before it, less those of the pods already reported.
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from kubernetes.client import CoreV1Api, V1Pod
+from kubernetes.client.rest import ApiException
+
+from dsmlp.app.codec import decode_object
+from dsmlp.app.config import TERMINAL_POD_PHASES
+from dsmlp.app.context import AdmissionContext, LookupMemo
+from dsmlp.app.gpu_validator import GPUValidator
+from dsmlp.app.id_validator import IDValidator
+from dsmlp.app.types import Request, UserInfo, ValidationFailure
+from dsmlp.plugin.awsed import AwsedClient
+from dsmlp.plugin.kube import KubeClient
+from dsmlp.plugin.logger import Logger
+
+logger = logging.getLogger(__name__)
+
+NON_TERMINAL_PODS = ','.join(f'status.phase!={phase}' for phase in TERMINAL_POD_PHASES)
+
+
+@dataclass(frozen=True)
+class ListedPod:
+    request: Request
+    # RFC 3339, so ordered as strings
+    created: str
+
+
+def list_pods(api: CoreV1Api, page_size: int = 500, field_selector: str = NON_TERMINAL_PODS) -> Iterator[List[V1Pod]]:
+    """Pages of pods across all namespaces, following continue tokens"""
+    token = None
+    while True:
+        try:
+            page = api.list_pod_for_all_namespaces(limit=page_size, _continue=token, field_selector=field_selector)
+        except ApiException as ex:
+            token = inconsistent_continue(ex)
+            if token is None:
+                raise
+            # The list outlived its snapshot: go on from the current state, as kubectl does
+            logger.warning("Pod list expired, continuing from a newer snapshot")
+            continue
+
+        yield page.items
+        token = page.metadata._continue
+        if not token:
+            return
+
+
+def inconsistent_continue(ex: ApiException) -> Optional[str]:
+    """The token to continue an expired list with (410 Gone), if the API server offered one"""
+    if ex.status != 410 or not ex.body:
+        return None
+    try:
+        return json.loads(ex.body)['metadata'].get('continue') or None
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+def to_listed_pod(pod: V1Pod, serialize) -> ListedPod:
+    """`serialize` turns the model into its JSON form, e.g. ApiClient.sanitize_for_serialization"""
+    data = serialize(pod)
+    metadata = data['metadata']
+    namespace = metadata['namespace']
+    obj = decode_object({'metadata': {'labels': metadata.get('labels') or {}, 'name': metadata.get('name')},
+                         'spec': data['spec']})
+    # The pod's owner is unknown once it runs; the validators identify the user by namespace anyway
+    request = Request(uid=metadata.get('uid'), namespace=namespace, object=obj, userInfo=UserInfo(username=namespace))
+    return ListedPod(request=request, created=metadata.get('creationTimestamp') or '')
+
+
+class PodAuditor:
+    """
+    Evaluates the pods of a namespace with the admission validators. Lookups are shared by
+    the pods of a namespace, and started on `lookup_executor` by `prefetch`.
+    """
+
+    def __init__(self, awsed: AwsedClient, kube: KubeClient, logger: Logger,
+                 lookup_executor: Optional[Executor] = None) -> None:
+        self.awsed = awsed
+        self.kube = kube
+        self.lookup_executor = lookup_executor
+        self.id_validator = IDValidator(awsed, logger)
+        self.gpu_validator = GPUValidator(awsed, kube, logger)
+        # Added by the reading thread, removed once the namespace is evaluated
+        self.memos: Dict[str, LookupMemo] = {}
+
+    def required_lookups(self, request: Request) -> List[str]:
+        names = list(self.id_validator.required_lookups(request))
+        if not self.gpu_validator.is_exempt(request):
+            # GPUs in use are counted from the listed pods, not looked up
+            names.extend(('namespace', 'gpu_quota'))
+        return names
+
+    def prefetch(self, pods: Iterable[ListedPod]) -> None:
+        for pod in pods:
+            memo = self.memos.setdefault(pod.request.namespace, LookupMemo())
+            context = AdmissionContext(pod.request, self.awsed, self.kube, self.lookup_executor, memo)
+            context.prefetch(self.required_lookups(pod.request))
+
+    def audit_namespace(self, namespace: str, pods: List[ListedPod]) -> List[Dict[str, Any]]:
+        memo = self.memos.pop(namespace, None) or LookupMemo()
+        violations = []
+        for pod in pods:
+            context = AdmissionContext(pod.request, self.awsed, self.kube, memo=memo)
+            violation = self.check(pod, 'IDValidator', lambda: self.id_validator.validate_pod(pod.request, context))
+            if violation is not None:
+                violations.append(violation)
+
+        in_use = 0
+        quota = None
+        for pod in sorted(pods, key=lambda pod: pod.created):
+            gpus = self.gpu_validator.calculate_utilized_gpu(pod.request)
+            if self.gpu_validator.is_exempt(pod.request):
+                in_use += gpus
+                continue
+
+            def check_quota():
+                nonlocal quota
+                if quota is None:
+                    context = AdmissionContext(pod.request, self.awsed, self.kube, memo=memo)
+                    quota = self.gpu_validator.determine_gpu_quota(context.gpu_quota(), context.namespace().gpu_quota)
+                self.gpu_validator.check_quota(gpus, in_use, quota)
+
+            violation = self.check(pod, 'GPUValidator', check_quota)
+            if violation is not None:
+                violations.append(violation)
+            else:
+                in_use += gpus
+
+        return violations
+
+    def check(self, pod: ListedPod, validator: str, validate) -> Optional[Dict[str, Any]]:
+        violation = {'namespace': pod.request.namespace, 'pod': pod.request.object.metadata.name,
+                     'validator': validator}
+        try:
+            validate()
+        except ValidationFailure as ex:
+            violation['message'] = ex.message
+            return violation
+        except Exception as ex:
+            violation['error'] = repr(ex)
+            return violation
+        return None
+
+
+class Audit:
+    """Reads pages of pods and evaluates up to `window` namespaces at a time on `executor`"""
+
+    def __init__(self, auditor: PodAuditor, executor: Executor, window: int = 32,
+                 namespaces: Optional[Set[str]] = None) -> None:
+        """Only the pods of `namespaces` are evaluated, if given"""
+        self.auditor = auditor
+        self.executor = executor
+        self.window = window
+        self.namespaces = namespaces
+        self.pods = 0
+        self.namespaces_audited = 0
+
+    def run(self, pages: Iterable[List[ListedPod]]) -> Iterator[Dict[str, Any]]:
+        pending: Deque = deque()
+        for namespace, pods in self.group(pages):
+            self.namespaces_audited += 1
+            pending.append(self.executor.submit(self.auditor.audit_namespace, namespace, pods))
+            if len(pending) >= self.window:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+    def group(self, pages: Iterable[List[ListedPod]]) -> Iterator[Tuple[str, List[ListedPod]]]:
+        namespace, group = None, []
+        for page in pages:
+            if self.namespaces is not None:
+                page = [pod for pod in page if pod.request.namespace in self.namespaces]
+            self.pods += len(page)
+            self.auditor.prefetch(page)
+            for pod in page:
+                if pod.request.namespace != namespace:
+                    if group:
+                        yield namespace, group
+                    namespace, group = pod.request.namespace, []
+                group.append(pod)
+        if group:
+            yield namespace, group
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog='dsmlp-audit', description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--namespace-selector', default='k8s-sync',
+                        help="label selector of the namespaces to audit, '' for all (default: k8s-sync)")
+    parser.add_argument('--page-size', type=int, default=500, help="pods per list call (default: 500)")
+    parser.add_argument('--workers', type=int, default=8, help="namespaces evaluated at once (default: 8)")
+    parser.add_argument('--lookup-workers', type=int, default=16, help="concurrent lookups (default: 16)")
+    parser.add_argument('--window', type=int, default=32,
+                        help="namespaces read ahead of the one being reported (default: 32)")
+    args = parser.parse_args(argv)
+
+    # Imported here: dsmlp.app configures its clients from the environment on import
+    from dsmlp.app import factory
+    from dsmlp.ext.kube_api import KubeApiProvider
+    from dsmlp.ext.logger import PythonLogger
+
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+    api = KubeApiProvider(request_timeout=60).core_v1()
+    namespaces = None
+    if args.namespace_selector:
+        namespaces = {namespace.metadata.name
+                      for namespace in api.list_namespace(label_selector=args.namespace_selector).items}
+
+    lookup_executor = ThreadPoolExecutor(max_workers=args.lookup_workers, thread_name_prefix='audit-lookup')
+    executor = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix='audit')
+    auditor = PodAuditor(factory.awsed_client, factory.kube_client, PythonLogger(None), lookup_executor)
+    audit = Audit(auditor, executor, args.window, namespaces)
+    serialize = api.api_client.sanitize_for_serialization
+    pages = ([to_listed_pod(pod, serialize) for pod in page] for page in list_pods(api, args.page_size))
+
+    start = time.monotonic()
+    violations = errors = 0
+    try:
+        for violation in audit.run(pages):
+            violations += 'message' in violation
+            errors += 'error' in violation
+            sys.stdout.write(json.dumps(violation) + '\n')
+            sys.stdout.flush()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        lookup_executor.shutdown(wait=False, cancel_futures=True)
+
+    print(f"{audit.pods} pods in {audit.namespaces_audited} namespaces, {violations} violations, "
+          f"{errors} errors, {time.monotonic() - start:.1f} s", file=sys.stderr)
+    sys.exit(1 if violations or errors else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+"""
+End-to-end benchmark of Validator.validate_request against in-memory AWSEd and Kubernetes
+clients with injected latency.
+
+    dsmlp-bench                                # synthetic scenarios
+    dsmlp-bench --payload ref.json --latency-ms 2 --lookup-workers 5 --json > results.json
+
+Each scenario reports throughput and p50/p99/p999 latency. With --json the results are printed
+as one JSON document so runs from different releases can be compared.
+"""
+import argparse
+import copy
+import json
+import platform
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from os import path
+from typing import Any, Callable, Dict, List, Optional
+
+from dsmlp.app.validator import Validator
+from dsmlp.plugin.awsed import AwsedClient, ListTeamsResponse, TeamJson, UnsuccessfulRequest, UserResponse
+from dsmlp.plugin.kube import KubeClient, Namespace, NotFound
+from dsmlp.plugin.logger import Logger
+
+BENCH_UID = 10000
+BENCH_GID = 20000
+
+
+class LatentAwsedClient(AwsedClient):
+    """Answers from memory after sleeping `latency` seconds, like a remote AWSEd"""
+
+    def __init__(self, latency: float = 0) -> None:
+        self.latency = latency
+        self.users: Dict[str, UserResponse] = {}
+        self.teams: Dict[str, ListTeamsResponse] = {}
+        self.gpu_quotas: Dict[str, int] = {}
+
+    def describe_user(self, username: str) -> UserResponse:
+        self._wait()
+        return self.users.get(username)
+
+    def list_user_teams(self, username: str) -> ListTeamsResponse:
+        self._wait()
+        try:
+            return self.teams[username]
+        except KeyError:
+            raise UnsuccessfulRequest()
+
+    def get_user_gpu_quota(self, username: str) -> int:
+        self._wait()
+        return self.gpu_quotas.get(username, 0)
+
+    def _wait(self):
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+
+class LatentKubeClient(KubeClient):
+    """Answers from memory after sleeping `latency` seconds, like a remote API server"""
+
+    def __init__(self, latency: float = 0) -> None:
+        self.latency = latency
+        self.namespaces: Dict[str, Namespace] = {}
+        self.gpus: Dict[str, int] = {}
+
+    def get_namespace(self, name: str) -> Namespace:
+        self._wait()
+        try:
+            return self.namespaces[name]
+        except KeyError:
+            raise NotFound()
+
+    def get_gpus_in_namespace(self, name: str) -> int:
+        self._wait()
+        return self.gpus.get(name, 0)
+
+    def _wait(self):
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+
+class NullLogger(Logger):
+    def debug(self, message, **fields):
+        pass
+
+    def info(self, message, **fields):
+        pass
+
+    def exception(self, exception):
+        pass
+
+    def is_debug_enabled(self) -> bool:
+        return False
+
+
+def admission_review(username: str, containers: int = 1, init_containers: int = 0, gpus: int = 0,
+                     labels: int = 0) -> Dict[str, Any]:
+    container = {"securityContext": {"runAsUser": BENCH_UID, "runAsGroup": BENCH_GID}}
+    if gpus > 0:
+        container["resources"] = {"requests": {"nvidia.com/gpu": gpus}, "limits": {"nvidia.com/gpu": gpus}}
+
+    spec = {
+        "containers": [copy.deepcopy(container) for _ in range(containers)],
+        "securityContext": {"runAsUser": BENCH_UID, "runAsGroup": BENCH_GID, "fsGroup": BENCH_GID},
+    }
+    if init_containers > 0:
+        spec["initContainers"] = [{"securityContext": {"runAsUser": BENCH_UID}} for _ in range(init_containers)]
+
+    return {
+        "apiVersion": "admission.k8s.io/v1",
+        "kind": "AdmissionReview",
+        "request": {
+            "uid": "705ab4f5-6393-11e8-b7cc-42010a800002",
+            "namespace": username,
+            "userInfo": {"username": username},
+            "object": {
+                "metadata": {"labels": {f"bench/label-{i}": f"value-{i}" for i in range(labels)}},
+                "spec": spec,
+            },
+        },
+    }
+
+
+SCENARIOS: Dict[str, Callable[[], Dict[str, Any]]] = {
+    'minimal': lambda: admission_review('bench'),
+    'many-containers': lambda: admission_review('bench', containers=50, init_containers=20),
+    'gpu': lambda: admission_review('bench', containers=4, gpus=1),
+    'large-labels': lambda: admission_review('bench', labels=500),
+}
+
+
+def seed(review: Dict[str, Any], awsed: LatentAwsedClient, kube: LatentKubeClient) -> None:
+    """Make the user and namespace of a review known, so that it is allowed"""
+    request = review['request']
+    username = request['userInfo']['username']
+    security_context = request['object']['spec'].get('securityContext') or {}
+    labels = request['object']['metadata'].get('labels') or {}
+    enrollments = [labels['dsmlp/course']] if 'dsmlp/course' in labels else []
+
+    awsed.users[username] = UserResponse(uid=security_context.get('runAsUser', BENCH_UID), enrollments=enrollments)
+    awsed.teams[username] = ListTeamsResponse(teams=[TeamJson(gid=BENCH_GID)])
+    awsed.gpu_quotas[username] = 1000
+    kube.namespaces[request['namespace']] = Namespace(
+        name=request['namespace'], labels={'k8s-sync': 'true'}, gpu_quota=1000)
+
+
+@dataclass
+class Result:
+    scenario: str
+    requests: int
+    threads: int
+    seconds: float
+    throughput: float
+    p50_ms: float
+    p99_ms: float
+    p999_ms: float
+    allowed: int
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    index = min(len(ordered) - 1, max(0, int(round(q * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def run_scenario(name: str, review: Dict[str, Any], validator: Validator, requests: int, threads: int,
+                 warmup: int = 100) -> Result:
+    for _ in range(warmup):
+        validator.validate_request(review)
+
+    latencies: List[float] = []
+    allowed = [0]
+    lock = threading.Lock()
+    per_thread = max(1, requests // threads)
+
+    def work():
+        local = []
+        local_allowed = 0
+        for _ in range(per_thread):
+            start = time.perf_counter()
+            response = validator.validate_request(review)
+            local.append(time.perf_counter() - start)
+            local_allowed += response['response']['allowed']
+        with lock:
+            latencies.extend(local)
+            allowed[0] += local_allowed
+
+    start = time.perf_counter()
+    if threads == 1:
+        work()
+    else:
+        workers = [threading.Thread(target=work) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return Result(
+        scenario=name,
+        requests=len(latencies),
+        threads=threads,
+        seconds=elapsed,
+        throughput=len(latencies) / elapsed,
+        p50_ms=percentile(latencies, .5) * 1e3,
+        p99_ms=percentile(latencies, .99) * 1e3,
+        p999_ms=percentile(latencies, .999) * 1e3,
+        allowed=allowed[0])
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog='dsmlp-bench', description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--payload', action='append', default=[],
+                        help="recorded AdmissionReview JSON file to add as a scenario (repeatable)")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help="synthetic scenario to run (repeatable, default: all)")
+    parser.add_argument('-n', '--requests', type=int, default=2000, help="requests per scenario")
+    parser.add_argument('-t', '--threads', type=int, default=1, help="concurrent callers")
+    parser.add_argument('--latency-ms', type=float, default=0, help="latency injected into every lookup")
+    parser.add_argument('--lookup-workers', type=int, default=0,
+                        help="make each request's lookups concurrently on this many threads")
+    parser.add_argument('--json', action='store_true', help="print machine-readable results")
+    args = parser.parse_args(argv)
+
+    reviews = {name: SCENARIOS[name]() for name in (args.scenario or SCENARIOS)}
+    for payload in args.payload:
+        with open(payload, 'rb') as f:
+            reviews[path.basename(payload)] = json.load(f)
+
+    awsed = LatentAwsedClient(args.latency_ms / 1e3)
+    kube = LatentKubeClient(args.latency_ms / 1e3)
+    for review in reviews.values():
+        seed(review, awsed, kube)
+
+    executor = None
+    if args.lookup_workers > 0:
+        executor = ThreadPoolExecutor(max_workers=args.lookup_workers, thread_name_prefix="lookup")
+    validator = Validator(awsed, kube, NullLogger(), executor)
+
+    try:
+        results = [run_scenario(name, review, validator, args.requests, args.threads)
+                   for name, review in reviews.items()]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if args.json:
+        print(json.dumps({
+            'python': platform.python_version(),
+            'latency_ms': args.latency_ms,
+            'lookup_workers': args.lookup_workers,
+            'results': [asdict(result) for result in results],
+        }, indent=2))
+    else:
+        print(f"{'scenario':<20} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'p999 ms':>9} {'allowed':>9}")
+        for result in results:
+            print(f"{result.scenario:<20} {result.throughput:>10.0f} {result.p50_ms:>9.3f} "
+                  f"{result.p99_ms:>9.3f} {result.p999_ms:>9.3f} {result.allowed:>9}")
+
+
+if __name__ == '__main__':
+    main()
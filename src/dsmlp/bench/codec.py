@@ -0,0 +1,67 @@
+"""
+Compares the dataclasses_json decode path with dsmlp.app.codec.
+
+    python -m dsmlp.bench.codec ref.json
+"""
+import argparse
+import json
+import time
+
+from dsmlp.app.codec import decode_review, encode_response
+from dsmlp.app.types import AdmissionReview
+
+
+def response_for(review: AdmissionReview):
+    return {
+        "apiVersion": "admission.k8s.io/v1",
+        "kind": "AdmissionReview",
+        "response": {"uid": review.request.uid, "allowed": True, "status": {"message": "Allowed"}}
+    }
+
+
+def reflective(body: bytes) -> bytes:
+    review = AdmissionReview.from_dict(json.loads(body))
+    return json.dumps(response_for(review)).encode()
+
+
+def fast(body: bytes) -> bytes:
+    review = decode_review(body)
+    return encode_response(response_for(review))
+
+
+def measure(fn, body: bytes, iterations: int) -> float:
+    """Mean seconds per call"""
+    fn(body)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(body)
+    return (time.perf_counter() - start) / iterations
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('payload', help="AdmissionReview JSON file, e.g. ref.json")
+    parser.add_argument('-n', '--iterations', type=int, default=5000)
+    parser.add_argument('--json', action='store_true', help="print machine-readable results")
+    args = parser.parse_args(argv)
+
+    with open(args.payload, 'rb') as f:
+        body = f.read()
+
+    results = {
+        'payload_bytes': len(body),
+        'dataclasses_json_us': measure(reflective, body, args.iterations) * 1e6,
+        'codec_us': measure(fast, body, args.iterations) * 1e6,
+    }
+    results['speedup'] = results['dataclasses_json_us'] / results['codec_us']
+
+    if args.json:
+        print(json.dumps(results))
+    else:
+        print(f"payload: {results['payload_bytes']} bytes, {args.iterations} iterations")
+        print(f"dataclasses_json: {results['dataclasses_json_us']:.1f} us/request")
+        print(f"codec:            {results['codec_us']:.1f} us/request ({results['speedup']:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Compares the V1Pod model path of DefaultKubeClient.get_gpus_in_namespace with raw JSON reads
+(KUBE_RAW_READS), in CPU time and latency per call.
+
+    python -m dsmlp.bench.kube --pods 100 --terminal 20
+    python -m dsmlp.bench.kube --namespace user10      # against the configured cluster
+
+By default the API server is replaced by canned pod lists, so the numbers are the client's
+own cost; --latency-ms adds a simulated round trip. The canned server honours the field
+selector of raw reads, so terminal pods are only returned to the model path.
+"""
+import argparse
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+from kubernetes.client import ApiClient, Configuration, CoreV1Api
+
+from dsmlp.app.config import TERMINAL_POD_PHASES
+from dsmlp.ext.kube import DefaultKubeClient
+
+
+def synthetic_pod(namespace: str, index: int, phase: str) -> Dict[str, Any]:
+    """A pod shaped like a DSMLP notebook pod, with the fields the API server returns"""
+    container = {
+        'name': 'main',
+        'image': 'ghcr.io/ucsd-ets/datascience-notebook:2024.1-stable',
+        'command': ['/bin/bash', '-c', 'start-notebook.sh'],
+        'env': [{'name': f'VAR_{i}', 'value': 'x' * 40} for i in range(20)],
+        'resources': {'requests': {'cpu': '2', 'memory': '8Gi', 'nvidia.com/gpu': '1'},
+                      'limits': {'cpu': '4', 'memory': '16Gi', 'nvidia.com/gpu': '1'}},
+        'volumeMounts': [{'name': f'volume-{i}', 'mountPath': f'/mnt/volume-{i}'} for i in range(6)],
+        'securityContext': {'runAsUser': 1000, 'runAsGroup': 100},
+    }
+    return {
+        'metadata': {
+            'name': f'{namespace}-{index}', 'namespace': namespace, 'uid': f'00000000-0000-0000-0000-{index:012d}',
+            'resourceVersion': str(100000 + index), 'creationTimestamp': '2024-01-01T00:00:00Z',
+            'labels': {'dsmlp/course': 'CSE101', 'app': 'notebook', 'pod-template-hash': 'abc123'},
+            'annotations': {f'example.com/annotation-{i}': 'y' * 60 for i in range(5)},
+            'ownerReferences': [{'apiVersion': 'apps/v1', 'kind': 'ReplicaSet', 'name': f'{namespace}-rs',
+                                 'uid': '11111111-1111-1111-1111-111111111111', 'controller': True}],
+        },
+        'spec': {
+            'containers': [container],
+            'initContainers': [dict(container, name='init', resources={})],
+            'volumes': [{'name': f'volume-{i}', 'persistentVolumeClaim': {'claimName': f'claim-{i}'}}
+                        for i in range(6)],
+            'securityContext': {'runAsUser': 1000, 'fsGroup': 100, 'supplementalGroups': [100, 200]},
+            'nodeName': 'node-1', 'restartPolicy': 'Always', 'priorityClassName': 'normal',
+            'tolerations': [{'key': 'nvidia.com/gpu', 'operator': 'Exists', 'effect': 'NoSchedule'}],
+        },
+        'status': {
+            'phase': phase, 'podIP': '10.0.0.1', 'startTime': '2024-01-01T00:00:05Z',
+            'conditions': [{'type': kind, 'status': 'True', 'lastTransitionTime': '2024-01-01T00:00:05Z'}
+                           for kind in ('Initialized', 'Ready', 'ContainersReady', 'PodScheduled')],
+            'containerStatuses': [{'name': 'main', 'ready': True, 'restartCount': 0, 'image': container['image'],
+                                   'imageID': 'sha256:' + 'f' * 64, 'containerID': 'containerd://' + 'e' * 64,
+                                   'state': {'running': {'startedAt': '2024-01-01T00:00:06Z'}}}],
+        },
+    }
+
+
+def pod_list(pods: List[Dict[str, Any]]) -> bytes:
+    return json.dumps({'kind': 'PodList', 'apiVersion': 'v1', 'metadata': {'resourceVersion': '200000'},
+                       'items': pods}).encode()
+
+
+class CannedResponse:
+    """Stands in for the urllib3 response the kubernetes client reads"""
+
+    def __init__(self, data: bytes) -> None:
+        self.status = 200
+        self.reason = 'OK'
+        self.data = data
+
+    def getheaders(self) -> Dict[str, str]:
+        return {'Content-Type': 'application/json'}
+
+    def getheader(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        return self.getheaders().get(name, default)
+
+    def release_conn(self) -> None:
+        pass
+
+
+class CannedApiClient(ApiClient):
+    """Answers pod lists and namespace reads from memory, after `latency` seconds"""
+
+    def __init__(self, namespace: str, pods: int, terminal: int, latency: float = 0) -> None:
+        super().__init__(Configuration())
+        listed = [synthetic_pod(namespace, i, 'Running') for i in range(pods - terminal)]
+        finished = [synthetic_pod(namespace, i, TERMINAL_POD_PHASES[0]) for i in range(pods - terminal, pods)]
+        self.all_pods = pod_list(listed + finished)
+        self.non_terminal_pods = pod_list(listed)
+        self.namespace = json.dumps({'kind': 'Namespace', 'apiVersion': 'v1', 'metadata': {'name': namespace}}).encode()
+        self.latency = latency
+
+    def request(self, method, url, query_params=None, headers=None, post_params=None, body=None,
+                _preload_content=True, _request_timeout=None):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if not url.endswith('/pods'):
+            return CannedResponse(self.namespace)
+        if any(key == 'fieldSelector' for key, _ in query_params or []):
+            return CannedResponse(self.non_terminal_pods)
+        return CannedResponse(self.all_pods)
+
+
+def measure(client: DefaultKubeClient, namespace: str, iterations: int) -> Dict[str, float]:
+    """Mean CPU and wall-clock milliseconds per call"""
+    client.get_gpus_in_namespace(namespace)
+    cpu, wall = time.process_time(), time.perf_counter()
+    for _ in range(iterations):
+        client.get_gpus_in_namespace(namespace)
+    return {'cpu_ms': (time.process_time() - cpu) / iterations * 1e3,
+            'latency_ms': (time.perf_counter() - wall) / iterations * 1e3}
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pods', type=int, default=100, help="pods in the canned namespace (default: 100)")
+    parser.add_argument('--terminal', type=int, default=20,
+                        help="of which Succeeded, filtered out by raw reads (default: 20)")
+    parser.add_argument('--latency-ms', type=float, default=0, help="simulated API server round trip")
+    parser.add_argument('--namespace', help="measure against this namespace of the configured cluster instead")
+    parser.add_argument('-n', '--iterations', type=int, default=200)
+    parser.add_argument('--json', action='store_true', help="print machine-readable results")
+    args = parser.parse_args(argv)
+
+    if args.namespace is not None:
+        from dsmlp.ext.kube_api import KubeApiProvider
+        namespace, api_provider = args.namespace, KubeApiProvider(qps=0)
+        api = api_provider.core_v1()
+    else:
+        namespace = 'user10'
+        api = CoreV1Api(CannedApiClient(namespace, args.pods, args.terminal, args.latency_ms / 1e3))
+
+    results: Dict[str, Any] = {}
+    for name, raw_reads in (('models', False), ('raw', True)):
+        client = DefaultKubeClient(raw_reads=raw_reads)
+        client.get_policy_api = lambda: api
+        results[name] = dict(measure(client, namespace, args.iterations), gpus=client.get_gpus_in_namespace(namespace))
+    results['cpu_speedup'] = results['models']['cpu_ms'] / results['raw']['cpu_ms']
+
+    if args.json:
+        print(json.dumps(results))
+        return
+
+    print(f"namespace {namespace}, {args.iterations} calls")
+    for name in ('models', 'raw'):
+        result = results[name]
+        print(f"{name:<7} {result['cpu_ms']:.3f} ms CPU  {result['latency_ms']:.3f} ms latency  "
+              f"{result['gpus']} GPUs")
+    print(f"raw reads use {results['cpu_speedup']:.1f}x less CPU")
+
+
+if __name__ == '__main__':
+    main()
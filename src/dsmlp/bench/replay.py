@@ -0,0 +1,181 @@
+"""
+Replays a decision log (DECISION_LOG_PATH) through Validator and reports decisions that
+differ from the recorded ones, with replay throughput and latency.
+
+    dsmlp-replay decisions.log                   # recorded dependency responses, full speed
+    dsmlp-replay decisions.log --speed 1         # at the original pace
+    dsmlp-replay decisions.log --fakes --latency-ms 2 --json
+
+By default every lookup is answered with the response recorded alongside the decision, so
+differences come from validator changes only. Requests decided from the ID decision cache
+replay with the cached decision, as their lookups were not made, and GPUs reserved by
+earlier admissions count as in use. With --fakes, lookups go to in-memory clients
+seeded to allow each request instead.
+
+Lookups recorded as unavailable are decided under AWSED_DEGRADED_POLICY and KUBE_DEGRADED_POLICY,
+so set them as they were set for the recorded traffic.
+"""
+import argparse
+import json
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from dsmlp.app.gpu_validator import GPUS_RESERVED
+from dsmlp.app.id_validator import CACHED_DECISION
+from dsmlp.app.validator import Validator
+from dsmlp.bench.admission import LatentAwsedClient, LatentKubeClient, NullLogger, percentile, seed
+from dsmlp.ext.decision_log import RecordReader, decode_lookup, decode_review
+from dsmlp.plugin.awsed import AwsedClient, ListTeamsResponse, UserResponse
+from dsmlp.plugin.kube import KubeClient, Namespace
+
+
+class Recording:
+    """The dependency responses recorded with the decision being replayed"""
+
+    def __init__(self) -> None:
+        self.lookups: Dict[str, Tuple[Any, Optional[Exception]]] = {}
+
+    def load(self, lookups: Dict[str, Dict[str, Any]]) -> None:
+        self.lookups = {name: decode_lookup(name, lookup) for name, lookup in lookups.items()}
+
+    def answer(self, name: str):
+        try:
+            result, error = self.lookups[name]
+        except KeyError:
+            raise RuntimeError(f"{name} lookup was not recorded")
+        if error is not None:
+            raise error
+        return result
+
+
+class RecordedAwsedClient(AwsedClient):
+    def __init__(self, recording: Recording) -> None:
+        self.recording = recording
+
+    def describe_user(self, username: str) -> UserResponse:
+        return self.recording.answer('user')
+
+    def list_user_teams(self, username: str) -> ListTeamsResponse:
+        return self.recording.answer('teams')
+
+    def get_user_gpu_quota(self, username: str) -> int:
+        return self.recording.answer('gpu_quota')
+
+
+class RecordedKubeClient(KubeClient):
+    def __init__(self, recording: Recording) -> None:
+        self.recording = recording
+
+    def get_namespace(self, name: str) -> Namespace:
+        return self.recording.answer('namespace')
+
+    def get_gpus_in_namespace(self, name: str) -> int:
+        # GPUs reserved by earlier admissions were counted with the pods when the decision was made
+        reserved, _ = self.recording.lookups.get(GPUS_RESERVED, (0, None))
+        return self.recording.answer('gpus_in_namespace') + reserved
+
+
+class RecordedDecisions:
+    """Stands in for IDValidator's decision cache, holding the decision recorded with a cache hit"""
+
+    def __init__(self, recording: Recording) -> None:
+        self.recording = recording
+
+    def __contains__(self, key) -> bool:
+        return CACHED_DECISION in self.recording.lookups
+
+    def peek(self, key, default=None):
+        return self.recording.answer(CACHED_DECISION) if key in self else default
+
+    def get(self, key, loader: Callable[[], Optional[str]]) -> Optional[str]:
+        if key in self:
+            return self.recording.answer(CACHED_DECISION)
+        return loader()
+
+
+def decision(response: Dict[str, Any]) -> Tuple[bool, str]:
+    return response['response']['allowed'], response['response']['status']['message']
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog='dsmlp-replay', description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('log', help="decision log file")
+    parser.add_argument('--speed', type=float, default=0,
+                        help="replay pace relative to the original traffic, e.g. 1 or 10 (default: 0, no pacing)")
+    parser.add_argument('--fakes', action='store_true', help="answer lookups from seeded fakes, not the recording")
+    parser.add_argument('--latency-ms', type=float, default=0, help="latency injected into every lookup with --fakes")
+    parser.add_argument('--json', action='store_true', help="print machine-readable results")
+    args = parser.parse_args(argv)
+
+    recording = Recording()
+    if args.fakes:
+        awsed, kube = LatentAwsedClient(args.latency_ms / 1e3), LatentKubeClient(args.latency_ms / 1e3)
+    else:
+        awsed, kube = RecordedAwsedClient(recording), RecordedKubeClient(recording)
+    degraded_policies = {dependency: os.environ.get(f'{dependency.upper()}_DEGRADED_POLICY', 'cache').lower()
+                         for dependency in ('awsed', 'kube')}
+    validator = Validator(awsed, kube, NullLogger(), id_decision_cache=RecordedDecisions(recording),
+                          degraded_policies=degraded_policies)
+
+    latencies: List[float] = []
+    recorded_latencies: List[float] = []
+    mismatches = []
+    first_record = replay_start = None
+    records = RecordReader(args.log)
+    for record in records:
+        review = decode_review(record['review'])
+        if args.fakes:
+            seed(review, awsed, kube)
+        else:
+            recording.load(record['lookups'])
+
+        if first_record is None:
+            first_record, replay_start = record['time'], time.monotonic()
+        elif args.speed > 0:
+            delay = (record['time'] - first_record) / args.speed - (time.monotonic() - replay_start)
+            if delay > 0:
+                time.sleep(delay)
+
+        start = time.perf_counter()
+        response = validator.validate_request(review)
+        latencies.append(time.perf_counter() - start)
+        if 'total' in record['timings']:
+            recorded_latencies.append(record['timings']['total'])
+
+        if decision(response) != decision(record['response']):
+            mismatches.append({'uid': record['uid'], 'recorded': decision(record['response']),
+                               'replayed': decision(response)})
+
+    elapsed = time.monotonic() - replay_start if replay_start is not None else 0
+    latencies.sort()
+    recorded_latencies.sort()
+    results = {
+        'requests': len(latencies),
+        'mismatches': mismatches,
+        'skipped': records.skipped,
+        'seconds': elapsed,
+        'throughput': len(latencies) / elapsed if elapsed > 0 else 0,
+    }
+    for name, values in (('replay', latencies), ('recorded', recorded_latencies)):
+        if values:
+            for q, label in ((.5, 'p50'), (.99, 'p99'), (.999, 'p999')):
+                results[f'{name}_{label}_ms'] = percentile(values, q) * 1e3
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for mismatch in mismatches:
+        print(f"{mismatch['uid']}: recorded {mismatch['recorded']}, replayed {mismatch['replayed']}")
+    print(f"{results['requests']} requests, {len(mismatches)} decisions differ, "
+          f"{records.skipped} unreadable records skipped, {results['throughput']:.0f} req/s")
+    for name in ('replay', 'recorded'):
+        if f'{name}_p50_ms' in results:
+            print(f"{name:<9} p50 {results[f'{name}_p50_ms']:.3f} ms  p99 {results[f'{name}_p99_ms']:.3f} ms  "
+                  f"p999 {results[f'{name}_p999_ms']:.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
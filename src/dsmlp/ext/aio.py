@@ -0,0 +1,49 @@
+import asyncio
+from concurrent.futures import Executor
+
+from dsmlp.plugin.awsed import AsyncAwsedClient, AwsedClient, ListTeamsResponse, UserResponse
+from dsmlp.plugin.kube import AsyncKubeClient, KubeClient, Namespace
+
+
+class ExecutorAwsedClient(AsyncAwsedClient):
+    """
+    Async AwsedClient that runs a blocking client on a bounded thread pool.
+
+    The AWSEd client library is synchronous, so only lookups that are actually waiting on
+    AWSEd occupy a thread; admissions waiting for their turn cost nothing but a coroutine.
+    """
+
+    def __init__(self, client: AwsedClient, executor: Executor) -> None:
+        self.client = client
+        self.executor = executor
+
+    async def describe_user(self, username: str) -> UserResponse:
+        return await self._call(self.client.describe_user, username)
+
+    async def list_user_teams(self, username: str) -> ListTeamsResponse:
+        return await self._call(self.client.list_user_teams, username)
+
+    async def get_user_gpu_quota(self, username: str) -> int:
+        return await self._call(self.client.get_user_gpu_quota, username)
+
+    async def _call(self, method, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, method, *args)
+
+
+class ExecutorKubeClient(AsyncKubeClient):
+    """
+    Async KubeClient that runs a blocking client on a bounded thread pool.
+    """
+
+    def __init__(self, client: KubeClient, executor: Executor) -> None:
+        self.client = client
+        self.executor = executor
+
+    async def get_namespace(self, name: str) -> Namespace:
+        return await self._call(self.client.get_namespace, name)
+
+    async def get_gpus_in_namespace(self, name: str) -> int:
+        return await self._call(self.client.get_gpus_in_namespace, name)
+
+    async def _call(self, method, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, method, *args)
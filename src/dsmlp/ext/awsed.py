@@ -9,14 +9,57 @@ import awsed.client
 import awsed.types
 import logging
 from dsmlp.plugin.logger import Logger
+from dsmlp.ext.cache import TTLCache
 
 # added logging to check if API has an error getting GPU quota
 logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+class TimeoutSession(requests.Session):
+    """A Session whose requests time out after `timeout` seconds to connect and to read, unless given one"""
+
+    def __init__(self, timeout: float) -> None:
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().request(method, url, **kwargs)
+
+
+class TimeoutRequests:
+    """Stands in for the requests module in awsed.client, sending through a TimeoutSession"""
+
+    def __init__(self, session: TimeoutSession) -> None:
+        self.session = session
+
+    def request(self, method, url, **kwargs):
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.session.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.session.request('POST', url, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+
 class ExternalAwsedClient(AwsedClient): 
-    def __init__(self):
+    def __init__(self, timeout: float = None):
+        """With a timeout, AWSEd requests give up after that many seconds to connect or to read"""
         self.client = awsed.client.DefaultAwsedClient(endpoint=os.environ.get('AWSED_ENDPOINT'),
                                                       awsed_api_key=os.environ.get('AWSED_API_KEY'))
         self.logger = logging.getLogger(__name__)  # Initialize the logger
+        if timeout is not None:
+            session = TimeoutSession(timeout)
+            if hasattr(self.client, 'session'):
+                self.client.session = session
+            elif hasattr(awsed.client, 'requests'):
+                # The client calls the requests module directly and takes no timeout
+                awsed.client.requests = TimeoutRequests(session)
+            else:
+                self.logger.warning("Cannot set a timeout on AWSEd requests")
 
     def describe_user(self, username: str) -> UserResponse:
         usrResultJson = self.client.describe_user(username)
@@ -37,7 +80,7 @@ class ExternalAwsedClient(AwsedClient):
     def get_user_gpu_quota(self, username: str) -> int:
         try:
             usrGpuQuota = self.client.get_user_quota(username)
-            self.logger.debug(f"usrGpuQuota: {usrGpuQuota}")  # Log the structure of usrGpuQuota
+            self.logger.debug("usrGpuQuota: %s", usrGpuQuota)  # Log the structure of usrGpuQuota
             if not usrGpuQuota:
                 return None
             gpu_quota = usrGpuQuota.quota.resources.get("gpu", 0)  # Access the correct attribute
@@ -45,13 +88,43 @@ class ExternalAwsedClient(AwsedClient):
             response = UserQuotaResponse(quota=quota)
             return gpu_quota
         
-        # Debugging
+        # Debugging; raised rather than returned as no quota, so that the failure is not cached
         except KeyError as e:
-            self.logger.error(f"Key error: {e}")
-            return None
+            self.logger.error("Key error: %s", e)
+            raise UnsuccessfulRequest(f"GPU quota of {username}: {e}") from e
         except ValueError as e:
-            self.logger.error(f"Value error: {e}")
-            return None
+            self.logger.error("Value error: %s", e)
+            raise UnsuccessfulRequest(f"GPU quota of {username}: {e}") from e
         except Exception as e:
-            self.logger.error(f"Failed to fetch GPU quota for user {username}: {e}")
-            return None
+            self.logger.error("Failed to fetch GPU quota for user %s: %s", username, e)
+            raise UnsuccessfulRequest(f"GPU quota of {username}: {e}") from e
+
+
+class CachingAwsedClient(AwsedClient):
+    """
+    Wraps another AwsedClient with per-method TTL caches.
+
+    Hot users are refreshed in the background before they expire, and if AWSEd fails the last
+    known answer is served for up to `stale_ttl` seconds. Failed lookups are not cached, and
+    answers of None (no such user or quota) only for `negative_ttl` seconds.
+    """
+
+    def __init__(self, client: AwsedClient, user_ttl: float = 300, teams_ttl: float = 300,
+                 quota_ttl: float = 60, maxsize: int = 4096, stale_ttl: float = 3600,
+                 negative_ttl: float = 10) -> None:
+        self.client = client
+        self.users = TTLCache("awsed-users", ttl=user_ttl, maxsize=maxsize, stale_ttl=stale_ttl,
+                              negative_ttl=negative_ttl)
+        self.teams = TTLCache("awsed-teams", ttl=teams_ttl, maxsize=maxsize, stale_ttl=stale_ttl,
+                              negative_ttl=negative_ttl)
+        self.quotas = TTLCache("awsed-quotas", ttl=quota_ttl, maxsize=maxsize, stale_ttl=stale_ttl,
+                               negative_ttl=negative_ttl)
+
+    def describe_user(self, username: str) -> UserResponse:
+        return self.users.get(username, lambda: self.client.describe_user(username))
+
+    def list_user_teams(self, username: str) -> ListTeamsResponse:
+        return self.teams.get(username, lambda: self.client.list_user_teams(username))
+
+    def get_user_gpu_quota(self, username: str) -> int:
+        return self.quotas.get(username, lambda: self.client.get_user_gpu_quota(username))
@@ -0,0 +1,184 @@
+import heapq
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Optional, Set
+
+from dsmlp.plugin.awsed import AwsedClient, ListTeamsResponse, UserResponse
+
+
+@dataclass(frozen=True)
+class ReplicaRecord:
+    user: Optional[UserResponse]
+    teams: ListTeamsResponse
+    gpu_quota: Optional[int]
+    synced_at: float
+
+
+class AwsedReplica(AwsedClient):
+    """
+    An AwsedClient answering from an in-memory replica of AWSEd.
+
+    The replica holds every user returned by `list_usernames` (the k8s-sync namespaces). AWSEd
+    has no bulk endpoint, so on first use the background thread fetches each listed user with
+    the usual three per-user calls, `workers` users at a time. The replica is then kept current
+    by re-fetching the `batch_size` least recently synced users every `sync_period` seconds, so
+    a full pass takes about len(replica) / batch_size * sync_period seconds. The user list is
+    re-read every `relist_period` seconds.
+
+    Users not in the replica yet, and users last synced more than `max_age` seconds ago (if
+    set), are looked up with `fallback` (by default `client`), so that while AWSEd is down
+    the degraded policy of the fallback applies to them. If AWSEd fails during a sync, the
+    last synced records are kept and new users that could not be fetched are retried on the
+    next sync. A sync counts as one, for `age` and `has_synced`, once any user was fetched.
+    """
+
+    def __init__(self, client: AwsedClient, list_usernames: Callable[[], Iterable[str]],
+                 fallback: Optional[AwsedClient] = None, sync_period: float = 5, batch_size: int = 50,
+                 relist_period: float = 300, workers: int = 8, max_age: float = 0,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.client = client
+        self.list_usernames = list_usernames
+        self.fallback = fallback if fallback is not None else client
+        self.sync_period = sync_period
+        self.batch_size = batch_size
+        self.relist_period = relist_period
+        self.workers = workers
+        self.max_age = max_age
+        self.clock = clock
+        self.logger = logging.getLogger(__name__)
+
+        # Replaced one key at a time by the sync thread; readers need no lock
+        self._records: Dict[str, ReplicaRecord] = {}
+        self._pending: Set[str] = set()
+        self._pending_lock = threading.Lock()
+        self._loaded = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.last_sync: Optional[float] = None
+        self.last_relist: Optional[float] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.sync_errors = 0
+
+    def describe_user(self, username: str) -> UserResponse:
+        record = self._record(username)
+        return record.user if record is not None else self.fallback.describe_user(username)
+
+    def list_user_teams(self, username: str) -> ListTeamsResponse:
+        record = self._record(username)
+        return record.teams if record is not None else self.fallback.list_user_teams(username)
+
+    def get_user_gpu_quota(self, username: str) -> int:
+        record = self._record(username)
+        return record.gpu_quota if record is not None else self.fallback.get_user_gpu_quota(username)
+
+    def _record(self, username: str) -> Optional[ReplicaRecord]:
+        self.start()
+        record = self._records.get(username)
+        if record is not None and (self.max_age <= 0 or self.clock() - record.synced_at <= self.max_age):
+            self.hits += 1
+            return record
+
+        self.misses += 1
+        with self._pending_lock:
+            self._pending.add(username)
+        return None
+
+    def restore(self, username: str, user: Optional[UserResponse], teams: ListTeamsResponse,
+                gpu_quota: Optional[int], age: float) -> None:
+        """Add a record fetched `age` seconds ago, e.g. from a snapshot, unless the user is already synced"""
+        if username not in self._records:
+            self._records[username] = ReplicaRecord(user=user, teams=teams, gpu_quota=gpu_quota,
+                                                    synced_at=self.clock() - age)
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self.run, name="awsed-replica", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def has_synced(self) -> bool:
+        return self._loaded.is_set()
+
+    def wait_for_sync(self, timeout: Optional[float] = None) -> bool:
+        return self._loaded.wait(timeout)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def age(self) -> Optional[float]:
+        """Seconds since the last successful sync, or None if never"""
+        if self.last_sync is None:
+            return None
+        return self.clock() - self.last_sync
+
+    def lag(self) -> Optional[float]:
+        """Seconds since the least recently synced user was fetched, or None if empty"""
+        records = list(self._records.values())
+        if not records:
+            return None
+        return self.clock() - min(record.synced_at for record in records)
+
+    def run(self) -> None:
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="awsed-replica") as executor:
+            while not self._stopped.is_set():
+                try:
+                    self.sync(executor)
+                except Exception as ex:
+                    self.sync_errors += 1
+                    self.logger.error("AWSEd replica sync failed: %s", ex)
+                self._stopped.wait(self.sync_period)
+
+    def sync(self, executor: Optional[ThreadPoolExecutor] = None) -> None:
+        """Relist users if due, then fetch new users and the least recently synced batch"""
+        now = self.clock()
+        usernames: Set[str] = set()
+        if self.last_relist is None or now - self.last_relist >= self.relist_period:
+            listed = set(self.list_usernames())
+            for username in set(self._records) - listed:
+                del self._records[username]
+            usernames = listed - set(self._records)
+            self.last_relist = now
+
+        with self._pending_lock:
+            usernames |= self._pending
+            self._pending = set()
+
+        oldest = heapq.nsmallest(self.batch_size, self._records.items(), key=lambda item: item[1].synced_at)
+        usernames |= {username for username, _ in oldest}
+
+        fetch = executor.map if executor is not None else map
+        failed = [username for username, ok in zip(usernames, fetch(self.fetch, usernames)) if not ok]
+        if failed:
+            self.sync_errors += len(failed)
+            self.logger.error("AWSEd replica could not sync %d of %d users", len(failed), len(usernames))
+            with self._pending_lock:
+                self._pending |= {username for username in failed if username not in self._records}
+            if len(failed) == len(usernames):
+                return
+
+        self.last_sync = self.clock()
+        self._loaded.set()
+
+    def fetch(self, username: str) -> bool:
+        try:
+            user = self.client.describe_user(username)
+            teams = self.client.list_user_teams(username) if user else ListTeamsResponse(teams=[])
+            gpu_quota = self.client.get_user_gpu_quota(username)
+        except Exception as ex:
+            self.logger.debug("AWSEd replica could not fetch %s: %s", username, ex)
+            return False
+
+        self._records[username] = ReplicaRecord(user=user, teams=teams, gpu_quota=gpu_quota, synced_at=self.clock())
+        return True
@@ -0,0 +1,148 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Any, Callable, Optional
+
+from dsmlp.plugin.awsed import AwsedClient, ListTeamsResponse, UserResponse
+from dsmlp.plugin.errors import DependencyUnavailable
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures. While open, calls are rejected
+    without being made. After `reset_timeout` seconds a single trial call is let through
+    (half open); it closes the breaker if it succeeds and reopens it if it fails.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.rejections = 0
+        self.opens = 0
+        self._trial_running = False
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def before_call(self) -> None:
+        """Raise DependencyUnavailable if the call must not be made"""
+        with self._lock:
+            if self.state == OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+            if self.state == CLOSED:
+                return
+            if self.state == HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return
+            self.rejections += 1
+        raise DependencyUnavailable(self.name, "circuit open")
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != CLOSED:
+                self.logger.info("%s circuit closed", self.name)
+            self.state = CLOSED
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                if self.state == CLOSED:
+                    self.logger.error("%s circuit opened after %d failures", self.name, self.failures)
+                self.state = OPEN
+                self.opened_at = self.clock()
+                self.opens += 1
+
+
+class Guard:
+    """
+    Makes calls to one dependency through a circuit breaker, abandoning each `timeout` seconds
+    after it starts. Calls run on a pool of `workers` threads so a caller never waits longer
+    than the timeout; an abandoned call keeps its thread until it returns, so clients should
+    time out on their own as well. When every worker is busy, calls fail at once as
+    "saturated" rather than queueing, without counting against the dependency. Exceptions for
+    which `is_failure` is false (e.g. not found) are passed through without counting either.
+    """
+
+    def __init__(self, breaker: CircuitBreaker, timeout: float, workers: int = 32,
+                 is_failure: Callable[[Exception], bool] = lambda ex: True) -> None:
+        self.breaker = breaker
+        self.timeout = timeout
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{breaker.name}-call")
+        self.is_failure = is_failure
+        self.timeouts = 0
+        self.saturations = 0
+        # Held from submission until the call returns, so a call never waits for a worker
+        self._slots = threading.BoundedSemaphore(workers)
+
+    def call(self, fn: Callable[..., Any], *args) -> Any:
+        if not self._slots.acquire(blocking=False):
+            self.saturations += 1
+            raise DependencyUnavailable(self.breaker.name, "saturated")
+        try:
+            self.breaker.before_call()
+        except BaseException:
+            self._slots.release()
+            raise
+
+        started = threading.Event()
+
+        def run():
+            started.set()
+            try:
+                return fn(*args)
+            finally:
+                self._slots.release()
+
+        future = self.executor.submit(run)
+        started.wait()
+        try:
+            result = future.result(timeout=self.timeout)
+        except TimeoutError:
+            self.timeouts += 1
+            self.breaker.record_failure()
+            raise DependencyUnavailable(self.breaker.name, f"no answer within {self.timeout}s")
+        except Exception as ex:
+            if self.is_failure(ex):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            raise
+
+        self.breaker.record_success()
+        return result
+
+
+class GuardedAwsedClient(AwsedClient):
+    def __init__(self, client: AwsedClient, guard: Guard) -> None:
+        self.client = client
+        self.guard = guard
+
+    def describe_user(self, username: str) -> UserResponse:
+        return self.guard.call(self.client.describe_user, username)
+
+    def list_user_teams(self, username: str) -> ListTeamsResponse:
+        return self.guard.call(self.client.list_user_teams, username)
+
+    def get_user_gpu_quota(self, username: str) -> int:
+        return self.guard.call(self.client.get_user_gpu_quota, username)
+
+
+def is_kube_failure(ex: Exception) -> bool:
+    """Client errors such as 404 say nothing about the health of the API server"""
+    status = getattr(ex, 'status', None)
+    return not (isinstance(status, int) and 400 <= status < 500 and status != 429)
@@ -0,0 +1,177 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+@dataclass
+class CacheEntry:
+    value: Any
+    loaded_at: float
+    refresh_at: float
+    expires_at: float
+    refreshing: bool = False
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire after a fixed TTL.
+
+    Entries that are read after `refresh_ahead` of their TTL has elapsed are reloaded in the
+    background, so keys that stay hot never expire on the request path, unless
+    `background_refresh` is false, e.g. when a loader must not outlive its request. Concurrent misses for
+    the same key share a single load. When a load fails and `stale_ttl` is set, the last known
+    value is served for up to `stale_ttl` seconds past its expiry. A failed load is never cached,
+    and with `negative_ttl` set, a None (e.g. not found) expires after that many seconds instead.
+    """
+
+    def __init__(self, name: str, ttl: float, maxsize: int = 4096, refresh_ahead: float = 0.8,
+                 stale_ttl: float = 0, executor: Optional[ThreadPoolExecutor] = None,
+                 clock: Callable[[], float] = time.monotonic, background_refresh: bool = True,
+                 negative_ttl: Optional[float] = None) -> None:
+        self.name = name
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.maxsize = maxsize
+        self.refresh_ahead = refresh_ahead
+        self.background_refresh = background_refresh
+        self.stale_ttl = stale_ttl
+        self.clock = clock
+        self._executor = executor
+        self._entries: 'OrderedDict[Hashable, CacheEntry]' = OrderedDict()
+        self._loading: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.refreshes = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now < entry.expires_at:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                refresh = self.background_refresh and now >= entry.refresh_at and not entry.refreshing
+                entry.refreshing = entry.refreshing or refresh
+                value = entry.value
+            else:
+                self.misses += 1
+                future = self._loading.get(key)
+                owner = future is None
+                if owner:
+                    future = Future()
+                    self._loading[key] = future
+
+        if entry is not None and now < entry.expires_at:
+            if refresh:
+                self._submit_refresh(key, loader)
+            return value
+
+        if not owner:
+            return self._wait(key, future, entry)
+
+        try:
+            value = loader()
+        except Exception as ex:
+            future.set_exception(ex)
+            return self._stale_or_raise(entry, ex)
+        except BaseException as ex:
+            # Waiters get an error they handle; the interruption is the owner's alone
+            future.set_exception(RuntimeError(f"{self.name} load interrupted by {type(ex).__name__}"))
+            raise
+        else:
+            with self._lock:
+                self._store(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            # Whatever happened, the next miss loads again
+            with self._lock:
+                del self._loading[key]
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """The unexpired value cached for key, counted as a hit, else default. Never loads."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self.clock() >= entry.expires_at:
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def put(self, key: Hashable, value: Any, loaded_at: Optional[float] = None) -> None:
+        with self._lock:
+            self._store(key, value, loaded_at)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Whether an unexpired entry is cached for key. Does not count as a hit or miss."""
+        entry = self._entries.get(key)
+        return entry is not None and self.clock() < entry.expires_at
+
+    def _wait(self, key: Hashable, future: Future, entry: Optional[CacheEntry]) -> Any:
+        try:
+            return future.result()
+        except Exception as ex:
+            return self._stale_or_raise(entry, ex)
+
+    def _stale_or_raise(self, entry: Optional[CacheEntry], ex: Exception) -> Any:
+        if entry is not None and self.clock() < entry.expires_at + self.stale_ttl:
+            with self._lock:
+                self.stale_hits += 1
+            return entry.value
+        raise ex
+
+    def _store(self, key: Hashable, value: Any, loaded_at: Optional[float] = None) -> None:
+        # Caller holds the lock
+        if loaded_at is None:
+            loaded_at = self.clock()
+        ttl = self.negative_ttl if value is None and self.negative_ttl is not None else self.ttl
+        self._entries[key] = CacheEntry(
+            value=value,
+            loaded_at=loaded_at,
+            refresh_at=loaded_at + ttl * self.refresh_ahead,
+            expires_at=loaded_at + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _submit_refresh(self, key: Hashable, loader: Callable[[], Any]) -> None:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=2, thread_name_prefix=f"{self.name}-refresh")
+            executor = self._executor
+        executor.submit(self._refresh, key, loader)
+
+    def _refresh(self, key: Hashable, loader: Callable[[], Any]) -> None:
+        try:
+            value = loader()
+        except Exception:
+            # Keep serving the current entry; the next read past refresh_at retries
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry.refreshing = False
+            return
+
+        with self._lock:
+            self.refreshes += 1
+            self._store(key, value)
@@ -0,0 +1,147 @@
+"""
+Append-only log of admission decisions, one JSON record per line, for replaying production
+traffic with dsmlp-replay.
+
+Records are queued by the request thread and serialized, compressed and written by a
+background thread. When the queue is full, records are dropped rather than delaying admissions.
+
+Each record is appended with a single write to a file opened with O_APPEND, so workers of
+several processes can share a log without their records interleaving. A record cut short by a
+crash is skipped, and counted, when the log is read.
+"""
+import base64
+import dataclasses
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from dsmlp.plugin.awsed import ListTeamsResponse, TeamJson, UnsuccessfulRequest, UserResponse
+from dsmlp.plugin.decision_log import DecisionLog
+from dsmlp.plugin.errors import DependencyUnavailable
+from dsmlp.plugin.kube import Namespace, NotFound
+
+log = logging.getLogger(__name__)
+
+# Errors a recorded lookup can be replayed with; anything else is replayed as a RuntimeError
+ERRORS = {cls.__name__: cls for cls in (UnsuccessfulRequest, NotFound)}
+
+
+def encode_review(review: Dict[str, Any]) -> str:
+    return base64.b64encode(zlib.compress(json.dumps(review, separators=(',', ':')).encode())).decode()
+
+
+def decode_review(data: str) -> Dict[str, Any]:
+    return json.loads(zlib.decompress(base64.b64decode(data)))
+
+
+def encode_lookup(result: Any, error: Optional[Exception]) -> Dict[str, Any]:
+    if isinstance(error, DependencyUnavailable):
+        return {'error': type(error).__name__, 'message': str(error),
+                'dependency': error.dependency, 'reason': error.reason}
+    if error is not None:
+        return {'error': type(error).__name__, 'message': str(error)}
+    if dataclasses.is_dataclass(result):
+        return {'result': dataclasses.asdict(result)}
+    return {'result': result}
+
+
+def decode_lookup(name: str, lookup: Dict[str, Any]) -> Tuple[Any, Optional[Exception]]:
+    if lookup.get('error') == DependencyUnavailable.__name__:
+        return None, DependencyUnavailable(lookup['dependency'], lookup['reason'])
+    if 'error' in lookup:
+        return None, ERRORS.get(lookup['error'], RuntimeError)(lookup['message'])
+
+    result = lookup['result']
+    if result is None:
+        return None, None
+    if name == 'user':
+        return UserResponse(**result), None
+    if name == 'teams':
+        return ListTeamsResponse(teams=[TeamJson(**team) for team in result['teams']]), None
+    if name == 'namespace':
+        return Namespace(**result), None
+    return result, None
+
+
+def encode_record(timestamp: float, review: Dict[str, Any], response: Dict[str, Any], timings: Dict[str, float],
+                  lookups: Dict[str, Tuple[Any, Optional[Exception]]]) -> str:
+    return json.dumps({
+        'time': timestamp,
+        'uid': response['response']['uid'],
+        'allowed': response['response']['allowed'],
+        'review': encode_review(review),
+        'response': response,
+        'timings': timings,
+        'lookups': {name: encode_lookup(result, error) for name, (result, error) in lookups.items()},
+    }, separators=(',', ':'))
+
+
+class RecordReader:
+    """Iterates over the records of a log, counting the lines that are not a record in `skipped`"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.skipped = 0
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        with open(self.path, errors='replace') as f:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                if not isinstance(record, dict):
+                    log.warning("Skipping unreadable decision record at %s:%d", self.path, number)
+                    self.skipped += 1
+                    continue
+                yield record
+
+
+def read_records(path: str) -> Iterator[Dict[str, Any]]:
+    return iter(RecordReader(path))
+
+
+class FileDecisionLog(DecisionLog):
+    def __init__(self, path: str, queue_size: int = 10000) -> None:
+        self.path = path
+        self.dropped = 0
+        self.written = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self.run, name="decision-log", daemon=True)
+        self._thread.start()
+
+    def record(self, review, response, timings, lookups):
+        try:
+            self._queue.put_nowait((time.time(), review, response, dict(timings), lookups))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, timeout: float = 5) -> None:
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def run(self) -> None:
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+
+                try:
+                    data = (encode_record(*item) + "\n").encode()
+                    # One write per record: O_APPEND places it whole at the end of the file
+                    if os.write(fd, data) != len(data):
+                        log.error("Decision record cut short writing to %s", self.path)
+                    self.written += 1
+                except Exception:
+                    log.exception("Could not write decision record")
+        finally:
+            os.close(fd)
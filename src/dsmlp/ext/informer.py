@@ -0,0 +1,221 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from kubernetes import watch
+from kubernetes.client import CoreV1Api, V1Namespace, V1Pod
+from kubernetes.client.rest import ApiException
+
+from dsmlp.ext.kube import pod_gpus, to_namespace
+from dsmlp.plugin.kube import Namespace
+
+HTTP_GONE = 410
+
+
+class Informer:
+    """
+    Keeps an in-memory view of a Kubernetes resource with list+watch.
+
+    The resource is listed once, then watched from the list's resourceVersion. Watches are
+    resumed from the last seen resourceVersion; if that version has expired (410 Gone) the
+    resource is listed again. A full relist also happens every `resync_period` seconds to
+    correct any drift. Subclasses implement `list_func`, `replace` and `apply`.
+    """
+
+    def __init__(self, name: str, api_factory: Callable[[], CoreV1Api], resync_period: float = 300,
+                 watch_timeout: int = 240, retry_backoff: float = 5) -> None:
+        self.name = name
+        self.api_factory = api_factory
+        self.resync_period = resync_period
+        self.watch_timeout = watch_timeout
+        self.retry_backoff = retry_backoff
+        self.logger = logging.getLogger(__name__)
+        self.last_sync: Optional[float] = None
+        self.last_contact: Optional[float] = None
+        self._synced = threading.Event()
+        self._stopped = threading.Event()
+        self._watch: Optional[watch.Watch] = None
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def list_func(self, api: CoreV1Api) -> Callable:
+        raise NotImplementedError()
+
+    def replace(self, items: List) -> None:
+        """Replace the whole view with the result of a list call"""
+        raise NotImplementedError()
+
+    def apply(self, event_type: str, obj) -> None:
+        """Apply a single ADDED, MODIFIED or DELETED watch event"""
+        raise NotImplementedError()
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self.run, name=f"{self.name}-informer", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._watch is not None:
+            self._watch.stop()
+
+    def has_synced(self) -> bool:
+        return self._synced.is_set()
+
+    def wait_for_sync(self, timeout: Optional[float] = None) -> bool:
+        return self._synced.wait(timeout)
+
+    def age(self) -> Optional[float]:
+        """Seconds since the view was last confirmed against the API server, or None if never"""
+        if self.last_contact is None:
+            return None
+        return time.monotonic() - self.last_contact
+
+    def run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                self.list_and_watch()
+            except ApiException as ex:
+                if ex.status == HTTP_GONE:
+                    self.logger.info("%s informer resourceVersion expired, relisting", self.name)
+                    continue
+                self._failed(ex)
+            except Exception as ex:
+                self._failed(ex)
+
+    def list_and_watch(self) -> None:
+        func = self.list_func(self.api_factory())
+        listing = func()
+        self.replace(listing.items)
+        self.last_sync = self.last_contact = time.monotonic()
+        self._synced.set()
+
+        resource_version = listing.metadata.resource_version
+        resync_at = self.last_sync + self.resync_period
+        self._watch = watch.Watch()
+        while not self._stopped.is_set():
+            remaining = resync_at - time.monotonic()
+            if remaining <= 0:
+                return
+            for event in self._watch.stream(func, resource_version=resource_version,
+                                            timeout_seconds=int(min(self.watch_timeout, remaining)) + 1,
+                                            allow_watch_bookmarks=True):
+                if event['type'] in ('ADDED', 'MODIFIED', 'DELETED'):
+                    self.apply(event['type'], event['object'])
+                self.last_contact = time.monotonic()
+            self.last_contact = time.monotonic()
+            if self._watch.resource_version is not None:
+                resource_version = self._watch.resource_version
+
+    def _failed(self, ex: Exception) -> None:
+        # Stop answering from a view we can no longer keep current
+        self._synced.clear()
+        self.logger.error("%s informer failed: %s", self.name, ex)
+        self._stopped.wait(self.retry_backoff)
+
+
+class PodGpuLedger(Informer):
+    """
+    Tracks the number of GPUs held by the pods of every namespace. `pod_observer` is called
+    with a namespace and pod names as pods are listed or added.
+    """
+
+    def __init__(self, api_factory: Callable[[], CoreV1Api],
+                 pod_observer: Optional[Callable[[str, List[str]], None]] = None, **kwargs) -> None:
+        super().__init__("pod-gpu", api_factory, **kwargs)
+        self.pod_observer = pod_observer
+        self._pods: Dict[Tuple[str, str], int] = {}
+        self._totals: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def list_func(self, api: CoreV1Api) -> Callable:
+        return api.list_pod_for_all_namespaces
+
+    def replace(self, pods: List[V1Pod]) -> None:
+        held: Dict[Tuple[str, str], int] = {}
+        totals: Dict[str, int] = {}
+        for pod in pods:
+            gpus = pod_gpus(pod)
+            if gpus > 0:
+                key = (pod.metadata.namespace, pod.metadata.name)
+                held[key] = gpus
+                totals[key[0]] = totals.get(key[0], 0) + gpus
+
+        with self._lock:
+            self._pods = held
+            self._totals = totals
+
+        if self.pod_observer is not None:
+            names: Dict[str, List[str]] = {}
+            for namespace, name in held:
+                names.setdefault(namespace, []).append(name)
+            for namespace, pods in names.items():
+                self.pod_observer(namespace, pods)
+
+    def apply(self, event_type: str, pod: V1Pod) -> None:
+        key = (pod.metadata.namespace, pod.metadata.name)
+        gpus = 0 if event_type == 'DELETED' else pod_gpus(pod)
+
+        with self._lock:
+            previous = self._pods.pop(key, 0)
+            if gpus > 0:
+                self._pods[key] = gpus
+            total = self._totals.get(key[0], 0) - previous + gpus
+            if total > 0:
+                self._totals[key[0]] = total
+            else:
+                self._totals.pop(key[0], None)
+
+        if self.pod_observer is not None and gpus > 0:
+            self.pod_observer(key[0], [key[1]])
+
+    def gpus_in_namespace(self, namespace: str) -> int:
+        return self._totals.get(namespace, 0)
+
+
+class NamespaceCache(Informer):
+    """
+    Keeps the parsed Namespace of every namespace in the cluster.
+
+    `get` returns None on a miss, including before the first list completes, so callers
+    can fall back to reading the namespace directly. Namespaces restored from a snapshot are
+    served until then.
+    """
+
+    def __init__(self, api_factory: Callable[[], CoreV1Api], **kwargs) -> None:
+        super().__init__("namespace", api_factory, **kwargs)
+        self._namespaces: Dict[str, Namespace] = {}
+        self._restored = False
+        self.hits = 0
+        self.misses = 0
+
+    def list_func(self, api: CoreV1Api) -> Callable:
+        return api.list_namespace
+
+    def replace(self, namespaces: List[V1Namespace]) -> None:
+        self._namespaces = {ns.metadata.name: to_namespace(ns) for ns in namespaces}
+
+    def apply(self, event_type: str, namespace: V1Namespace) -> None:
+        if event_type == 'DELETED':
+            self._namespaces.pop(namespace.metadata.name, None)
+        else:
+            self._namespaces[namespace.metadata.name] = to_namespace(namespace)
+
+    def restore(self, namespaces: Dict[str, Namespace]) -> None:
+        if not self.has_synced():
+            self._namespaces = dict(namespaces)
+            self._restored = True
+
+    def get(self, name: str) -> Optional[Namespace]:
+        namespace = self._namespaces.get(name) if self.has_synced() or self._restored else None
+        if namespace is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return namespace
+
+    def __len__(self) -> int:
+        return len(self._namespaces)
@@ -1,65 +1,180 @@
-from typing import List
+import json
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
 
 from kubernetes import client, config
-from kubernetes.client import CoreV1Api, V1Namespace, V1ObjectMeta
+from kubernetes.client import CoreV1Api, V1Namespace, V1ObjectMeta, V1Pod
 from kubernetes.client.rest import ApiException
 
+from dsmlp.ext.kube_api import KubeApiProvider
 from dsmlp.plugin.kube import KubeClient, Namespace,  NotFound
 
 from dsmlp.app.config import *
 
+if TYPE_CHECKING:
+    from dsmlp.ext.breaker import Guard
+    from dsmlp.ext.informer import NamespaceCache, PodGpuLedger
+
+# Excludes pods that no longer hold GPUs, server side
+NON_TERMINAL_PODS = ','.join(f'status.phase!={phase}' for phase in TERMINAL_POD_PHASES)
+
+
+def pod_gpus(pod: V1Pod) -> int:
+    """
+    Number of GPUs held by a pod. Pods in a terminal phase no longer hold any.
+    """
+    if pod.status is not None and pod.status.phase in TERMINAL_POD_PHASES:
+        return 0
+
+    gpu_count = 0
+    for container in pod.spec.containers:
+        requested, limit = 0, 0
+        try:
+            requested = int(container.resources.requests[GPU_LABEL])
+        except (KeyError, AttributeError, TypeError):
+            pass
+        try:
+            limit = int(container.resources.limits[GPU_LABEL])
+        except (KeyError, AttributeError, TypeError):
+            pass
+
+        gpu_count += max(requested, limit)
+
+    return gpu_count
+
+
+def raw_pod_gpus(pod: Dict[str, Any]) -> int:
+    """pod_gpus for a pod as decoded from the API server's JSON"""
+    if (pod.get('status') or {}).get('phase') in TERMINAL_POD_PHASES:
+        return 0
+
+    gpu_count = 0
+    for container in pod['spec']['containers']:
+        resources = container.get('resources') or {}
+        requested, limit = 0, 0
+        try:
+            requested = int(resources['requests'][GPU_LABEL])
+        except (KeyError, TypeError):
+            pass
+        try:
+            limit = int(resources['limits'][GPU_LABEL])
+        except (KeyError, TypeError):
+            pass
+
+        gpu_count += max(requested, limit)
+
+    return gpu_count
+
+
+def to_namespace(v1namespace: V1Namespace) -> Namespace:
+    metadata: V1ObjectMeta = v1namespace.metadata
+
+    gpu_quota = 1
+    if metadata is not None and metadata.annotations is not None and GPU_LIMIT_ANNOTATION in metadata.annotations:
+        gpu_quota = int(metadata.annotations[GPU_LIMIT_ANNOTATION])
+
+    return Namespace(
+        name=metadata.name,
+        labels=metadata.labels,
+        gpu_quota=gpu_quota)
+
 
 class DefaultKubeClient(KubeClient):
     """
     See https://github.com/kubernetes-client/python/blob/master/kubernetes/README.md
     """
 
+    def __init__(self, gpu_ledger: Optional['PodGpuLedger'] = None,
+                 namespace_cache: Optional['NamespaceCache'] = None,
+                 api_provider: Optional[KubeApiProvider] = None,
+                 pod_observer: Optional[Callable[[str, List[str], float], None]] = None,
+                 raw_reads: bool = False, request_timeout: Optional[float] = None,
+                 guard: Optional['Guard'] = None) -> None:
+        """
+        Lookups give up after `request_timeout` seconds, if set, whatever the API client's own
+        timeout. With a `guard`, lookups that go to the API server are made through it; answers
+        from the namespace cache and the GPU ledger are in memory and never are.
+
+        `pod_observer` is called with a namespace, the names of its pods and the time.monotonic()
+        at which the list was requested, whenever they are listed.
+
+        With `raw_reads`, pods are listed without building V1Pod models: the JSON response is
+        decoded as is and only the container resources are read. Terminal pods are filtered out
+        by the API server, and lists are served from its watch cache (resourceVersion=0), which
+        may trail etcd slightly; GPU reservations cover pods admitted in the meantime.
+        """
+        self.gpu_ledger = gpu_ledger
+        self.raw_reads = raw_reads
+        self.request_timeout = request_timeout
+        self.guard = guard
+        self.pod_observer = pod_observer
+        self.namespace_cache = namespace_cache
+        self.api_provider = api_provider if api_provider is not None else KubeApiProvider()
+
     def get_namespace(self, name: str) -> Namespace:
-        api = self.get_policy_api()
-        v1namespace: V1Namespace = api.read_namespace(name=name)
-        metadata: V1ObjectMeta = v1namespace.metadata
+        if self.namespace_cache is not None:
+            self.namespace_cache.start()
+            namespace = self.namespace_cache.get(name)
+            if namespace is not None:
+                return namespace
 
-        gpu_quota = 1
-        if metadata is not None and metadata.annotations is not None and GPU_LIMIT_ANNOTATION in metadata.annotations:
-            gpu_quota = int(metadata.annotations[GPU_LIMIT_ANNOTATION])
+        return self.call(self.read_namespace, name)
 
-        return Namespace(
-            name=metadata.name,
-            labels=metadata.labels,
-            gpu_quota=gpu_quota)
+    def read_namespace(self, name: str) -> Namespace:
+        api = self.get_policy_api()
+        v1namespace: V1Namespace = api.read_namespace(name=name, **self.request_options())
+        return to_namespace(v1namespace)
 
     def get_gpus_in_namespace(self, name: str) -> int:
+        if self.gpu_ledger is not None:
+            self.gpu_ledger.start()
+            if self.gpu_ledger.has_synced():
+                return self.gpu_ledger.gpus_in_namespace(name)
+
+        return self.call(self.list_gpus_in_namespace, name)
+
+    def list_gpus_in_namespace(self, name: str) -> int:
+        if self.raw_reads:
+            return self.get_gpus_in_namespace_raw(name)
+
         api = self.get_policy_api()
-        V1Namespace: V1Namespace = api.read_namespace(name=name)
-        pods = api.list_namespaced_pod(namespace=name)
+        V1Namespace: V1Namespace = api.read_namespace(name=name, **self.request_options())
+        listed_at = time.monotonic()
+        pods = api.list_namespaced_pod(namespace=name, **self.request_options())
+        if self.pod_observer is not None:
+            self.pod_observer(name, [pod.metadata.name for pod in pods.items], listed_at)
+
+        return sum(pod_gpus(pod) for pod in pods.items)
+
+    def get_gpus_in_namespace_raw(self, name: str) -> int:
+        listed_at = time.monotonic()
+        pods = self.list_raw_pods(name)
+        if self.pod_observer is not None:
+            # Terminal pods are not listed: their reservations are released by timeout instead
+            self.pod_observer(name, [pod['metadata']['name'] for pod in pods], listed_at)
 
-        gpu_count = 0
-        for pod in pods.items:
-            for container in pod.spec.containers:
-                requested, limit = 0, 0
-                try:
-                    requested = int(container.resources.requests[GPU_LABEL])
-                except (KeyError, AttributeError, TypeError):
-                    pass
-                try:
-                    limit = int(container.resources.limits[GPU_LABEL])
-                except (KeyError, AttributeError, TypeError):
-                    pass
+        return sum(raw_pod_gpus(pod) for pod in pods)
 
-                gpu_count += max(requested, limit)
+    def list_raw_pods(self, name: str) -> List[Dict[str, Any]]:
+        """The non-terminal pods of a namespace, as decoded from JSON"""
+        api = self.get_policy_api()
+        response = api.list_namespaced_pod(namespace=name, field_selector=NON_TERMINAL_PODS, resource_version='0',
+                                           _preload_content=False, **self.request_options())
+        try:
+            return json.loads(response.data)['items'] or []
+        finally:
+            response.release_conn()
 
-        return gpu_count
+    def call(self, fn: Callable[[str], Any], name: str) -> Any:
+        return self.guard.call(fn, name) if self.guard is not None else fn(name)
 
-    # noinspection PyMethodMayBeStatic
+    def request_options(self) -> Dict[str, Any]:
+        return {'_request_timeout': self.request_timeout} if self.request_timeout is not None else {}
+
+    def list_namespace_names(self, label_selector: Optional[str] = None) -> List[str]:
+        api = self.get_policy_api()
+        return [namespace.metadata.name for namespace in api.list_namespace(label_selector=label_selector).items]
 
     def get_policy_api(self) -> CoreV1Api:
-        try:
-            config.load_incluster_config()
-        except config.ConfigException:
-            try:
-                config.load_kube_config()
-            except config.ConfigException:
-                raise Exception("Could not configure kubernetes python client")
-
-        coreapi = client.CoreV1Api()
-        return coreapi
+        return self.api_provider.core_v1()
+
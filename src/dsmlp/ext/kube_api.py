@@ -0,0 +1,106 @@
+import threading
+import time
+from typing import Callable, Optional
+
+from kubernetes import client, config
+from kubernetes.client import ApiClient, Configuration, CoreV1Api
+
+
+class TokenBucket:
+    """
+    Client-side rate limiter allowing `qps` requests per second with bursts of up to `burst`.
+    """
+
+    def __init__(self, qps: float, burst: int, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep) -> None:
+        self.qps = qps
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = float(burst)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.qps <= 0:
+            return
+
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.qps)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.qps if self._tokens < 0 else 0
+
+        if wait > 0:
+            self.sleep(wait)
+
+
+class PooledApiClient(ApiClient):
+    """
+    ApiClient that rate limits every request and applies a default timeout.
+
+    Watch requests are exempt from the default timeout because they are expected to stay open.
+    """
+
+    def __init__(self, configuration: Configuration, limiter: TokenBucket,
+                 request_timeout: Optional[float] = None) -> None:
+        super().__init__(configuration)
+        self.limiter = limiter
+        self.request_timeout = request_timeout
+
+    def request(self, method, url, query_params=None, headers=None, post_params=None, body=None,
+                _preload_content=True, _request_timeout=None):
+        self.limiter.acquire()
+        if _request_timeout is None and not any(key == 'watch' for key, _ in query_params or []):
+            _request_timeout = self.request_timeout
+
+        return super().request(method, url, query_params=query_params, headers=headers,
+                               post_params=post_params, body=body, _preload_content=_preload_content,
+                               _request_timeout=_request_timeout)
+
+
+class KubeApiProvider:
+    """
+    Builds one long-lived, thread-safe CoreV1Api so every Kubernetes call reuses the same
+    configuration and urllib3 connection pool.
+
+    In-cluster, the service account token is re-read by the config loader's refresh hook
+    whenever it is due, so projected token rotation is picked up without rebuilding the client.
+    """
+
+    def __init__(self, pool_size: int = 16, qps: float = 50, burst: int = 100,
+                 request_timeout: Optional[float] = 10) -> None:
+        self.pool_size = pool_size
+        self.limiter = TokenBucket(qps, burst)
+        self.request_timeout = request_timeout
+        self._api: Optional[CoreV1Api] = None
+        self._lock = threading.Lock()
+
+    def core_v1(self) -> CoreV1Api:
+        api = self._api
+        if api is not None:
+            return api
+
+        with self._lock:
+            if self._api is None:
+                self._api = client.CoreV1Api(self.create_api_client())
+            return self._api
+
+    def create_api_client(self) -> ApiClient:
+        configuration = Configuration()
+        try:
+            config.load_incluster_config(client_configuration=configuration)
+        except config.ConfigException:
+            try:
+                config.load_kube_config(client_configuration=configuration)
+            except config.ConfigException:
+                raise Exception("Could not configure kubernetes python client")
+
+        configuration.connection_pool_maxsize = self.pool_size
+        return PooledApiClient(configuration, self.limiter, self.request_timeout)
+
+    def reset(self) -> None:
+        """Drop the current client so the next call reloads configuration"""
+        with self._lock:
+            self._api = None
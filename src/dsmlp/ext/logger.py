@@ -1,16 +1,71 @@
-from dsmlp.plugin.logger import Logger
 import logging
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from dsmlp.plugin.logger import Logger, StructuredMessage
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Hands records to a background QueueListener without formatting them first, so message
+    text is built on the writer thread. Records are dropped rather than blocking the caller
+    when the queue is full.
+    """
+
+    def __init__(self, log_queue: queue.Queue) -> None:
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener: Optional[QueueListener] = None
+_listener_lock = threading.Lock()
+
+
+def start_background_logging(logger: logging.Logger, queue_size: int = 10000) -> None:
+    """
+    Route `logger` through a queue so its records are written by a background thread with
+    the root logger's handlers.
+    """
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            return
+
+        log_queue = queue.Queue(maxsize=queue_size)
+        handlers = logging.getLogger().handlers or [logging.StreamHandler()]
+        _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        logger.addHandler(DeferredQueueHandler(log_queue))
+        logger.propagate = False
+        _listener.start()
 
 
 class PythonLogger(Logger):
-    def __init__(self, logger: logging.Logger) -> None:
+    def __init__(self, logger: logging.Logger, background: bool = False) -> None:
         self.logger = logging.getLogger('dsmlp')
+        if background:
+            start_background_logging(self.logger)
 
-    def debug(self, message: str):
-        self.logger.debug(message)
+    def debug(self, message: str, **fields):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(StructuredMessage(message, fields))
 
-    def info(self, message: str):
-        self.logger.info(message)
+    def info(self, message: str, **fields):
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info(StructuredMessage(message, fields))
 
     def exception(self, exception):
         self.logger.exception(exception)
+
+    def is_debug_enabled(self) -> bool:
+        return self.logger.isEnabledFor(logging.DEBUG)
@@ -0,0 +1,352 @@
+"""
+AWSEd and namespace lookups cached in a memory-mapped file shared by every validator process
+on a node (put it on a tmpfs such as /dev/shm), so N workers hold and fetch one copy.
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from dsmlp.ext.decision_log import decode_lookup, encode_lookup
+from dsmlp.plugin.awsed import AwsedClient, ListTeamsResponse, UserResponse
+from dsmlp.plugin.kube import KubeClient, Namespace
+
+MAGIC = b'DSMLPSH1'
+# magic, slots, slot size
+FILE_HEADER = struct.Struct('<8sII')
+# read_at, then the fields guarded by seq: seq, key hash, stored_at, key length, value length
+SLOT_HEADER = struct.Struct('<dIQdHI')
+SEQ = struct.Struct('<I')
+SEQ_OFFSET = 8
+
+
+def key_hash(key: bytes) -> int:
+    # Python's hash() differs between processes. 0 marks an empty slot.
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little') or 1
+
+
+class SharedTable:
+    """
+    Fixed-size hash table of byte strings in a memory-mapped file shared by every process
+    that opens it.
+
+    Readers take no lock: a writer makes a slot's sequence number odd while it changes the
+    slot, and readers retry a copy during which the sequence number was odd or changed (a
+    seqlock). Writers serialize on a lock of the file. A key lives in one of `probe` slots
+    from its hash; when all of them are taken, the least recently written one is replaced.
+
+    Open the table in each process, after forking: the file lock belongs to the open file.
+    """
+
+    def __init__(self, path: str, slots: int = 16384, slot_size: int = 2048, probe: int = 8,
+                 clock: Callable[[], float] = time.time) -> None:
+        self.path = path
+        self.probe = probe
+        self.clock = clock
+        self._write_lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self._locked():
+            self.slots, self.slot_size = self._init_file(slots, slot_size)
+        self._mm = mmap.mmap(self._fd, FILE_HEADER.size + self.slots * self.slot_size)
+        self.evictions = 0
+        self.oversized = 0
+        self.contended = 0
+
+    def _init_file(self, slots: int, slot_size: int) -> Tuple[int, int]:
+        """Use the geometry of an existing table, or format the file. Caller holds the file lock."""
+        header = os.pread(self._fd, FILE_HEADER.size, 0)
+        if len(header) == FILE_HEADER.size:
+            magic, existing_slots, existing_slot_size = FILE_HEADER.unpack(header)
+            if magic == MAGIC and os.fstat(self._fd).st_size == FILE_HEADER.size + existing_slots * existing_slot_size:
+                return existing_slots, existing_slot_size
+
+        os.ftruncate(self._fd, 0)
+        os.ftruncate(self._fd, FILE_HEADER.size + slots * slot_size)
+        os.pwrite(self._fd, FILE_HEADER.pack(MAGIC, slots, slot_size), 0)
+        return slots, slot_size
+
+    def get(self, key: str) -> Optional[Tuple[bytes, float]]:
+        """(value, stored_at) of a key, or None"""
+        encoded = key.encode()
+        h = key_hash(encoded)
+        for offset in self._candidates(h):
+            slot = self._read_slot(offset)
+            if slot is None:
+                self.contended += 1
+                return None
+            _, _, slot_hash, stored_at, key_len, value_len = SLOT_HEADER.unpack_from(slot)
+            if slot_hash == 0:
+                return None
+            start = SLOT_HEADER.size
+            if slot_hash == h and slot[start:start + key_len] == encoded:
+                # Not guarded by the seqlock: a lost or misplaced read time only affects refreshes
+                struct.pack_into('<d', self._mm, offset, self.clock())
+                return slot[start + key_len:start + key_len + value_len], stored_at
+        return None
+
+    def put(self, key: str, value: bytes, stored_at: Optional[float] = None) -> bool:
+        """Store a value. Returns False if it does not fit in a slot."""
+        encoded = key.encode()
+        if SLOT_HEADER.size + len(encoded) + len(value) > self.slot_size:
+            self.oversized += 1
+            return False
+
+        h = key_hash(encoded)
+        stored_at = self.clock() if stored_at is None else stored_at
+        with self._write_lock, self._locked():
+            offset = self._slot_for(h, encoded)
+            # Odd already if a writer died mid-put (dsmlp-server kills stuck workers): this write repairs it
+            seq = SEQ.unpack_from(self._mm, offset + SEQ_OFFSET)[0] | 1
+            SEQ.pack_into(self._mm, offset + SEQ_OFFSET, seq)
+            body = SLOT_HEADER.pack(0, seq, h, stored_at, len(encoded), len(value)) + encoded + value
+            self._mm[offset + SEQ_OFFSET + SEQ.size:offset + len(body)] = body[SEQ_OFFSET + SEQ.size:]
+            SEQ.pack_into(self._mm, offset + SEQ_OFFSET, (seq + 1) & 0xffffffff)
+        return True
+
+    def items(self) -> Iterator[Tuple[str, bytes, float, float]]:
+        """(key, value, stored_at, read_at) of every entry"""
+        for index in range(self.slots):
+            slot = self._read_slot(FILE_HEADER.size + index * self.slot_size)
+            if slot is None:
+                continue
+            read_at, _, slot_hash, stored_at, key_len, value_len = SLOT_HEADER.unpack_from(slot)
+            if slot_hash != 0:
+                start = SLOT_HEADER.size
+                yield (slot[start:start + key_len].decode(), slot[start + key_len:start + key_len + value_len],
+                       stored_at, read_at)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.items())
+
+    def close(self) -> None:
+        self._mm.close()
+        os.close(self._fd)
+
+    def _candidates(self, h: int) -> Iterator[int]:
+        for i in range(min(self.probe, self.slots)):
+            yield FILE_HEADER.size + ((h + i) % self.slots) * self.slot_size
+
+    def _slot_for(self, h: int, encoded: bytes) -> int:
+        """The slot holding the key, else the first empty one, else the least recently written"""
+        oldest = None
+        for offset in self._candidates(h):
+            _, _, slot_hash, stored_at, key_len, _ = SLOT_HEADER.unpack_from(self._mm, offset)
+            start = offset + SLOT_HEADER.size
+            if slot_hash == 0 or (slot_hash == h and self._mm[start:start + key_len] == encoded):
+                return offset
+            if oldest is None or stored_at < oldest[1]:
+                oldest = (offset, stored_at)
+        self.evictions += 1
+        return oldest[0]
+
+    def _read_slot(self, offset: int, attempts: int = 100) -> Optional[bytes]:
+        for _ in range(attempts):
+            before, = SEQ.unpack_from(self._mm, offset + SEQ_OFFSET)
+            if before & 1:
+                continue
+            # Copy only the header and the bytes in use; lengths read mid-write are caught below
+            _, _, _, _, key_len, value_len = SLOT_HEADER.unpack_from(self._mm, offset)
+            end = min(SLOT_HEADER.size + key_len + value_len, self.slot_size)
+            slot = self._mm[offset:offset + end]
+            after, = SEQ.unpack_from(self._mm, offset + SEQ_OFFSET)
+            if before == after:
+                return slot
+        return None
+
+    def _locked(self):
+        return FileLock(self._fd)
+
+
+class FileLock:
+    def __init__(self, fd: int) -> None:
+        self.fd = fd
+
+    def __enter__(self):
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+
+class SharedLookupCache:
+    """
+    Lookups of several kinds in a SharedTable, each kind expiring after its TTL.
+
+    One process on the node, whichever holds the refresher lock, re-fetches in the background
+    the entries read since they were stored once `refresh_ahead` of their TTL has elapsed;
+    if it exits, another takes over. Other processes only fetch on a miss. When a fetch
+    fails, an expired entry is served for up to `stale_ttl` seconds past its expiry. Failed
+    fetches are not stored, and with `negative_ttl` set, a None expires after that many seconds.
+    """
+
+    def __init__(self, name: str, table: SharedTable, loaders: Dict[str, Callable[[str], Any]],
+                 ttls: Dict[str, float], stale_ttl: float = 0, refresh_ahead: float = 0.8,
+                 refresh_period: float = 1, workers: int = 4, negative_ttl: Optional[float] = None) -> None:
+        self.name = name
+        self.table = table
+        self.loaders = loaders
+        self.ttls = ttls
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self.refresh_ahead = refresh_ahead
+        self.refresh_period = refresh_period
+        self.workers = workers
+        self.logger = logging.getLogger(__name__)
+        self._lock_fd: Optional[int] = None
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.refreshes = 0
+        self.sync_errors = 0
+
+    def get(self, kind: str, key: str) -> Any:
+        self.start()
+        entry = self.table.get(f'{kind}:{key}')
+        now = self.table.clock()
+        cached = self._decode(kind, entry[0]) if entry is not None else None
+        if entry is not None and now < entry[1] + self._ttl(kind, cached):
+            self.hits += 1
+            return cached
+
+        self.misses += 1
+        try:
+            value = self.loaders[kind](key)
+        except Exception:
+            if entry is not None and now < entry[1] + self._ttl(kind, cached) + self.stale_ttl:
+                self.stale_hits += 1
+                return cached
+            raise
+
+        self._store(kind, key, value)
+        return value
+
+    def _ttl(self, kind: str, value: Any) -> float:
+        return self.negative_ttl if value is None and self.negative_ttl is not None else self.ttls[kind]
+
+    def is_refresher(self) -> bool:
+        return self._lock_fd is not None
+
+    def __len__(self) -> int:
+        return sum(1 for key, _, _, _ in self.table.items() if key.split(':', 1)[0] in self.loaders)
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self.run, name=f"{self.name}-refresh", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def run(self) -> None:
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"{self.name}-refresh") as executor:
+            while not self._stopped.wait(self.refresh_period):
+                if self.is_refresher() or self._become_refresher():
+                    try:
+                        self.refresh(executor)
+                    except Exception as ex:
+                        self.sync_errors += 1
+                        self.logger.error("Shared cache %s refresh failed: %s", self.name, ex)
+
+    def refresh(self, executor: Optional[ThreadPoolExecutor] = None) -> None:
+        """Re-fetch the entries read since they were stored that are due for a refresh"""
+        now = self.table.clock()
+        due = []
+        for table_key, _, stored_at, read_at in self.table.items():
+            kind, key = table_key.split(':', 1)
+            if kind in self.loaders and read_at > stored_at and now >= stored_at + self.ttls[kind] * self.refresh_ahead:
+                due.append((kind, key))
+
+        fetch = executor.map if executor is not None else map
+        for ok in fetch(lambda item: self._refresh(*item), due):
+            if not ok:
+                self.sync_errors += 1
+
+    def _refresh(self, kind: str, key: str) -> bool:
+        try:
+            value = self.loaders[kind](key)
+        except Exception as ex:
+            self.logger.debug("Shared cache %s could not refresh %s %s: %s", self.name, kind, key, ex)
+            return False
+        self._store(kind, key, value)
+        self.refreshes += 1
+        return True
+
+    def _become_refresher(self) -> bool:
+        fd = os.open(f'{self.table.path}.{self.name}.lock', os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self.logger.info("Refreshing shared cache %s from pid %d", self.name, os.getpid())
+        self._lock_fd = fd
+        return True
+
+    def _store(self, kind: str, key: str, value: Any) -> None:
+        self.table.put(f'{kind}:{key}', json.dumps(encode_lookup(value, None)).encode())
+
+    @staticmethod
+    def _decode(kind: str, value: bytes) -> Any:
+        result, _ = decode_lookup(kind, json.loads(value))
+        return result
+
+
+class SharedCacheAwsedClient(AwsedClient):
+    """Wraps another AwsedClient with a SharedLookupCache"""
+
+    def __init__(self, client: AwsedClient, table: SharedTable, user_ttl: float = 300, teams_ttl: float = 300,
+                 quota_ttl: float = 60, stale_ttl: float = 3600, negative_ttl: float = 10) -> None:
+        self.client = client
+        self.cache = SharedLookupCache(
+            'awsed-shared', table,
+            loaders={'user': client.describe_user, 'teams': client.list_user_teams,
+                     'gpu_quota': client.get_user_gpu_quota},
+            ttls={'user': user_ttl, 'teams': teams_ttl, 'gpu_quota': quota_ttl},
+            stale_ttl=stale_ttl, negative_ttl=negative_ttl)
+
+    def describe_user(self, username: str) -> UserResponse:
+        return self.cache.get('user', username)
+
+    def list_user_teams(self, username: str) -> ListTeamsResponse:
+        return self.cache.get('teams', username)
+
+    def get_user_gpu_quota(self, username: str) -> int:
+        return self.cache.get('gpu_quota', username)
+
+
+class SharedCacheKubeClient(KubeClient):
+    """
+    Wraps another KubeClient with a SharedLookupCache of namespaces. GPU usage changes too
+    quickly to be shared and is always read through `client`.
+    """
+
+    def __init__(self, client: KubeClient, table: SharedTable, namespace_ttl: float = 60,
+                 stale_ttl: float = 3600) -> None:
+        self.client = client
+        self.cache = SharedLookupCache('namespaces-shared', table, loaders={'namespace': client.get_namespace},
+                                       ttls={'namespace': namespace_ttl}, stale_ttl=stale_ttl)
+
+    def get_namespace(self, name: str) -> Namespace:
+        return self.cache.get('namespace', name)
+
+    def get_gpus_in_namespace(self, name: str) -> int:
+        return self.client.get_gpus_in_namespace(name)
+
+    def __getattr__(self, name: str):
+        return getattr(self.client, name)
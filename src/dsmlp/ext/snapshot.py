@@ -0,0 +1,213 @@
+"""
+Last-known-good AWSEd and namespace lookups, persisted to an sqlite file.
+
+A new process loads the snapshot at startup to warm its caches, so it can admit pods before
+AWSEd or the API server have been asked anything. While running, successful lookups are
+remembered and written back periodically, and remembered answers are served when AWSEd or
+the API server fail.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from dsmlp.ext.awsed_replica import AwsedReplica
+from dsmlp.ext.cache import TTLCache
+from dsmlp.ext.decision_log import decode_lookup, encode_lookup
+from dsmlp.ext.informer import NamespaceCache
+from dsmlp.plugin.awsed import AwsedClient, ListTeamsResponse, UserResponse
+from dsmlp.plugin.kube import KubeClient, Namespace
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lookups (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    saved_at REAL NOT NULL,
+    PRIMARY KEY (kind, key)
+)
+"""
+
+
+class LookupSnapshot:
+    """
+    Lookup results by (kind, key), where kind is an AdmissionContext lookup name. Values are
+    held in memory; `save` writes the entries changed since the last save to `path`.
+    """
+
+    def __init__(self, path: str, max_age: float = 86400, clock: Callable[[], float] = time.time) -> None:
+        self.path = path
+        self.max_age = max_age
+        self.clock = clock
+        self.logger = logging.getLogger(__name__)
+        self._values: Dict[Tuple[str, str], Tuple[Any, float]] = {}
+        self._dirty: Dict[Tuple[str, str], Tuple[Any, float]] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def remember(self, kind: str, key: str, value: Any) -> None:
+        entry = (value, self.clock())
+        with self._lock:
+            self._values[(kind, key)] = entry
+            self._dirty[(kind, key)] = entry
+
+    def recall(self, kind: str, key: str) -> Tuple[bool, Any]:
+        """(True, value) if a value younger than max_age is known, else (False, None)"""
+        entry = self._values.get((kind, key))
+        if entry is None or self.clock() - entry[1] > self.max_age:
+            return False, None
+        return True, entry[0]
+
+    def items(self, kind: str) -> Iterator[Tuple[str, Any, float]]:
+        """(key, value, saved_at) of every entry of a kind"""
+        with self._lock:
+            entries = [(key, value, saved_at) for (k, key), (value, saved_at) in self._values.items() if k == kind]
+        return iter(entries)
+
+    def load(self) -> int:
+        """Read the snapshot file, skipping entries older than max_age. Returns the number loaded."""
+        oldest = self.clock() - self.max_age
+        try:
+            with self._connect() as db:
+                rows = db.execute("SELECT kind, key, value, saved_at FROM lookups WHERE saved_at >= ?",
+                                  (oldest,)).fetchall()
+        except sqlite3.Error as ex:
+            self.logger.error("Could not load snapshot %s: %s", self.path, ex)
+            return 0
+
+        loaded = 0
+        with self._lock:
+            for kind, key, value, saved_at in rows:
+                result, error = decode_lookup(kind, json.loads(value))
+                if error is None and (kind, key) not in self._values:
+                    self._values[(kind, key)] = (result, saved_at)
+                    loaded += 1
+        self.logger.info("Loaded %d lookups from snapshot %s", loaded, self.path)
+        return loaded
+
+    def save(self) -> int:
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return 0
+
+        rows = [(kind, key, json.dumps(encode_lookup(value, None)), saved_at)
+                for (kind, key), (value, saved_at) in dirty.items()]
+        try:
+            with self._connect() as db:
+                db.executemany("INSERT OR REPLACE INTO lookups (kind, key, value, saved_at) VALUES (?, ?, ?, ?)", rows)
+                db.execute("DELETE FROM lookups WHERE saved_at < ?", (self.clock() - self.max_age,))
+        except sqlite3.Error as ex:
+            self.logger.error("Could not save snapshot %s: %s", self.path, ex)
+            with self._lock:
+                # Retry on the next save, unless newer values were remembered meanwhile
+                self._dirty = {**dirty, **self._dirty}
+            return 0
+        return len(rows)
+
+    def start(self, interval: float = 60) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self.run, args=(interval,), name="snapshot", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def run(self, interval: float) -> None:
+        while not self._stopped.wait(interval):
+            self.save()
+        self.save()
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, timeout=5)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(SCHEMA)
+        return db
+
+
+class SnapshotAwsedClient(AwsedClient):
+    """
+    Remembers the answers of `client` in a snapshot, and unless `fallback` is false, answers
+    from it when `client` fails
+    """
+
+    def __init__(self, client: AwsedClient, snapshot: LookupSnapshot, fallback: bool = True) -> None:
+        self.client = client
+        self.snapshot = snapshot
+        self.fallback = fallback
+
+    def describe_user(self, username: str) -> UserResponse:
+        return self._call('user', username, self.client.describe_user)
+
+    def list_user_teams(self, username: str) -> ListTeamsResponse:
+        return self._call('teams', username, self.client.list_user_teams)
+
+    def get_user_gpu_quota(self, username: str) -> int:
+        return self._call('gpu_quota', username, self.client.get_user_gpu_quota)
+
+    def _call(self, kind: str, key: str, method: Callable[[str], Any]) -> Any:
+        return call_with_snapshot(self.snapshot, kind, key, method, self.fallback)
+
+
+class SnapshotKubeClient(KubeClient):
+    """
+    Remembers namespaces read through `client` in a snapshot, and unless `fallback` is false,
+    answers from it when `client` fails. GPU usage changes too quickly to be snapshotted and
+    is always read live.
+    """
+
+    def __init__(self, client: KubeClient, snapshot: LookupSnapshot, fallback: bool = True) -> None:
+        self.client = client
+        self.snapshot = snapshot
+        self.fallback = fallback
+
+    def get_namespace(self, name: str) -> Namespace:
+        return call_with_snapshot(self.snapshot, 'namespace', name, self.client.get_namespace, self.fallback)
+
+    def get_gpus_in_namespace(self, name: str) -> int:
+        return self.client.get_gpus_in_namespace(name)
+
+    def __getattr__(self, name: str):
+        return getattr(self.client, name)
+
+
+def call_with_snapshot(snapshot: LookupSnapshot, kind: str, key: str, method: Callable[[str], Any],
+                       fallback: bool = True) -> Any:
+    try:
+        value = method(key)
+    except Exception:
+        if not fallback:
+            raise
+        known, value = snapshot.recall(kind, key)
+        if not known:
+            raise
+        snapshot.logger.warning("Serving %s %s from snapshot", kind, key)
+        return value
+
+    snapshot.remember(kind, key, value)
+    return value
+
+
+def warm_cache(cache: TTLCache, snapshot: LookupSnapshot, kind: str) -> None:
+    """Fill a cache with snapshot values, due for a background refresh on their first read"""
+    loaded_at = cache.clock() - (cache.ttl * cache.refresh_ahead if cache.background_refresh else 0)
+    for key, value, saved_at in snapshot.items(kind):
+        cache.put(key, value, loaded_at=loaded_at)
+
+
+def warm_replica(replica: AwsedReplica, snapshot: LookupSnapshot) -> None:
+    users = {key: (value, saved_at) for key, value, saved_at in snapshot.items('user')}
+    teams = {key: value for key, value, saved_at in snapshot.items('teams')}
+    quotas = {key: value for key, value, saved_at in snapshot.items('gpu_quota')}
+    now = snapshot.clock()
+    for username, (user, saved_at) in users.items():
+        if username in teams and username in quotas:
+            replica.restore(username, user, teams[username], quotas[username], age=now - saved_at)
+
+
+def warm_namespace_cache(namespace_cache: NamespaceCache, snapshot: LookupSnapshot) -> None:
+    namespace_cache.restore({key: value for key, value, saved_at in snapshot.items('namespace')})
@@ -42,5 +42,18 @@ class AwsedClient(metaclass=ABCMeta):
         # Return the quota (DICT) of a user
         pass
 
+class AsyncAwsedClient(metaclass=ABCMeta):
+    @abstractmethod
+    async def list_user_teams(self, username: str) -> ListTeamsResponse:
+        pass
+
+    @abstractmethod
+    async def describe_user(self, username: str) -> UserResponse:
+        pass
+
+    @abstractmethod
+    async def get_user_gpu_quota(self, username: str) -> int:
+        pass
+
 class UnsuccessfulRequest(Exception):
     pass
@@ -0,0 +1,13 @@
+from abc import ABCMeta, abstractmethod
+from typing import Any, Dict, Optional, Tuple
+
+
+class DecisionLog(metaclass=ABCMeta):
+    @abstractmethod
+    def record(self, review: Dict[str, Any], response: Dict[str, Any], timings: Dict[str, float],
+               lookups: Dict[str, Tuple[Any, Optional[Exception]]]):
+        """
+        Append an admission decision: the AdmissionReview as received, the response, the seconds
+        spent in each stage and the (result, error) of each dependency lookup. Must not block.
+        """
+        pass
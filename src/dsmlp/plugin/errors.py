@@ -0,0 +1,7 @@
+class DependencyUnavailable(Exception):
+    """AWSEd or Kubernetes did not answer in time or is failing; `dependency` is 'awsed' or 'kube'"""
+
+    def __init__(self, dependency: str, reason: str) -> None:
+        self.dependency = dependency
+        self.reason = reason
+        super().__init__(f"{dependency} unavailable: {reason}")
@@ -25,3 +25,15 @@ class KubeClient(metaclass=ABCMeta):
     def get_gpus_in_namespace(self) -> int:
         """Get # of GPUs in Namespace"""
         pass
+
+
+class AsyncKubeClient(metaclass=ABCMeta):
+    @abstractmethod
+    async def get_namespace(self, name: str) -> Namespace:
+        """Get a namespace"""
+        pass
+
+    @abstractmethod
+    async def get_gpus_in_namespace(self, name: str) -> int:
+        """Get # of GPUs in Namespace"""
+        pass
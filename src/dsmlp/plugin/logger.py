@@ -1,15 +1,48 @@
+import json
 from abc import ABCMeta, abstractmethod
+from typing import Any, Dict
+
+
+class StructuredMessage:
+    """
+    A log message with key=value fields. The text is only built when the message is written.
+    """
+    __slots__ = ('message', 'fields')
+
+    def __init__(self, message: str, fields: Dict[str, Any]) -> None:
+        self.message = message
+        self.fields = fields
+
+    def __str__(self) -> str:
+        if not self.fields:
+            return self.message
+        return self.message + " " + " ".join(f"{key}={value}" for key, value in self.fields.items())
+
+
+class LazyJson:
+    """A log field that is serialized to JSON only when written"""
+    __slots__ = ('value',)
+
+    def __init__(self, value: Any) -> None:
+        self.value = value
+
+    def __str__(self) -> str:
+        return json.dumps(self.value, indent=2)
 
 
 class Logger(metaclass=ABCMeta):
     @abstractmethod
-    def debug(self, message: str):
+    def debug(self, message: str, **fields):
         pass
 
     @abstractmethod
-    def info(self, message: str):
+    def info(self, message: str, **fields):
         pass
 
     @abstractmethod
     def exception(self, message: str):
         pass
+
+    def is_debug_enabled(self) -> bool:
+        """Lets callers skip building expensive debug fields"""
+        return True
@@ -0,0 +1,351 @@
+"""
+Pre-fork multi-process server.
+
+    dsmlp-server --listen 0.0.0.0:8080 --workers 4 --threads 8
+
+The supervisor imports the heavy modules (kubernetes models, dataclasses_json, the AWSEd
+client, flask, waitress), moves them out of the garbage collector's reach with gc.freeze()
+so that workers do not dirty the pages they share with it, binds the listening socket and
+forks the workers. Each worker creates its own AppFactory (clients, caches, background
+threads) and serves the inherited socket with waitress, or with --reuse-port binds its own
+SO_REUSEPORT socket so the kernel balances connections across workers.
+
+With --certfile and --keyfile, workers terminate TLS themselves and keep connections alive
+between requests (see dsmlp.tls), reloading the certificate when its files change.
+
+SIGHUP restarts the workers one at a time, SIGTERM and SIGINT stop them. A stopping worker
+stops accepting, finishes its in-flight requests and exits. A worker whose serving loop has
+not checked in for --stale-after seconds is killed and restarted, and GET /healthz on any
+worker fails while one is stale. Metrics and GPU reservations are per worker.
+"""
+import argparse
+import gc
+import importlib
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dsmlp.tls import CertificateReloader, TLSServer, create_ssl_context
+
+# Imported before forking. Modules under dsmlp.app are not: importing it creates the AppFactory.
+PRELOAD = (
+    'kubernetes.client',
+    'kubernetes.config',
+    'kubernetes.watch',
+    'dataclasses_json',
+    'dacite',
+    'requests',
+    'flask',
+    'waitress',
+    'dotenv',
+    'dsmlp.plugin.awsed',
+    'dsmlp.plugin.kube',
+    'dsmlp.ext.awsed',
+    'dsmlp.ext.kube_api',
+    'dsmlp.ext.logger',
+)
+
+logger = logging.getLogger(__name__)
+
+
+def preload(modules=PRELOAD) -> None:
+    for module in modules:
+        importlib.import_module(module)
+    gc.collect()
+    gc.freeze()
+
+
+class Heartbeats:
+    """
+    Last check-in time of each worker's serving loop, in memory shared by the supervisor and
+    the workers. Created before forking.
+    """
+
+    def __init__(self, workers: int, stale_after: float = 30, clock: Callable[[], float] = time.monotonic) -> None:
+        self.stale_after = stale_after
+        self.clock = clock
+        # One double per worker, written by its owner only
+        self.beats = multiprocessing.RawArray('d', workers)
+
+    def beat(self, slot: int) -> None:
+        self.beats[slot] = self.clock()
+
+    def age(self, slot: int) -> float:
+        return self.clock() - self.beats[slot]
+
+    def stale(self) -> List[int]:
+        return [slot for slot in range(len(self.beats)) if self.age(slot) > self.stale_after]
+
+    def health(self) -> Tuple[bool, str]:
+        stale = self.stale()
+        live = len(self.beats) - len(stale)
+        if stale:
+            return False, f"{live}/{len(self.beats)} workers live, stale: {', '.join(map(str, stale))}"
+        return True, f"OK {live}/{len(self.beats)} workers live"
+
+
+def listen(host: str, port: int, backlog: int, reuse_port: bool = False) -> socket.socket:
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+@dataclass(frozen=True)
+class TLSSettings:
+    certfile: str
+    keyfile: str
+    keep_alive_timeout: float = 120
+    reload_interval: float = 10
+    max_body_size: int = 64 << 20
+
+
+class Worker:
+    """Serves the app with waitress on a listening socket until asked to stop, then drains"""
+
+    def __init__(self, slot: int, sock: socket.socket, heartbeats: Heartbeats, threads: int = 4,
+                 graceful_timeout: float = 30, tls: Optional[TLSSettings] = None) -> None:
+        self.slot = slot
+        self.sock = sock
+        self.heartbeats = heartbeats
+        self.threads = threads
+        self.graceful_timeout = graceful_timeout
+        self.tls = tls
+        self.stopping = False
+
+    def run(self) -> None:
+        from waitress.server import create_server
+
+        from dsmlp.admission_controller import create_app
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.heartbeats.beat(self.slot)
+        app = create_app(health=self.heartbeats.health)
+        if self.tls is not None:
+            self.serve_tls(app)
+            return
+        server = create_server(app, sockets=[self.sock], threads=self.threads)
+        self.serve(server)
+
+    def serve_tls(self, app) -> None:
+        context = create_ssl_context(self.tls.certfile, self.tls.keyfile)
+        reloader = CertificateReloader(context, self.tls.certfile, self.tls.keyfile, self.tls.reload_interval)
+        reloader.start()
+        server = TLSServer(self.sock, app, context, keep_alive_timeout=self.tls.keep_alive_timeout,
+                           max_body_size=self.tls.max_body_size)
+        server.serve(lambda: self.stopping, beat=lambda: self.heartbeats.beat(self.slot),
+                     graceful_timeout=self.graceful_timeout)
+        reloader.stop()
+
+    def serve(self, server) -> None:
+        while not self.stopping:
+            self.poll(server)
+
+        # Leave new connections to the other workers
+        server.accepting = False
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.busy(server) and time.monotonic() < deadline:
+            self.poll(server)
+        server.task_dispatcher.shutdown()
+
+    def poll(self, server) -> None:
+        self.heartbeats.beat(self.slot)
+        server.asyncore.loop(timeout=server.adj.asyncore_loop_timeout, map=server._map,
+                             use_poll=server.adj.asyncore_use_poll, count=1)
+
+    @staticmethod
+    def busy(server) -> bool:
+        dispatcher = server.task_dispatcher
+        return bool(dispatcher.active_count or dispatcher.queue or any(
+            channel.requests or channel.total_outbufs_len for channel in server.active_channels.values()))
+
+    def stop(self, signum, frame) -> None:
+        self.stopping = True
+
+
+class Supervisor:
+    """Forks the workers and restarts them when they exit, hang, or on SIGHUP"""
+
+    def __init__(self, host: str = '0.0.0.0', port: int = 8080, workers: int = 2, threads: int = 4,
+                 backlog: int = 1024, reuse_port: bool = False, stale_after: float = 30,
+                 graceful_timeout: float = 30, tls: Optional[TLSSettings] = None) -> None:
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.threads = threads
+        self.backlog = backlog
+        self.reuse_port = reuse_port
+        self.graceful_timeout = graceful_timeout
+        self.tls = tls
+        self.heartbeats = Heartbeats(workers, stale_after)
+        self.sock: Optional[socket.socket] = None
+        # Worker pid -> slot
+        self.pids: Dict[int, int] = {}
+        self.started_at: Dict[int, float] = {}
+        self.stopping = False
+        self.reload = False
+
+    def run(self) -> None:
+        if self.tls is not None:
+            # Fail now rather than in every worker
+            create_ssl_context(self.tls.certfile, self.tls.keyfile)
+        preload()
+        if not self.reuse_port:
+            self.sock = listen(self.host, self.port, self.backlog)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGHUP, self.restart)
+        logger.info("Serving on %s:%d with %d workers", self.host, self.port, self.workers)
+        self.check_reservations()
+
+        for slot in range(self.workers):
+            self.spawn(slot)
+        while not self.stopping:
+            time.sleep(0.5)
+            self.reap()
+            self.kill_stale()
+            if self.reload:
+                self.reload = False
+                self.rolling_restart()
+        self.shutdown()
+
+    def check_reservations(self) -> bool:
+        """Warn that GPU reservations only cover the admissions of one worker. Returns whether it warned."""
+        if self.workers <= 1 or float(os.environ.get('GPU_RESERVATION_TIMEOUT', 60)) <= 0:
+            return False
+        logger.warning("GPU reservations are per worker: admissions served by different workers of the %d "
+                       "can still exceed a namespace's GPU quota together", self.workers)
+        return True
+
+    def spawn(self, slot: int) -> int:
+        # A worker that just died is not restarted in a tight loop
+        time.sleep(max(0.0, self.started_at.get(slot, 0) + 1 - time.monotonic()))
+        self.heartbeats.beat(slot)
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                signal.signal(signal.SIGHUP, signal.SIG_DFL)
+                self.serve_worker(slot)
+            except BaseException:
+                logger.exception("Worker %d failed", slot)
+                status = 1
+            finally:
+                os._exit(status)
+
+        self.pids[pid] = slot
+        self.started_at[slot] = time.monotonic()
+        return pid
+
+    def serve_worker(self, slot: int) -> None:
+        sock = listen(self.host, self.port, self.backlog, reuse_port=True) if self.reuse_port else self.sock
+        Worker(slot, sock, self.heartbeats, self.threads, self.graceful_timeout, self.tls).run()
+
+    def reap(self) -> List[int]:
+        """Restart exited workers. Returns their slots."""
+        exited = []
+        while self.pids:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                break
+            slot = self.pids.pop(pid, None)
+            if slot is None:
+                continue
+            logger.warning("Worker %d (pid %d) exited with status %d", slot, pid, os.waitstatus_to_exitcode(status))
+            exited.append(slot)
+            if not self.stopping:
+                self.spawn(slot)
+        return exited
+
+    def kill_stale(self) -> None:
+        for pid, slot in list(self.pids.items()):
+            if slot in self.heartbeats.stale():
+                logger.error("Worker %d (pid %d) stopped checking in, killing it", slot, pid)
+                os.kill(pid, signal.SIGKILL)
+
+    def rolling_restart(self) -> None:
+        for pid, slot in list(self.pids.items()):
+            if self.stopping:
+                return
+            self.terminate(pid)
+            self.spawn(slot)
+
+    def terminate(self, pid: int) -> None:
+        """Stop a worker, killing it if it has not drained within the graceful timeout"""
+        self.pids.pop(pid, None)
+        os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        while time.monotonic() < deadline:
+            if os.waitpid(pid, os.WNOHANG)[0] == pid:
+                return
+            time.sleep(0.1)
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+    def shutdown(self) -> None:
+        for pid in list(self.pids):
+            os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        while self.pids and time.monotonic() < deadline:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                time.sleep(0.1)
+            else:
+                self.pids.pop(pid, None)
+        for pid in self.pids:
+            os.kill(pid, signal.SIGKILL)
+
+    def stop(self, signum, frame) -> None:
+        self.stopping = True
+
+    def restart(self, signum, frame) -> None:
+        self.reload = True
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog='dsmlp-server', description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--listen', default='0.0.0.0:8080', help="host:port to listen on")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument('--threads', type=int, default=4, help="request threads per worker")
+    parser.add_argument('--backlog', type=int, default=int(os.environ.get('SERVER_BACKLOG', 1024)),
+                        help="connections the kernel queues before they are accepted")
+    parser.add_argument('--reuse-port', action='store_true', help="give each worker its own SO_REUSEPORT socket")
+    parser.add_argument('--stale-after', type=float, default=30,
+                        help="seconds without a check-in after which a worker is killed and restarted")
+    parser.add_argument('--graceful-timeout', type=float, default=30,
+                        help="seconds a stopping worker may take to finish its requests")
+    parser.add_argument('--certfile', default=os.environ.get('TLS_CERT_FILE'), help="serve TLS with this certificate")
+    parser.add_argument('--keyfile', default=os.environ.get('TLS_KEY_FILE'), help="private key of --certfile")
+    parser.add_argument('--keep-alive-timeout', type=float, default=120,
+                        help="seconds an idle TLS connection is kept open")
+    parser.add_argument('--cert-reload-interval', type=float, default=10,
+                        help="seconds between checks of the certificate files for changes")
+    parser.add_argument('--max-body-size', type=int, default=64 << 20,
+                        help="bytes of a request body accepted over TLS, larger ones get 413 (default: 64 MiB)")
+    args = parser.parse_args(argv)
+    if bool(args.certfile) != bool(args.keyfile):
+        parser.error("--certfile and --keyfile go together")
+
+    logging.basicConfig(level=logging.INFO)
+    host, port = args.listen.rsplit(':', 1)
+    tls = None
+    if args.certfile:
+        tls = TLSSettings(args.certfile, args.keyfile, args.keep_alive_timeout, args.cert_reload_interval,
+                          args.max_body_size)
+    Supervisor(host.strip('[]'), int(port), args.workers, args.threads, args.backlog, args.reuse_port,
+               args.stale_after, args.graceful_timeout, tls).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,321 @@
+"""
+TLS termination for dsmlp-server, so the API server's connections reach the validator with
+no proxy in between.
+
+Connections are kept alive between requests (HTTP/1.1) until they have been idle for
+`keep_alive_timeout` seconds. The TLS handshake is done on the connection's own thread, so
+a slow client does not hold up accepting others. The certificate and key are reloaded when
+their files change, e.g. when cert-manager rotates the secret; connections made afterwards
+use the new certificate. Responses the app gives no Content-Length, e.g. the results of
+/validate/batch, are streamed with chunked transfer encoding as they are produced.
+"""
+import io
+import itertools
+import logging
+import os
+import socket
+import socketserver
+import ssl
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Longest chunk size or trailer line read
+MAX_LINE = 65536
+
+
+def create_ssl_context(certfile: str, keyfile: str) -> ssl.SSLContext:
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(certfile, keyfile)
+    return context
+
+
+class CertificateReloader:
+    """Reloads the certificate chain of an SSLContext when the certificate or key file changes"""
+
+    def __init__(self, context: ssl.SSLContext, certfile: str, keyfile: str, interval: float = 10) -> None:
+        self.context = context
+        self.certfile = certfile
+        self.keyfile = keyfile
+        self.interval = interval
+        self.reloads = 0
+        self.errors = 0
+        self._version = self._file_version()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self.run, name="cert-reloader", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self.check()
+
+    def check(self) -> bool:
+        """Reload if the files changed since the last load. Returns whether it reloaded."""
+        try:
+            version = self._file_version()
+            if version == self._version:
+                return False
+            self.context.load_cert_chain(self.certfile, self.keyfile)
+        except (OSError, ssl.SSLError) as ex:
+            # Often the certificate and key are caught mid-update; the next check retries
+            self.errors += 1
+            logger.warning("Could not reload certificate %s: %s", self.certfile, ex)
+            return False
+
+        self._version = version
+        self.reloads += 1
+        logger.info("Reloaded certificate %s", self.certfile)
+        return True
+
+    def _file_version(self) -> Tuple[Tuple[int, int, int], ...]:
+        # Mounted secrets are replaced by swapping a symlink: stat follows it
+        return tuple((stat.st_ino, stat.st_mtime_ns, stat.st_size)
+                     for stat in (os.stat(self.certfile), os.stat(self.keyfile)))
+
+
+class WSGIRequestHandler(BaseHTTPRequestHandler):
+    """Runs a WSGI app for each request of a persistent connection"""
+
+    protocol_version = 'HTTP/1.1'
+    server: 'TLSServer'
+
+    def setup(self) -> None:
+        self.timeout = self.server.keep_alive_timeout
+        super().setup()
+
+    def handle_one_request(self) -> None:
+        try:
+            super().handle_one_request()
+        except (ConnectionError, socket.timeout, ssl.SSLError) as ex:
+            logger.debug("Connection from %s closed: %s", self.client_address[0], ex)
+            self.close_connection = True
+
+    def do_GET(self) -> None:
+        self.run_wsgi()
+
+    do_POST = do_PUT = do_DELETE = do_HEAD = do_GET
+
+    def run_wsgi(self) -> None:
+        self.server.set_busy(self.connection, True)
+        try:
+            body = self.read_body()
+            if body is None:
+                return
+            response: Dict[str, object] = {}
+
+            def start_response(status, headers, exc_info=None):
+                response['status'], response['headers'] = status, headers
+                return lambda data: None
+
+            result = self.server.app(self.environ(body), start_response)
+            try:
+                self.send_result(response, result)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        finally:
+            self.server.set_busy(self.connection, False)
+
+    def send_result(self, response: Dict[str, object], result: Iterable[bytes]) -> None:
+        """
+        Sends the response of the app. Without a Content-Length from the app, the body is
+        streamed as it is produced, in chunks, to HTTP/1.1 clients.
+        """
+        chunks = iter(result)
+        # The app may only start the response once it is iterated
+        first = next(chunks, b'')
+        status, headers = response['status'], response['headers']
+        chunked = (self.request_version == 'HTTP/1.1'
+                   and not any(name.lower() == 'content-length' for name, _ in headers))
+        if not chunked:
+            first, chunks = first + b''.join(chunks), iter(())
+        if self.server.draining:
+            self.close_connection = True
+
+        code, _, reason = status.partition(' ')
+        self.send_response(int(code), reason)
+        for name, value in headers:
+            if name.lower() not in ('content-length', 'connection', 'transfer-encoding'):
+                self.send_header(name, value)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Content-Length', str(len(first)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        if not chunked:
+            self.wfile.write(first)
+            return
+
+        try:
+            for data in itertools.chain((first,), chunks):
+                if data:
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+                    self.wfile.flush()
+            self.wfile.write(b'0\r\n\r\n')
+        except Exception:
+            # The response is cut short: the client can only tell by the connection closing
+            self.close_connection = True
+            raise
+
+    def read_body(self) -> Optional[bytes]:
+        """The request body, or None once an error response has been sent"""
+        limit = self.server.max_body_size
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            chunks = []
+            length = 0
+            while True:
+                line = self.rfile.readline(MAX_LINE)
+                try:
+                    size = int(line.split(b';', 1)[0], 16)
+                except ValueError:
+                    size = -1
+                if size < 0:
+                    self.send_error(400, "Invalid chunk size")
+                    return None
+                if size == 0:
+                    # Skip trailers up to the blank line
+                    while self.rfile.readline(MAX_LINE) not in (b'\r\n', b'\n', b''):
+                        pass
+                    return b''.join(chunks)
+                length += size
+                if length > limit:
+                    self.send_error(413, "Request body too large")
+                    return None
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline(MAX_LINE)
+
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.send_error(400, "Invalid Content-Length")
+            return None
+        if length > limit:
+            self.send_error(413, "Request body too large")
+            return None
+        return self.rfile.read(length) if length > 0 else b''
+
+    def environ(self, body: bytes) -> Dict[str, object]:
+        path, _, query = self.path.partition('?')
+        environ = {
+            'REQUEST_METHOD': self.command,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'CONTENT_TYPE': self.headers.get('Content-Type', ''),
+            'CONTENT_LENGTH': str(len(body)),
+            'SERVER_NAME': self.server.server_name,
+            'SERVER_PORT': str(self.server.server_port),
+            'SERVER_PROTOCOL': self.request_version,
+            'REMOTE_ADDR': self.client_address[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'https',
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in self.headers.items():
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            if key not in ('HTTP_CONTENT_TYPE', 'HTTP_CONTENT_LENGTH'):
+                environ[key] = f'{environ[key]},{value}' if key in environ else value
+        return environ
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug("%s %s", self.client_address[0], format % args)
+
+
+class TLSServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    Serves a WSGI app over TLS on an already listening socket, one thread per connection.
+    `serve` accepts connections until `stopping()` returns true, then lets in-flight requests
+    finish, for up to `graceful_timeout` seconds, and closes idle connections.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, sock: socket.socket, app: Callable, context: ssl.SSLContext,
+                 keep_alive_timeout: float = 120, max_body_size: int = 64 << 20) -> None:
+        super().__init__(sock.getsockname()[:2], WSGIRequestHandler, bind_and_activate=False)
+        self.socket.close()
+        self.socket = sock
+        self.server_name = sock.getsockname()[0]
+        self.server_port = sock.getsockname()[1]
+        self.app = app
+        self.context = context
+        self.keep_alive_timeout = keep_alive_timeout
+        # Larger request bodies are refused with 413
+        self.max_body_size = max_body_size
+        self.draining = False
+        self.connections: Dict[socket.socket, bool] = {}
+        self._connections_lock = threading.Lock()
+
+    def finish_request(self, request: socket.socket, client_address) -> None:
+        try:
+            request.settimeout(self.keep_alive_timeout)
+            request = self.context.wrap_socket(request, server_side=True)
+        except (OSError, ssl.SSLError) as ex:
+            logger.debug("TLS handshake with %s failed: %s", client_address[0], ex)
+            request.close()
+            return
+
+        with self._connections_lock:
+            self.connections[request] = False
+        try:
+            super().finish_request(request, client_address)
+        finally:
+            with self._connections_lock:
+                del self.connections[request]
+            request.close()
+
+    def set_busy(self, connection: socket.socket, busy: bool) -> None:
+        with self._connections_lock:
+            if connection in self.connections:
+                self.connections[connection] = busy
+
+    def serve(self, stopping: Callable[[], bool], beat: Callable[[], None] = lambda: None,
+              graceful_timeout: float = 30, poll_interval: float = 1) -> None:
+        self.timeout = poll_interval
+        while not stopping():
+            beat()
+            self.handle_request()
+
+        self.draining = True
+        deadline = time.monotonic() + graceful_timeout
+        while self.busy() and time.monotonic() < deadline:
+            beat()
+            time.sleep(0.05)
+        with self._connections_lock:
+            for connection in self.connections:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def busy(self) -> bool:
+        with self._connections_lock:
+            return any(self.connections.values())
+
+    def server_close(self) -> None:
+        # The listening socket belongs to the caller
+        pass
+
@@ -0,0 +1,95 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from hamcrest import assert_that, equal_to
+
+from dsmlp.app.validator import AsyncValidator
+from dsmlp.asgi import create_app
+from dsmlp.ext.aio import ExecutorAwsedClient, ExecutorKubeClient
+from dsmlp.plugin.awsed import ListTeamsResponse, TeamJson, UserResponse
+from dsmlp.plugin.kube import Namespace
+from tests.fakes import FakeAwsedClient, FakeKubeClient, FakeLogger
+
+
+def admission_review(username: str, gpus: int = 0, run_as_user: int = None):
+    container = {}
+    if gpus > 0:
+        container["resources"] = {"limits": {"nvidia.com/gpu": gpus}}
+    spec = {"containers": [container]}
+    if run_as_user is not None:
+        spec["securityContext"] = {"runAsUser": run_as_user}
+
+    return {
+        "request": {
+            "uid": "705ab4f5-6393-11e8-b7cc-42010a800002",
+            "namespace": username,
+            "userInfo": {"username": username},
+            "object": {"metadata": {"labels": {}}, "spec": spec},
+        }
+    }
+
+
+class TestAsyncValidator:
+    def setup_method(self) -> None:
+        self.logger = FakeLogger()
+        self.awsed_client = FakeAwsedClient()
+        self.kube_client = FakeKubeClient()
+        self.executor = ThreadPoolExecutor(max_workers=4)
+
+        self.awsed_client.add_user('user10', UserResponse(uid=10, enrollments=[]))
+        self.awsed_client.add_teams('user10', ListTeamsResponse(teams=[TeamJson(gid=1000)]))
+        self.awsed_client.assign_user_gpu_quota('user10', {"gpu": 2})
+        self.kube_client.add_namespace('user10', Namespace(
+            name='user10', labels={'k8s-sync': 'true'}, gpu_quota=10))
+
+        self.validator = AsyncValidator(
+            ExecutorAwsedClient(self.awsed_client, self.executor),
+            ExecutorKubeClient(self.kube_client, self.executor),
+            self.logger)
+
+    def teardown_method(self) -> None:
+        self.executor.shutdown()
+
+    def test_allowed(self):
+        response = asyncio.run(self.validator.validate_request(admission_review('user10', gpus=1)))
+
+        assert_that(response['response']['allowed'], equal_to(True))
+
+    def test_denied(self):
+        response = asyncio.run(self.validator.validate_request(admission_review('user10', run_as_user=3)))
+
+        assert_that(response['response']['status']['message'],
+                    equal_to("spec.securityContext: uid must be in range [10]"))
+
+    def test_unknown_user(self):
+        response = asyncio.run(self.validator.validate_request(admission_review('user2')))
+
+        assert_that(response['response']['status']['message'],
+                    equal_to("namespace: no AWSEd user found with username user2"))
+
+    def test_asgi_validate(self):
+        status, body = asyncio.run(self.call_app('POST', '/validate', admission_review('user10', gpus=3)))
+
+        assert_that(status, equal_to(200))
+        assert_that(json.loads(body)['response']['allowed'], equal_to(False))
+
+    def test_asgi_healthz(self):
+        status, body = asyncio.run(self.call_app('GET', '/healthz'))
+
+        assert_that((status, body), equal_to((200, b'OK')))
+
+    async def call_app(self, method, path, payload=None):
+        app = create_app(self.validator)
+        body = json.dumps(payload).encode() if payload is not None else b''
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        await app({'type': 'http', 'method': method, 'path': path}, receive, send)
+        return sent[0]['status'], sent[1]['body']
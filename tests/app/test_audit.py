@@ -0,0 +1,148 @@
+import datetime
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from hamcrest import assert_that, equal_to
+from kubernetes.client import (ApiClient, V1Container, V1ListMeta, V1ObjectMeta, V1Pod, V1PodList,
+                               V1PodSecurityContext, V1PodSpec, V1ResourceRequirements)
+from kubernetes.client.rest import ApiException
+
+from dsmlp.audit import NON_TERMINAL_PODS, Audit, PodAuditor, list_pods, to_listed_pod
+from dsmlp.plugin.awsed import ListTeamsResponse, TeamJson, UserResponse
+from dsmlp.plugin.kube import Namespace
+from tests.fakes import CountingAwsedClient, CountingKubeClient, FakeLogger
+
+
+def pod(namespace: str, name: str, minute: int, gpus: int = 0, run_as_user: int = None, priority: str = None):
+    resources = V1ResourceRequirements(limits={'nvidia.com/gpu': str(gpus)}) if gpus else None
+    return V1Pod(
+        metadata=V1ObjectMeta(namespace=namespace, name=name, uid=f'{namespace}-{name}',
+                              creation_timestamp=datetime.datetime(2024, 1, 1, 0, minute)),
+        spec=V1PodSpec(containers=[V1Container(name='main', resources=resources)],
+                       security_context=V1PodSecurityContext(run_as_user=run_as_user),
+                       priority_class_name=priority))
+
+
+class FakeCoreV1Api:
+    def __init__(self, pods, page_size: int, expire_after: int = None) -> None:
+        self.pods = pods
+        self.page_size = page_size
+        self.expire_after = expire_after
+        self.calls = []
+
+    def list_pod_for_all_namespaces(self, limit=None, _continue=None, field_selector=None):
+        self.calls.append((limit, _continue, field_selector))
+        if self.expire_after is not None and len(self.calls) == self.expire_after:
+            raise ApiException(status=410, reason="Gone")
+        start = int(_continue or 0)
+        end = start + self.page_size
+        token = str(end) if end < len(self.pods) else None
+        return V1PodList(items=self.pods[start:end], metadata=V1ListMeta(_continue=token))
+
+
+class ExpiredApiException(ApiException):
+    def __init__(self, token: str) -> None:
+        super().__init__(status=410, reason="Gone")
+        self.body = json.dumps({'kind': 'Status', 'metadata': {'continue': token}, 'code': 410})
+
+
+class TestListPods:
+    def test_pages_follow_continue_tokens(self):
+        api = FakeCoreV1Api([pod('user10', str(i), i) for i in range(5)], page_size=2)
+
+        pages = list(list_pods(api, page_size=2))
+
+        assert_that([len(page) for page in pages], equal_to([2, 2, 1]))
+        assert_that(api.calls, equal_to([(2, None, NON_TERMINAL_PODS), (2, '2', NON_TERMINAL_PODS),
+                                         (2, '4', NON_TERMINAL_PODS)]))
+
+    def test_expired_list_continues_with_the_offered_token(self):
+        api = FakeCoreV1Api([pod('user10', str(i), i) for i in range(5)], page_size=2)
+        list_pod_for_all_namespaces = api.list_pod_for_all_namespaces
+
+        def expire_second_call(**kwargs):
+            if len(api.calls) == 1:
+                api.calls.append('expired')
+                raise ExpiredApiException('3')
+            return list_pod_for_all_namespaces(**kwargs)
+
+        api.list_pod_for_all_namespaces = expire_second_call
+
+        pages = list(list_pods(api, page_size=2))
+
+        assert_that([[p.metadata.name for p in page] for page in pages], equal_to([['0', '1'], ['3', '4']]))
+
+    def test_expired_list_without_token_fails(self):
+        api = FakeCoreV1Api([pod('user10', str(i), i) for i in range(5)], page_size=2, expire_after=2)
+
+        try:
+            list(list_pods(api, page_size=2))
+            raised = None
+        except ApiException as ex:
+            raised = ex.status
+
+        assert_that(raised, equal_to(410))
+
+
+class TestAudit:
+    def setup_method(self) -> None:
+        self.awsed_client = CountingAwsedClient()
+        self.kube_client = CountingKubeClient()
+        for username, uid in (('user10', 10), ('user11', 11)):
+            self.awsed_client.add_user(username, UserResponse(uid=uid, enrollments=[]))
+            self.awsed_client.add_teams(username, ListTeamsResponse(teams=[TeamJson(gid=1000)]))
+            self.awsed_client.assign_user_gpu_quota(username, {"gpu": 3})
+            self.kube_client.add_namespace(username, Namespace(name=username, labels={'k8s-sync': 'true'},
+                                                               gpu_quota=10))
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.lookup_executor = ThreadPoolExecutor(max_workers=4)
+
+    def teardown_method(self) -> None:
+        self.executor.shutdown()
+        self.lookup_executor.shutdown()
+
+    def run(self, pods, page_size: int = 2, namespaces=None):
+        serialize = ApiClient().sanitize_for_serialization
+        api = FakeCoreV1Api(pods, page_size)
+        pages = ([to_listed_pod(p, serialize) for p in page] for page in list_pods(api, page_size))
+        auditor = PodAuditor(self.awsed_client, self.kube_client, FakeLogger(), self.lookup_executor)
+        self.audit = Audit(auditor, self.executor, window=2, namespaces=namespaces)
+        return list(self.audit.run(pages))
+
+    def test_pods_failing_the_id_policy_are_reported(self):
+        violations = self.run([pod('user10', 'a', 1, run_as_user=10), pod('user10', 'b', 2, run_as_user=11),
+                               pod('user11', 'c', 3, run_as_user=10), pod('user12', 'd', 4)])
+
+        assert_that(violations, equal_to([
+            {'namespace': 'user10', 'pod': 'b', 'validator': 'IDValidator',
+             'message': 'spec.securityContext: uid must be in range [10]'},
+            {'namespace': 'user11', 'pod': 'c', 'validator': 'IDValidator',
+             'message': 'spec.securityContext: uid must be in range [11]'},
+            {'namespace': 'user12', 'pod': 'd', 'validator': 'IDValidator',
+             'message': 'namespace: no AWSEd user found with username user12'}]))
+
+    def test_pods_over_the_gpu_quota_are_replayed_in_creation_order(self):
+        violations = self.run([pod('user10', 'late', 5, gpus=1), pod('user10', 'first', 1, gpus=1),
+                               pod('user10', 'low', 2, gpus=1, priority='low'), pod('user10', 'big', 3, gpus=2)])
+
+        assert_that([(v['pod'], v['validator']) for v in violations], equal_to([('big', 'GPUValidator')]))
+        assert_that(violations[0]['message'], equal_to(
+            "GPU quota exceeded. Wanted 2 but with 2 already in use, the quota of 3 would be exceeded."))
+
+    def test_lookups_are_made_once_per_namespace(self):
+        pods = [pod(namespace, str(i), i, gpus=1, run_as_user=10)
+                for namespace in ('user10', 'user11') for i in range(5)]
+
+        self.run(pods, page_size=3)
+
+        assert_that(sorted(self.awsed_client.calls), equal_to(
+            ['describe_user', 'describe_user', 'get_user_gpu_quota', 'get_user_gpu_quota']))
+        assert_that(self.kube_client.calls, equal_to(['get_namespace', 'get_namespace']))
+        assert_that((self.audit.pods, self.audit.namespaces_audited), equal_to((10, 2)))
+
+    def test_only_selected_namespaces_are_audited(self):
+        violations = self.run([pod('kube-system', 'a', 1, run_as_user=0), pod('user10', 'b', 2, run_as_user=11)],
+                              namespaces={'user10'})
+
+        assert_that([v['pod'] for v in violations], equal_to(['b']))
+        assert_that(self.audit.pods, equal_to(1))
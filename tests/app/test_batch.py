@@ -0,0 +1,112 @@
+import asyncio
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from hamcrest import assert_that, calling, equal_to, raises
+
+from dsmlp.app.batch import BatchItemError, parse_reviews, validate_batch
+from dsmlp.app.metrics import ADMISSIONS
+from dsmlp.app.validator import AsyncValidator, Validator
+from dsmlp.asgi import create_app
+from dsmlp.ext.aio import ExecutorAwsedClient, ExecutorKubeClient
+from dsmlp.plugin.awsed import ListTeamsResponse, TeamJson, UserResponse
+from dsmlp.plugin.kube import Namespace
+from tests.app.test_async_validator import admission_review
+from tests.fakes import CountingAwsedClient, CountingKubeClient, FakeLogger
+
+
+def decisions(results):
+    return [result['response']['allowed'] if 'response' in result else result['error'] for result in results]
+
+
+class TestParseReviews:
+    def test_json_array(self):
+        reviews = parse_reviews(io.BytesIO(b' [{"a": 1}, {"b": 2}]'))
+
+        assert_that(list(reviews), equal_to([{'a': 1}, {'b': 2}]))
+
+    def test_invalid_json_array(self):
+        assert_that(calling(parse_reviews).with_args(io.BytesIO(b'[{"a": 1},')), raises(ValueError))
+
+    def test_ndjson(self):
+        reviews = list(parse_reviews(io.BytesIO(b'\n{"a": 1}\n\nnot json\n{"b": 2}')))
+
+        assert_that([reviews[0], reviews[2]], equal_to([{'a': 1}, {'b': 2}]))
+        assert_that(isinstance(reviews[1], BatchItemError), equal_to(True))
+
+
+class TestBatch:
+    def setup_method(self) -> None:
+        self.awsed_client = CountingAwsedClient()
+        self.kube_client = CountingKubeClient()
+        for username, uid in (('user10', 10), ('user11', 11)):
+            self.awsed_client.add_user(username, UserResponse(uid=uid, enrollments=[]))
+            self.awsed_client.add_teams(username, ListTeamsResponse(teams=[TeamJson(gid=1000)]))
+            self.awsed_client.assign_user_gpu_quota(username, {"gpu": 2})
+            self.kube_client.add_namespace(username, Namespace(name=username, labels={'k8s-sync': 'true'},
+                                                               gpu_quota=10))
+        self.validator = Validator(self.awsed_client, self.kube_client, FakeLogger())
+        self.reviews = [admission_review('user10', gpus=1), admission_review('user11', run_as_user=10),
+                        BatchItemError("invalid JSON"), admission_review('user10', gpus=3), {'request': {}},
+                        admission_review('user11', gpus=2)] * 5
+
+    def test_results_are_in_order(self):
+        executor = ThreadPoolExecutor(max_workers=4)
+
+        results = list(validate_batch(self.validator, self.reviews, executor, window=4))
+
+        executor.shutdown()
+        assert_that(decisions(results[:6]), equal_to([
+            True, False, 'invalid JSON', False, "invalid AdmissionReview: KeyError('userInfo')", True]))
+        assert_that(decisions(results), equal_to(decisions(results[:6]) * 5))
+        assert_that([result['index'] for result in results], equal_to(list(range(30))))
+
+    def test_batches_are_not_counted_as_admissions(self):
+        logger = FakeLogger()
+        validator = Validator(self.awsed_client, self.kube_client, logger)
+        before = ADMISSIONS.values()
+
+        results = list(validate_batch(validator, self.reviews[:6]))
+
+        assert_that(decisions(results), equal_to(
+            [True, False, 'invalid JSON', False, "invalid AdmissionReview: KeyError('userInfo')", True]))
+        assert_that(ADMISSIONS.values(), equal_to(before))
+        assert_that([message for message in logger.messages
+                     if 'Allowed request' in message or 'Denied request' in message], equal_to([]))
+
+    def test_lookups_are_shared_across_the_batch(self):
+        list(validate_batch(self.validator, self.reviews))
+
+        assert_that(sorted(self.awsed_client.calls), equal_to(
+            ['describe_user', 'describe_user', 'get_user_gpu_quota', 'get_user_gpu_quota']))
+        assert_that(sorted(self.kube_client.calls), equal_to(
+            ['get_gpus_in_namespace', 'get_gpus_in_namespace', 'get_namespace', 'get_namespace']))
+
+    def test_asgi_batch(self):
+        executor = ThreadPoolExecutor(max_workers=4)
+        validator = AsyncValidator(ExecutorAwsedClient(self.awsed_client, executor),
+                                   ExecutorKubeClient(self.kube_client, executor), FakeLogger())
+        body = b'\n'.join(json.dumps(review).encode() for review in self.reviews[:2] * 3) + b'\nnot json\n'
+
+        sent = asyncio.run(call_app(create_app(validator), '/validate/batch', body))
+
+        executor.shutdown()
+        lines = [json.loads(line) for message in sent[1:] for line in message['body'].splitlines()]
+        assert_that(decisions(lines)[:6], equal_to([True, False] * 3))
+        assert_that([line['index'] for line in lines], equal_to(list(range(7))))
+        assert_that(self.awsed_client.calls.count('describe_user'), equal_to(2))
+
+
+async def call_app(app, path, body):
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await app({'type': 'http', 'method': 'POST', 'path': path}, receive, send)
+    return sent
@@ -0,0 +1,17 @@
+from hamcrest import assert_that, equal_to
+
+from dsmlp.app.validator import Validator
+from dsmlp.bench.admission import SCENARIOS, LatentAwsedClient, LatentKubeClient, NullLogger, run_scenario, seed
+
+
+class TestBench:
+    def test_scenarios_are_allowed(self):
+        awsed, kube = LatentAwsedClient(), LatentKubeClient()
+        validator = Validator(awsed, kube, NullLogger())
+
+        for name, scenario in SCENARIOS.items():
+            review = scenario()
+            seed(review, awsed, kube)
+            result = run_scenario(name, review, validator, requests=10, threads=2, warmup=1)
+
+            assert_that((name, result.requests, result.allowed), equal_to((name, 10, 10)))
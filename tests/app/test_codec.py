@@ -0,0 +1,51 @@
+import json
+from os import path
+
+import pytest
+from hamcrest import assert_that, calling, equal_to, raises
+
+from dsmlp.app.codec import decode_review, encode_response
+from dsmlp.app.types import AdmissionReview
+from dsmlp.app.validator import Validator
+from tests.fakes import FakeAwsedClient, FakeKubeClient, FakeLogger
+
+ROOT = path.dirname(path.dirname(path.dirname(path.abspath(__file__))))
+
+
+class TestCodec:
+    @pytest.mark.parametrize('payload', ['ref.json', 'tests/admission-review.json'])
+    def test_matches_dataclasses_json(self, payload):
+        with open(path.join(ROOT, payload), 'rb') as f:
+            body = f.read()
+
+        assert_that(decode_review(body), equal_to(AdmissionReview.from_dict(json.loads(body))))
+
+    def test_missing_required_field(self):
+        review = {"request": {"uid": "1", "namespace": "user10", "userInfo": {"username": "user10"},
+                              "object": {"metadata": {}, "spec": {"containers": []}}}}
+
+        assert_that(calling(decode_review).with_args(review), raises(KeyError))
+
+    def test_dry_run(self):
+        review = {"request": {"uid": "1", "namespace": "user10", "userInfo": {"username": "user10"}, "dryRun": True,
+                              "object": {"metadata": {"labels": {}}, "spec": {"containers": []}}}}
+
+        assert_that(decode_review(review).request.dryRun, equal_to(True))
+        assert_that(decode_review(review), equal_to(AdmissionReview.from_dict(review)))
+
+    def test_encode_response(self):
+        response = Validator(None, None, FakeLogger()).admission_response(
+            'uid"1', False, "spec.securityContext: gid must be in range [1000, 0, 100]")
+
+        assert_that(json.loads(encode_response(response)), equal_to(response))
+
+    def test_validate_request_body(self):
+        awsed_client = FakeAwsedClient()
+        validator = Validator(awsed_client, FakeKubeClient(), FakeLogger())
+        body = json.dumps({"request": {"uid": "1", "namespace": "user10", "userInfo": {"username": "user10"},
+                                       "object": {"metadata": {"labels": {}}, "spec": {"containers": [{}]}}}})
+
+        response = json.loads(validator.validate_request_body(body.encode()))
+
+        assert_that(response['response']['status']['message'],
+                    equal_to("namespace: no AWSEd user found with username user10"))
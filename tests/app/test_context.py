@@ -0,0 +1,61 @@
+from hamcrest import assert_that, contains_exactly, equal_to, has_length
+
+from dsmlp.app.context import AdmissionContext
+from dsmlp.app.types import ComponentValidator
+from dsmlp.app.validator import Validator
+from dsmlp.plugin.awsed import ListTeamsResponse, TeamJson, UnsuccessfulRequest, UserResponse
+from dsmlp.plugin.kube import Namespace
+from tests.app.utils import gen_request
+from tests.fakes import CountingAwsedClient, FakeKubeClient, FakeLogger
+
+
+class UserLookupValidator(ComponentValidator):
+    def validate_pod(self, request, context=None):
+        context.user()
+        context.teams()
+        context.gpu_quota()
+
+
+class TestAdmissionContext:
+    def setup_method(self) -> None:
+        self.logger = FakeLogger()
+        self.awsed_client = CountingAwsedClient()
+        self.kube_client = FakeKubeClient()
+
+        self.awsed_client.add_user('user10', UserResponse(uid=10, enrollments=[]))
+        self.awsed_client.add_teams('user10', ListTeamsResponse(teams=[TeamJson(gid=1000)]))
+        self.kube_client.add_namespace('user10', Namespace(
+            name='user10', labels={'k8s-sync': 'true'}, gpu_quota=10))
+
+    def test_lookups_are_shared_across_validators(self):
+        validator = Validator(self.awsed_client, self.kube_client, self.logger)
+        validator.component_validators.append(UserLookupValidator())
+
+        validator.validate_pod(gen_request(gpu_req=1, run_as_group=1000))
+
+        assert_that(self.awsed_client.calls, contains_exactly(
+            'describe_user', 'list_user_teams', 'get_user_gpu_quota'))
+
+    def test_records_lookups(self):
+        context = AdmissionContext(gen_request(), self.awsed_client, self.kube_client)
+        context.user()
+        context.user()
+        context.namespace()
+
+        assert_that([(r.name, r.key) for r in context.records], contains_exactly(
+            ('user', 'user10'), ('namespace', 'user10')))
+        assert_that(context.records[0].seconds >= 0, equal_to(True))
+
+    def test_failed_lookups_are_recorded_and_not_retried(self):
+        context = AdmissionContext(gen_request(username='user2'), self.awsed_client, self.kube_client)
+
+        for _ in range(2):
+            try:
+                context.teams()
+                raise AssertionError("Expected UnsuccessfulRequest")
+            except UnsuccessfulRequest:
+                pass
+
+        assert_that(context.records, has_length(1))
+        assert_that(context.records[0].error, equal_to("UnsuccessfulRequest()"))
+        assert_that(self.awsed_client.calls, contains_exactly('list_user_teams'))
@@ -0,0 +1,91 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from hamcrest import assert_that, equal_to
+
+from dsmlp.app.validator import AsyncValidator, Validator
+from dsmlp.ext.aio import ExecutorAwsedClient, ExecutorKubeClient
+from dsmlp.ext.cache import TTLCache
+from dsmlp.plugin.awsed import ListTeamsResponse, TeamJson, UserResponse
+from dsmlp.plugin.kube import Namespace
+from tests.app.test_async_validator import admission_review
+from tests.app.utils import gen_request, try_val_with_component
+from tests.fakes import CountingAwsedClient, FakeKubeClient, FakeLogger
+
+
+class TestIDDecisionCache:
+    def setup_method(self) -> None:
+        self.logger = FakeLogger()
+        self.awsed_client = CountingAwsedClient()
+        self.kube_client = FakeKubeClient()
+        self.now = 0
+        self.cache = TTLCache('id-decisions', ttl=30, clock=lambda: self.now, background_refresh=False)
+
+        self.awsed_client.add_user('user10', UserResponse(uid=10, enrollments=[]))
+        self.awsed_client.add_teams('user10', ListTeamsResponse(teams=[TeamJson(gid=1000)]))
+        self.awsed_client.assign_user_gpu_quota('user10', {"gpu": 2})
+        self.kube_client.add_namespace('user10', Namespace(name='user10', labels={'k8s-sync': 'true'}, gpu_quota=10))
+
+        self.validator = Validator(self.awsed_client, self.kube_client, self.logger, id_decision_cache=self.cache)
+
+    def test_identical_pods_skip_lookups(self):
+        try_val_with_component(self.validator, gen_request(run_as_user=10, uid="1"), True)
+        try_val_with_component(self.validator, gen_request(run_as_user=10, uid="2"), True)
+
+        assert_that(self.awsed_client.calls, equal_to(['describe_user']))
+
+    def test_denials_are_cached(self):
+        for _ in range(2):
+            try_val_with_component(self.validator, gen_request(run_as_user=3), False,
+                                   "spec.securityContext: uid must be in range [10]")
+
+        assert_that(self.awsed_client.calls, equal_to(['describe_user']))
+
+    def test_different_spec_is_validated(self):
+        try_val_with_component(self.validator, gen_request(run_as_user=10), True)
+        try_val_with_component(self.validator, gen_request(run_as_user=10, run_as_group=2), False,
+                               "spec.securityContext: gid must be in range [1000, 0, 100]")
+
+    def test_decisions_expire(self):
+        try_val_with_component(self.validator, gen_request(run_as_user=10), True)
+        self.now = 31
+        try_val_with_component(self.validator, gen_request(run_as_user=10), True)
+
+        assert_that(len(self.awsed_client.calls), equal_to(2))
+
+    def test_gpu_quota_uses_current_usage(self):
+        try_val_with_component(self.validator, gen_request(gpu_req=2), True)
+        self.kube_client.set_existing_gpus('user10', 1)
+
+        try_val_with_component(self.validator, gen_request(gpu_req=2), False,
+                               "GPU quota exceeded. Wanted 2 but with 1 already in use, "
+                               "the quota of 2 would be exceeded.")
+
+    def test_cached_pods_are_not_prefetched(self):
+        request = gen_request(gpu_req=1, run_as_user=10)
+        try_val_with_component(self.validator, request, True)
+
+        assert_that(self.validator.required_lookups(request),
+                    equal_to(['gpu_quota', 'namespace', 'gpus_in_namespace']))
+
+    def test_decision_expiring_after_prefetch_is_used_once_decided(self):
+        executor = ThreadPoolExecutor(max_workers=2)
+        validator = AsyncValidator(ExecutorAwsedClient(self.awsed_client, executor),
+                                   ExecutorKubeClient(self.kube_client, executor), self.logger,
+                                   id_decision_cache=self.cache)
+        review = admission_review('user10', run_as_user=10)
+        asyncio.run(validator.validate_request(review))
+        self.awsed_client.calls.clear()
+        reads = []
+
+        def clock():
+            # The entry expires right after the prefetch reads it
+            reads.append(self.now)
+            return self.now if len(reads) == 1 else 31
+
+        self.cache.clock = clock
+        response = asyncio.run(validator.validate_request(review))
+
+        executor.shutdown()
+        assert_that(response['response']['allowed'], equal_to(True))
+        assert_that(self.awsed_client.calls, equal_to([]))
@@ -0,0 +1,49 @@
+from hamcrest import assert_that, equal_to
+
+from dsmlp.app.validator import Validator
+from dsmlp.plugin.awsed import ListTeamsResponse, TeamJson, UserResponse
+from dsmlp.plugin.errors import DependencyUnavailable
+from dsmlp.plugin.kube import Namespace
+from tests.app.test_async_validator import admission_review
+from tests.fakes import FakeAwsedClient, FakeKubeClient, FakeLogger
+
+
+class UnavailableAwsedClient(FakeAwsedClient):
+    def describe_user(self, username):
+        raise DependencyUnavailable('awsed', "circuit open")
+
+
+class TestDegradedPolicies:
+    def setup_method(self) -> None:
+        self.logger = FakeLogger()
+        self.awsed_client = UnavailableAwsedClient()
+        self.kube_client = FakeKubeClient()
+        self.awsed_client.add_teams('user10', ListTeamsResponse(teams=[TeamJson(gid=1000)]))
+        self.awsed_client.assign_user_gpu_quota('user10', {"gpu": 2})
+        self.kube_client.add_namespace('user10', Namespace(name='user10', labels={'k8s-sync': 'true'}, gpu_quota=10))
+
+    def validate(self, policy, review):
+        validator = Validator(self.awsed_client, self.kube_client, self.logger, degraded_policies={'awsed': policy})
+        return validator.validate_request(review)['response']
+
+    def test_deny(self):
+        response = self.validate('deny', admission_review('user10'))
+
+        assert_that((response['allowed'], response['status']['message']),
+                    equal_to((False, "awsed is unavailable, try again later")))
+
+    def test_allow_skips_validator(self):
+        response = self.validate('allow', admission_review('user10', run_as_user=3))
+
+        assert_that(response['allowed'], equal_to(True))
+        assert_that(self.logger.messages[:3], equal_to([
+            "INFO Validating request username=user10 namespace=user10 uid=705ab4f5-6393-11e8-b7cc-42010a800002",
+            "INFO Skipped validator validator=IDValidator reason=awsed unavailable: circuit open "
+            "uid=705ab4f5-6393-11e8-b7cc-42010a800002",
+            "INFO Allowed request username=user10 namespace=user10 uid=705ab4f5-6393-11e8-b7cc-42010a800002",
+        ]))
+
+    def test_allow_still_runs_other_validators(self):
+        response = self.validate('allow', admission_review('user10', gpus=3))
+
+        assert_that(response['allowed'], equal_to(False))
@@ -0,0 +1,84 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from hamcrest import assert_that, equal_to
+
+from dsmlp.app.validator import Validator
+from dsmlp.plugin.awsed import ListTeamsResponse, TeamJson, UserResponse
+from dsmlp.plugin.kube import Namespace
+from tests.app.utils import gen_request, try_val_with_component
+from tests.fakes import FakeAwsedClient, FakeKubeClient, FakeLogger
+
+
+class BarrierAwsedClient(FakeAwsedClient):
+    """Every lookup blocks until all five lookups of a request are in flight"""
+
+    def __init__(self, barrier: threading.Barrier):
+        super().__init__()
+        self.barrier = barrier
+
+    def describe_user(self, username):
+        self.barrier.wait()
+        return super().describe_user(username)
+
+    def list_user_teams(self, username):
+        self.barrier.wait()
+        return super().list_user_teams(username)
+
+    def get_user_gpu_quota(self, username):
+        self.barrier.wait()
+        return super().get_user_gpu_quota(username)
+
+
+class BarrierKubeClient(FakeKubeClient):
+    def __init__(self, barrier: threading.Barrier):
+        super().__init__()
+        self.barrier = barrier
+
+    def get_namespace(self, name):
+        self.barrier.wait()
+        return super().get_namespace(name)
+
+    def get_gpus_in_namespace(self, name):
+        self.barrier.wait()
+        return super().get_gpus_in_namespace(name)
+
+
+class TestLookupFanout:
+    def setup_method(self) -> None:
+        barrier = threading.Barrier(5, timeout=5)
+        self.logger = FakeLogger()
+        self.awsed_client = BarrierAwsedClient(barrier)
+        self.kube_client = BarrierKubeClient(barrier)
+        self.executor = ThreadPoolExecutor(max_workers=5)
+
+        self.awsed_client.add_user('user10', UserResponse(uid=10, enrollments=[]))
+        self.awsed_client.add_teams('user10', ListTeamsResponse(teams=[TeamJson(gid=1000)]))
+        self.awsed_client.assign_user_gpu_quota('user10', {"gpu": 2})
+        self.kube_client.add_namespace('user10', Namespace(
+            name='user10', labels={'k8s-sync': 'true'}, gpu_quota=10))
+        self.kube_client.set_existing_gpus('user10', 1)
+
+    def teardown_method(self) -> None:
+        self.executor.shutdown()
+
+    def test_lookups_run_concurrently(self):
+        self.try_validate(gen_request(gpu_req=1, run_as_user=10, run_as_group=1000), expected=True)
+
+    def test_decisions_match_sequential_validation(self):
+        self.try_validate(
+            gen_request(gpu_req=2, run_as_user=10, run_as_group=1000), expected=False,
+            message="GPU quota exceeded. Wanted 2 but with 1 already in use, the quota of 2 would be exceeded.")
+
+    def test_validate_request(self):
+        validator = Validator(self.awsed_client, self.kube_client, self.logger, self.executor)
+        response = validator.validate_request(
+            {"request": {"uid": "1", "namespace": "user10", "userInfo": {"username": "user10"},
+                         "object": {"metadata": {"labels": {}}, "spec": {"containers": [{"securityContext": {"runAsGroup": 1000},
+                                                                   "resources": {"limits": {"nvidia.com/gpu": 1}}}]}}}})
+
+        assert_that(response['response']['allowed'], equal_to(True))
+
+    def try_validate(self, request, expected: bool, message: str = None):
+        try_val_with_component(
+            Validator(self.awsed_client, self.kube_client, self.logger, self.executor), request, expected, message)
@@ -4,7 +4,7 @@ from unittest.mock import MagicMock
 from operator import contains
 from dsmlp.app.types import ValidationFailure
 from dsmlp.app.validator import Validator
-from dsmlp.plugin.awsed import ListTeamsResponse, TeamJson, UserResponse, Quota, UserQuotaResponse
+from dsmlp.plugin.awsed import ListTeamsResponse, TeamJson, UnsuccessfulRequest, UserResponse, Quota, UserQuotaResponse
 from dsmlp.plugin.kube import Namespace
 from hamcrest import assert_that, contains_inanyorder, equal_to, has_item
 from tests.fakes import FakeAwsedClient, FakeLogger, FakeKubeClient
@@ -116,6 +116,17 @@ class TestGPUValidator(unittest.TestCase):
             gen_request(gpu_req=11, username='user11'), expected=False, message="GPU quota exceeded. Wanted 11 but with 0 already in use, the quota of 5 would be exceeded."
         )
     
+    # AWSEd quota lookup fails for user 11, the namespace quota of 5 applies
+    def test_awsed_gpu_quota_failure(self):
+        self.kube_client.add_namespace('user11', Namespace(
+            name='user11', labels={'k8s-sync': 'true'}, gpu_quota=5))
+        self.kube_client.set_existing_gpus('user11', 0)
+        self.awsed_client.get_user_gpu_quota = MagicMock(side_effect=UnsuccessfulRequest("down"))
+
+        self.try_validate(
+            gen_request(gpu_req=11, username='user11'), expected=False, message="GPU quota exceeded. Wanted 11 but with 0 already in use, the quota of 5 would be exceeded."
+        )
+
     # Quota both set for user 11 from kube and awsed, should prioritize AWSED quota
     def test_gpu_quota_client_priority(self):
         self.kube_client.add_namespace('user11', Namespace(
@@ -0,0 +1,44 @@
+from hamcrest import assert_that, equal_to
+
+from dsmlp.app.metrics import LOOKUPS_AVOIDED
+from dsmlp.app.validator import Validator
+from dsmlp.plugin.awsed import ListTeamsResponse, TeamJson, UserResponse
+from dsmlp.plugin.kube import Namespace
+from tests.app.utils import gen_request, try_val_with_component
+from tests.fakes import CountingAwsedClient, CountingKubeClient, FakeLogger
+
+
+class TestLazyLookups:
+    def setup_method(self) -> None:
+        self.awsed_client = CountingAwsedClient()
+        self.kube_client = CountingKubeClient()
+        self.awsed_client.add_user('user10', UserResponse(uid=10, enrollments=[]))
+        self.awsed_client.add_teams('user10', ListTeamsResponse(teams=[TeamJson(gid=1000)]))
+        self.kube_client.add_namespace('user10', Namespace(name='user10', labels={'k8s-sync': 'true'}, gpu_quota=10))
+        self.validator = Validator(self.awsed_client, self.kube_client, FakeLogger())
+
+    def test_cpu_pod_without_groups(self):
+        avoided = LOOKUPS_AVOIDED.values()
+
+        try_val_with_component(self.validator, gen_request(run_as_user=10), True)
+
+        assert_that((self.awsed_client.calls, self.kube_client.calls), equal_to((['describe_user'], [])))
+        assert_that({labels: count - avoided.get(labels, 0) for labels, count in LOOKUPS_AVOIDED.values().items()
+                     if count != avoided.get(labels, 0)},
+                    equal_to({('teams',): 1, ('namespace',): 1, ('gpus_in_namespace',): 1, ('gpu_quota',): 1}))
+
+    def test_groups_need_teams(self):
+        try_val_with_component(self.validator, gen_request(run_as_group=2), False,
+                               "spec.securityContext: gid must be in range [1000, 0, 100]")
+
+        assert_that(self.awsed_client.calls, equal_to(['describe_user', 'list_user_teams']))
+
+    def test_gpu_pod_checks_quota(self):
+        try_val_with_component(self.validator, gen_request(gpu_req=1), True)
+
+        assert_that(self.kube_client.calls, equal_to(['get_namespace', 'get_gpus_in_namespace']))
+
+    def test_required_lookups(self):
+        assert_that(self.validator.required_lookups(gen_request()), equal_to(['user']))
+        assert_that(self.validator.required_lookups(gen_request(gpu_lim=1, fs_group=1000)),
+                    equal_to(['user', 'teams', 'gpu_quota', 'namespace', 'gpus_in_namespace']))
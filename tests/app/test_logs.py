@@ -1,9 +1,9 @@
 import inspect
 from operator import contains
-from dsmlp.app.validator import Validator
+from dsmlp.app.validator import RequestDumpSampler, Validator
 from dsmlp.plugin.awsed import ListTeamsResponse, TeamJson, UserResponse
 from dsmlp.plugin.kube import Namespace
-from hamcrest import assert_that, contains_inanyorder, equal_to, has_item
+from hamcrest import assert_that, contains_inanyorder, equal_to, has_item, starts_with
 from tests.fakes import FakeAwsedClient, FakeLogger, FakeKubeClient
 
 
@@ -94,6 +94,40 @@ class TestLogs:
         assert_that(self.logger.messages, has_item(
             "INFO Allowed request username=user10 namespace=user10 uid=705ab4f5-6393-11e8-b7cc-42010a800002"))
         
+    def test_denied_requests_are_dumped(self):
+        self.when_validate(self.review('user2'))
+
+        assert_that(self.logger.messages, has_item(starts_with(
+            "DEBUG request uid=705ab4f5-6393-11e8-b7cc-42010a800002 body={")))
+
+    def test_allowed_request_dumps_are_sampled(self):
+        validator = Validator(self.awsed_client, self.kube_client, self.logger,
+                              dump_sampler=RequestDumpSampler(every=3))
+        for _ in range(6):
+            validator.validate_request(self.review('user10'))
+
+        dumps = [m for m in self.logger.messages if m.startswith("DEBUG request")]
+        assert_that(len(dumps), equal_to(2))
+
+    def review(self, username):
+        return {
+            "request": {
+                "uid": "705ab4f5-6393-11e8-b7cc-42010a800002",
+                "namespace": username,
+                "userInfo": {
+                    "username": username
+                },
+                "object": {
+                    "metadata": {
+                        "labels": {}
+                    },
+                    "spec": {
+                        "containers": [{}]
+                    }
+                }
+            }
+        }
+
     # def test_gpu_quota_request(self):
     #     self.awsed_client.add_user_gpu_quota('user10', 10)
     #     self.awsed_client.get_user_gpu_quota('user10')
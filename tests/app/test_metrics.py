@@ -0,0 +1,116 @@
+import threading
+
+from hamcrest import assert_that, contains_string, equal_to, has_entries
+
+from dsmlp.app.metrics import ADMISSIONS, CACHES, REGISTRY, STAGE_SECONDS, Counter, Histogram, Registry, register_cache
+from dsmlp.app.validator import Validator
+from dsmlp.ext.cache import TTLCache
+from dsmlp.plugin.awsed import ListTeamsResponse, TeamJson, UserResponse
+from dsmlp.plugin.kube import Namespace
+from tests.app.test_async_validator import admission_review
+from tests.fakes import FakeAwsedClient, FakeKubeClient, FakeLogger
+
+
+class TestMetrics:
+    def test_counter_exposition(self):
+        registry = Registry()
+        counter = Counter('test_total', "Test counter", ['decision'], registry=registry)
+        counter.inc(('allowed',))
+        counter.inc(('allowed',))
+        counter.inc(('denied',))
+
+        assert_that(registry.expose(), equal_to(
+            '# HELP test_total Test counter\n'
+            '# TYPE test_total counter\n'
+            'test_total{decision="allowed"} 2\n'
+            'test_total{decision="denied"} 1\n'))
+
+    def test_histogram_exposition(self):
+        registry = Registry()
+        histogram = Histogram('test_seconds', "Test histogram", buckets=(.1, 1), registry=registry)
+        histogram.observe(.05)
+        histogram.observe(.5)
+        histogram.observe(5)
+
+        assert_that(registry.expose(), contains_string(
+            'test_seconds_bucket{le="0.1"} 1\n'
+            'test_seconds_bucket{le="1"} 2\n'
+            'test_seconds_bucket{le="+Inf"} 3\n'
+            'test_seconds_sum 5.55\n'
+            'test_seconds_count 3\n'))
+
+    def test_threads_are_aggregated(self):
+        counter = Counter('test_total', "Test counter", registry=None)
+
+        def work():
+            for _ in range(1000):
+                counter.inc()
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert_that(counter.values(), equal_to({(): 4000}))
+
+    def test_shards_of_exited_threads_are_retired(self):
+        counter = Counter('test_total', "Test counter", ['decision'], registry=None)
+        histogram = Histogram('test_seconds', "Test histogram", buckets=(.1, 1), registry=None)
+
+        def work():
+            counter.inc(('allowed',))
+            histogram.observe(.5)
+
+        for _ in range(50):
+            threads = [threading.Thread(target=work) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        work()
+
+        assert_that(counter.values(), equal_to({('allowed',): 201}))
+        assert_that(histogram.values(), equal_to({(): [0, 201, 0, 100.5]}))
+        assert_that((len(counter._shards), len(histogram._shards)), equal_to((1, 1)))
+
+    def test_cache_counters(self):
+        cache = TTLCache('test-metrics', ttl=60)
+        register_cache(cache.name, cache)
+        cache.get('key', lambda: 'value')
+        cache.get('key', lambda: 'value')
+
+        exposition = REGISTRY.expose()
+        del CACHES[cache.name]
+
+        assert_that(exposition, contains_string('dsmlp_cache_hits_total{cache="test-metrics"} 1\n'))
+        assert_that(exposition, contains_string('dsmlp_cache_misses_total{cache="test-metrics"} 1\n'))
+        assert_that(exposition, contains_string('dsmlp_cache_entries{cache="test-metrics"} 1\n'))
+
+    def test_validator_records_decisions(self):
+        awsed_client = FakeAwsedClient()
+        kube_client = FakeKubeClient()
+        awsed_client.add_user('user10', UserResponse(uid=10, enrollments=[]))
+        awsed_client.add_teams('user10', ListTeamsResponse(teams=[TeamJson(gid=1000)]))
+        kube_client.add_namespace('user10', Namespace(name='user10', labels={'k8s-sync': 'true'}, gpu_quota=10))
+        validator = Validator(awsed_client, kube_client, FakeLogger())
+        decisions = ADMISSIONS.values()
+        stages = STAGE_SECONDS.values()
+
+        validator.validate_request(admission_review('user10'))
+        validator.validate_request(admission_review('user10', run_as_user=3))
+
+        assert_that(diff(ADMISSIONS.values(), decisions), has_entries({
+            ('allowed', ''): 1,
+            ('denied', 'IDValidator'): 1}))
+        assert_that({labels: sum(counts[:-1]) for labels, counts in diff(STAGE_SECONDS.values(), stages).items()},
+                    has_entries({('decode',): 2, ('IDValidator',): 2, ('total',): 2}))
+
+
+def diff(after, before):
+    def subtract(new, old):
+        if isinstance(new, list):
+            return [n - o for n, o in zip(new, old or [0] * len(new))]
+        return new - (old or 0)
+
+    return {labels: subtract(value, before.get(labels)) for labels, value in after.items()}
@@ -0,0 +1,43 @@
+from hamcrest import assert_that, equal_to, is_, is_not
+
+from dsmlp.app.policy import PolicyCache, UserPolicy
+from dsmlp.plugin.awsed import ListTeamsResponse, TeamJson, UserResponse
+
+
+class TestUserPolicy:
+    def test_compile(self):
+        policy = UserPolicy.compile(UserResponse(uid=10, enrollments=['CSE100', 'CSE101']),
+                                    ListTeamsResponse(teams=[TeamJson(gid=1000), TeamJson(gid=1001)]))
+
+        assert_that(policy.uid, equal_to(10))
+        assert_that(policy.gids, equal_to(frozenset([1000, 1001, 0, 100])))
+        assert_that(policy.enrollments, equal_to(frozenset(['CSE100', 'CSE101'])))
+        assert_that(policy.gids_message, equal_to("[1000, 1001, 0, 100]"))
+        assert_that(policy.enrollments_message, equal_to("['CSE100', 'CSE101']"))
+
+    def test_cache_reuses_policy_for_same_responses(self):
+        cache = PolicyCache()
+        user = UserResponse(uid=10, enrollments=[])
+        teams = ListTeamsResponse(teams=[TeamJson(gid=1000)])
+
+        first = cache.get(user, teams)
+
+        assert_that(cache.get(user, teams), is_(first))
+        assert_that((cache.hits, cache.misses), equal_to((1, 1)))
+
+    def test_cache_recompiles_reloaded_responses(self):
+        cache = PolicyCache()
+        user = UserResponse(uid=10, enrollments=[])
+        first = cache.get(user, ListTeamsResponse(teams=[TeamJson(gid=1000)]))
+
+        second = cache.get(user, ListTeamsResponse(teams=[TeamJson(gid=2000)]))
+
+        assert_that(second, is_not(first))
+        assert_that(second.gids, equal_to(frozenset([2000, 0, 100])))
+
+    def test_cache_is_bounded(self):
+        cache = PolicyCache(maxsize=2)
+        for uid in range(3):
+            cache.get(UserResponse(uid=uid, enrollments=[]), ListTeamsResponse(teams=[]))
+
+        assert_that(len(cache), equal_to(2))
@@ -0,0 +1,182 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from hamcrest import assert_that, equal_to
+
+from dsmlp.app.reservations import GpuReservations
+from dsmlp.app.types import ObjectMeta
+from dsmlp.app.validator import AsyncValidator, Validator
+from dsmlp.ext.aio import ExecutorAwsedClient, ExecutorKubeClient
+from dsmlp.plugin.awsed import UserResponse
+from dsmlp.plugin.kube import Namespace
+from tests.app.test_async_validator import admission_review
+from tests.app.utils import gen_request, try_val_with_component
+from tests.fakes import FakeAwsedClient, FakeKubeClient, FakeLogger
+
+
+def gpu_pod(name: str, gpus: int):
+    request = gen_request(gpu_req=gpus, uid=name)
+    request.object.metadata = ObjectMeta(labels={}, name=name)
+    return request
+
+
+class ListingKubeClient(FakeKubeClient):
+    """Counts the GPUs of the pods created so far and reports them to the reservations, like DefaultKubeClient"""
+
+    def __init__(self, reservations: GpuReservations) -> None:
+        super().__init__()
+        self.reservations = reservations
+        self.created = {}
+
+    def get_gpus_in_namespace(self, name):
+        listed_at = self.reservations.clock()
+        pods = dict(self.created)
+        self.reservations.observe(name, list(pods), listed_at)
+        return sum(pods.values())
+
+
+class BlockingAwsedClient(FakeAwsedClient):
+    """Blocks the first user lookup until released"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.blocked = threading.Event()
+        self.release = threading.Event()
+
+    def describe_user(self, username):
+        if not self.blocked.is_set():
+            self.blocked.set()
+            self.release.wait(5)
+        return super().describe_user(username)
+
+
+class TestGpuReservations:
+    def setup_method(self) -> None:
+        self.now = 0
+        self.reservations = GpuReservations(timeout=60, clock=lambda: self.now)
+        self.awsed_client = FakeAwsedClient()
+        self.kube_client = FakeKubeClient()
+        self.awsed_client.add_user('user10', UserResponse(uid=10, enrollments=[]))
+        self.awsed_client.assign_user_gpu_quota('user10', {"gpu": 2})
+        self.kube_client.add_namespace('user10', Namespace(name='user10', labels={'k8s-sync': 'true'}, gpu_quota=10))
+        self.validator = Validator(self.awsed_client, self.kube_client, FakeLogger(),
+                                   gpu_reservations=self.reservations)
+
+    def test_admitted_gpus_are_reserved(self):
+        try_val_with_component(self.validator, gpu_pod('pod-a', 2), True)
+
+        try_val_with_component(self.validator, gpu_pod('pod-b', 1), False,
+                               "GPU quota exceeded. Wanted 1 but with 2 already in use, "
+                               "the quota of 2 would be exceeded.")
+
+    def test_observed_pods_are_released(self):
+        try_val_with_component(self.validator, gpu_pod('pod-a', 1), True)
+        self.kube_client.set_existing_gpus('user10', 1)
+        self.reservations.observe('user10', ['pod-a'])
+
+        try_val_with_component(self.validator, gpu_pod('pod-b', 1), True)
+        assert_that((len(self.reservations), self.reservations.observed_total), equal_to((1, 1)))
+
+    def test_lists_started_before_the_reservation_do_not_release_it(self):
+        try_val_with_component(self.validator, gpu_pod('pod-a', 2), True)
+        self.reservations.observe('user10', ['pod-a'], listed_at=-1)
+
+        assert_that(len(self.reservations), equal_to(1))
+
+    def test_reservations_expire(self):
+        try_val_with_component(self.validator, gpu_pod('pod-a', 2), True)
+        self.now = 60
+
+        try_val_with_component(self.validator, gpu_pod('pod-b', 2), True)
+        assert_that(self.reservations.expired_total, equal_to(1))
+
+    def test_dry_runs_are_not_reserved(self):
+        request = gpu_pod('pod-a', 2)
+        request.dryRun = True
+        try_val_with_component(self.validator, request, True)
+
+        try_val_with_component(self.validator, gpu_pod('pod-b', 2), True)
+
+    def test_denied_pods_are_not_reserved(self):
+        try_val_with_component(self.validator, gpu_pod('pod-a', 3), False,
+                               "GPU quota exceeded. Wanted 3 but with 0 already in use, "
+                               "the quota of 2 would be exceeded.")
+
+        assert_that(len(self.reservations), equal_to(0))
+
+    def test_concurrent_admissions_respect_quota(self):
+        self.awsed_client.assign_user_gpu_quota('user10', {"gpu": 4})
+        barrier = threading.Barrier(8)
+        allowed = []
+
+        def admit(i):
+            barrier.wait()
+            request = gpu_pod(f'pod-{i}', 1)
+            try:
+                self.validator.validate_pod(request)
+                allowed.append(i)
+            except Exception:
+                pass
+
+        threads = [threading.Thread(target=admit, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert_that(len(allowed), equal_to(4))
+
+
+class TestUsageReadUnderLock:
+    def setup_method(self) -> None:
+        self.reservations = GpuReservations(timeout=60)
+        self.awsed_client = BlockingAwsedClient()
+        self.kube_client = ListingKubeClient(self.reservations)
+        self.awsed_client.add_user('user10', UserResponse(uid=10, enrollments=[]))
+        self.awsed_client.assign_user_gpu_quota('user10', {"gpu": 1})
+        self.kube_client.add_namespace('user10', Namespace(name='user10', labels={'k8s-sync': 'true'}, gpu_quota=10))
+        self.executor = ThreadPoolExecutor(max_workers=4)
+
+    def teardown_method(self) -> None:
+        self.executor.shutdown()
+
+    def test_admission_does_not_use_usage_read_before_an_earlier_admission(self):
+        validator = Validator(self.awsed_client, self.kube_client, FakeLogger(), self.executor,
+                              gpu_reservations=self.reservations)
+        responses = {}
+
+        def admit(name):
+            responses[name] = validator.validate_request(
+                {'request': dict(admission_review('user10', gpus=1)['request'], uid=name)})
+
+        # pod-b starts first, with its lookups in flight while pod-a is admitted
+        thread = threading.Thread(target=admit, args=('pod-b',))
+        thread.start()
+        assert_that(self.awsed_client.blocked.wait(5), equal_to(True))
+        admit('pod-a')
+        # pod-a is created and a list showing it releases its reservation
+        self.kube_client.created['pod-a'] = 1
+        self.kube_client.get_gpus_in_namespace('user10')
+        assert_that(len(self.reservations), equal_to(0))
+        self.awsed_client.release.set()
+        thread.join(5)
+
+        assert_that((responses['pod-a']['response']['allowed'], responses['pod-b']['response']['allowed']),
+                    equal_to((True, False)))
+
+    def test_async_admissions_of_a_namespace_take_turns(self):
+        self.awsed_client.blocked.set()
+        self.awsed_client.assign_user_gpu_quota('user10', {"gpu": 2})
+        validator = AsyncValidator(ExecutorAwsedClient(self.awsed_client, self.executor),
+                                   ExecutorKubeClient(self.kube_client, self.executor), FakeLogger(),
+                                   gpu_reservations=self.reservations)
+
+        async def admit_all():
+            return await asyncio.gather(*(validator.validate_request(
+                {'request': dict(admission_review('user10', gpus=1)['request'], uid=f'pod-{i}')})
+                for i in range(6)))
+
+        responses = asyncio.run(admit_all())
+
+        assert_that(sum(response['response']['allowed'] for response in responses), equal_to(2))
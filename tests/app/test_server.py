@@ -0,0 +1,119 @@
+import os
+import signal
+import socket
+import threading
+import time
+
+import requests
+from hamcrest import assert_that, equal_to
+from waitress.server import create_server
+
+from dsmlp.server import Heartbeats, Supervisor, Worker, listen
+from tests.fakes import FakeClock
+
+
+class SleepingSupervisor(Supervisor):
+    """Workers check in until terminated, without serving anything"""
+
+    def serve_worker(self, slot: int) -> None:
+        stopped = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopped.append(signum))
+        while not stopped:
+            self.heartbeats.beat(slot)
+            time.sleep(0.05)
+
+
+def wait_for(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+class TestHeartbeats:
+    def test_health_aggregates_workers(self):
+        clock = FakeClock(100.0)
+        heartbeats = Heartbeats(3, stale_after=10, clock=clock)
+        for slot in range(3):
+            heartbeats.beat(slot)
+        assert_that(heartbeats.health(), equal_to((True, "OK 3/3 workers live")))
+
+        clock.now += 5
+        heartbeats.beat(0)
+        heartbeats.beat(2)
+        clock.now += 6
+
+        assert_that(heartbeats.stale(), equal_to([1]))
+        assert_that(heartbeats.health(), equal_to((False, "2/3 workers live, stale: 1")))
+
+
+class TestSupervisor:
+    def setup_method(self) -> None:
+        self.supervisor = SleepingSupervisor(workers=2, graceful_timeout=1, stale_after=1)
+
+    def teardown_method(self) -> None:
+        self.supervisor.stopping = True
+        self.supervisor.shutdown()
+
+    def test_warns_that_reservations_are_per_worker(self, monkeypatch):
+        monkeypatch.setenv('GPU_RESERVATION_TIMEOUT', '60')
+        warned = self.supervisor.check_reservations()
+        monkeypatch.setenv('GPU_RESERVATION_TIMEOUT', '0')
+
+        assert_that((warned, self.supervisor.check_reservations(), Supervisor(workers=1).check_reservations()),
+                    equal_to((True, False, False)))
+
+    def test_exited_workers_are_restarted(self):
+        pids = [self.supervisor.spawn(slot) for slot in range(2)]
+        os.kill(pids[0], signal.SIGKILL)
+
+        assert_that(wait_for(lambda: self.supervisor.reap() == [0]), equal_to(True))
+        assert_that(sorted(self.supervisor.pids.values()), equal_to([0, 1]))
+        assert_that(pids[0] in self.supervisor.pids, equal_to(False))
+
+    def test_rolling_restart_replaces_every_worker(self):
+        pids = [self.supervisor.spawn(slot) for slot in range(2)]
+
+        self.supervisor.rolling_restart()
+
+        assert_that(sorted(self.supervisor.pids.values()), equal_to([0, 1]))
+        assert_that(set(pids) & set(self.supervisor.pids), equal_to(set()))
+
+    def test_stale_workers_are_killed(self):
+        pid = self.supervisor.spawn(0)
+        self.supervisor.spawn(1)
+        os.kill(pid, signal.SIGSTOP)
+
+        assert_that(wait_for(lambda: 0 in self.supervisor.heartbeats.stale()), equal_to(True))
+        self.supervisor.kill_stale()
+
+        assert_that(wait_for(lambda: self.supervisor.reap() == [0]), equal_to(True))
+
+
+class TestWorker:
+    def test_stopping_worker_finishes_in_flight_requests(self):
+        started = threading.Event()
+
+        def app(environ, start_response):
+            started.set()
+            time.sleep(0.3)
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return [b'done']
+
+        sock = listen('127.0.0.1', 0, 16)
+        port = sock.getsockname()[1]
+        worker = Worker(0, sock, Heartbeats(1), threads=2, graceful_timeout=5)
+        server = create_server(app, sockets=[sock], threads=2)
+        responses = []
+        client = threading.Thread(target=lambda: responses.append(requests.get(f'http://127.0.0.1:{port}/')))
+        client.start()
+        threading.Thread(target=lambda: started.wait(5) and worker.stop(signal.SIGTERM, None)).start()
+
+        worker.serve(server)
+        client.join(5)
+
+        assert_that(responses[0].text, equal_to('done'))
+        assert_that(server.accepting, equal_to(False))
+        sock.close()
@@ -0,0 +1,165 @@
+import http.client
+import os
+import shutil
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+
+import pytest
+from hamcrest import assert_that, contains_string, equal_to
+
+from dsmlp.server import listen
+from dsmlp.tls import CertificateReloader, TLSServer, create_ssl_context
+
+pytestmark = pytest.mark.skipif(shutil.which('openssl') is None, reason="needs the openssl command")
+
+
+def self_signed(directory: str, name: str):
+    certfile, keyfile = os.path.join(directory, f'{name}.crt'), os.path.join(directory, f'{name}.key')
+    subprocess.run(['openssl', 'req', '-subj', f'/CN={name}', '-new', '-newkey', 'rsa:2048', '-nodes', '-x509',
+                    '-days', '1', '-keyout', keyfile, '-out', certfile], check=True, capture_output=True)
+    return certfile, keyfile
+
+
+def peer_name(port: int) -> str:
+    context = ssl._create_unverified_context()
+    with context.wrap_socket(socket.create_connection(('127.0.0.1', port))) as sock:
+        der = sock.getpeercert(binary_form=True)
+    pem = ssl.DER_cert_to_PEM_cert(der)
+    result = subprocess.run(['openssl', 'x509', '-noout', '-subject'], input=pem.encode(), capture_output=True)
+    return result.stdout.decode().strip()
+
+
+class TestTLSServer:
+    def setup_method(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.certfile, self.keyfile = self_signed(self.directory, 'first')
+        self.context = create_ssl_context(self.certfile, self.keyfile)
+        self.sock = listen('127.0.0.1', 0, 16)
+        self.port = self.sock.getsockname()[1]
+        self.release = threading.Event()
+        self.release.set()
+        self.stopping = False
+
+        self.proceed = threading.Event()
+        self.proceeded = []
+
+        def stream(start_response):
+            start_response('200 OK', [('Content-Type', 'application/x-ndjson')])
+            yield b'first\n'
+            self.proceeded.append(self.proceed.wait(5))
+            yield b'second\n'
+
+        def app(environ, start_response):
+            if environ['PATH_INFO'] == '/stream':
+                return stream(start_response)
+            self.release.wait(5)
+            body = environ['wsgi.input'].read()
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return [environ['REQUEST_METHOD'].encode(), b' ', environ['wsgi.url_scheme'].encode(), b' ', body]
+
+        self.server = TLSServer(self.sock, app, self.context, keep_alive_timeout=5)
+        self.thread = threading.Thread(target=self.server.serve, args=(lambda: self.stopping,),
+                                       kwargs={'graceful_timeout': 5, 'poll_interval': 0.05})
+        self.thread.start()
+
+    def teardown_method(self) -> None:
+        self.stopping = True
+        self.release.set()
+        self.thread.join(10)
+        self.sock.close()
+        shutil.rmtree(self.directory)
+
+    def connect(self) -> http.client.HTTPSConnection:
+        return http.client.HTTPSConnection('127.0.0.1', self.port, context=ssl._create_unverified_context())
+
+    def test_requests_share_a_connection(self):
+        connection = self.connect()
+        responses = []
+        for body in (b'one', b'two'):
+            connection.request('POST', '/validate', body=body)
+            response = connection.getresponse()
+            responses.append((response.status, response.read(), response.getheader('Connection')))
+            sock = connection.sock
+
+        assert_that(responses, equal_to([(200, b'POST https one', None), (200, b'POST https two', None)]))
+        assert_that(connection.sock is sock, equal_to(True))
+
+    def test_responses_without_length_are_streamed(self):
+        connection = self.connect()
+        connection.request('POST', '/stream', body=b'')
+        response = connection.getresponse()
+
+        first = response.read(6)
+        self.proceed.set()
+
+        assert_that((first, response.read()), equal_to((b'first\n', b'second\n')))
+        assert_that((response.getheader('Transfer-Encoding'), self.proceeded), equal_to(('chunked', [True])))
+        connection.request('GET', '/healthz')
+        assert_that(connection.getresponse().read(), equal_to(b'GET https '))
+
+    def send_raw(self, request: bytes) -> bytes:
+        context = ssl._create_unverified_context()
+        with context.wrap_socket(socket.create_connection(('127.0.0.1', self.port))) as sock:
+            sock.sendall(request)
+            return sock.recv(65536).split(b'\r\n', 1)[0]
+
+    def test_malformed_chunk_size_is_refused(self):
+        status = self.send_raw(b'POST /validate HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n'
+                               b'zz\r\nbody\r\n0\r\n\r\n')
+
+        assert_that(status, equal_to(b'HTTP/1.1 400 Invalid chunk size'))
+
+    def test_bodies_over_the_limit_are_refused(self):
+        self.server.max_body_size = 8
+
+        # Refused before the body is read
+        declared = self.send_raw(b'POST /validate HTTP/1.1\r\nHost: x\r\nContent-Length: 1000000000\r\n\r\n')
+        chunked = self.send_raw(b'POST /validate HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n'
+                                b'5\r\nxxxxx\r\n5\r\nxxxxx\r\n0\r\n\r\n')
+
+        assert_that((declared, chunked), equal_to((b'HTTP/1.1 413 Request body too large',) * 2))
+        connection = self.connect()
+        connection.request('POST', '/validate', body=b'x' * 8)
+        assert_that(connection.getresponse().read(), equal_to(b'POST https xxxxxxxx'))
+
+    def test_draining_finishes_in_flight_requests(self):
+        self.release.clear()
+        idle = self.connect()
+        idle.request('GET', '/healthz')
+        idle.getresponse().read()
+        connection = self.connect()
+        connection.request('POST', '/validate', body=b'late')
+        assert_that(wait_for(self.server.busy), equal_to(True))
+
+        self.stopping = True
+        time.sleep(0.2)
+        self.release.set()
+        response = connection.getresponse()
+
+        assert_that((response.read(), response.getheader('Connection')), equal_to((b'POST https late', 'close')))
+        self.thread.join(5)
+        assert_that(self.thread.is_alive(), equal_to(False))
+
+    def test_certificate_is_reloaded_when_its_files_change(self):
+        reloader = CertificateReloader(self.context, self.certfile, self.keyfile)
+        assert_that(reloader.check(), equal_to(False))
+
+        certfile, keyfile = self_signed(self.directory, 'second')
+        os.replace(certfile, self.certfile)
+        os.replace(keyfile, self.keyfile)
+
+        assert_that(reloader.check(), equal_to(True))
+        assert_that(peer_name(self.port), contains_string('second'))
+
+
+def wait_for(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
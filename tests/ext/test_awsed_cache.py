@@ -0,0 +1,140 @@
+import socket
+from concurrent.futures import Future
+
+import requests
+
+from hamcrest import assert_that, calling, equal_to, raises
+
+from dsmlp.ext.awsed import CachingAwsedClient, TimeoutSession
+from dsmlp.ext.cache import TTLCache
+from dsmlp.plugin.awsed import ListTeamsResponse, TeamJson, UnsuccessfulRequest, UserResponse
+from tests.fakes import CountingAwsedClient, FakeClock
+
+
+class ImmediateExecutor:
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+class TestCachingAwsedClient:
+    def setup_method(self) -> None:
+        self.clock = FakeClock()
+        self.awsed_client = CountingAwsedClient()
+        self.awsed_client.add_user('user10', UserResponse(uid=10, enrollments=[]))
+        self.awsed_client.add_teams('user10', ListTeamsResponse(teams=[TeamJson(gid=1000)]))
+
+        self.client = CachingAwsedClient(self.awsed_client, user_ttl=10, teams_ttl=10, stale_ttl=100, negative_ttl=2)
+        for cache in (self.client.users, self.client.teams, self.client.quotas):
+            cache.clock = self.clock
+            cache._executor = ImmediateExecutor()
+
+    def test_repeat_lookups_are_cached(self):
+        self.client.describe_user('user10')
+        self.client.describe_user('user10')
+        self.client.list_user_teams('user10')
+        self.client.list_user_teams('user10')
+
+        assert_that(self.awsed_client.requests, equal_to(
+            [('describe_user', 'user10'), ('list_user_teams', 'user10')]))
+
+    def test_entries_expire(self):
+        self.client.describe_user('user10')
+        self.clock.now = 11
+        self.client.describe_user('user10')
+
+        assert_that(len(self.awsed_client.calls), equal_to(2))
+
+    def test_hot_entries_refresh_ahead(self):
+        self.client.describe_user('user10')
+        self.clock.now = 9
+        self.client.describe_user('user10')
+        self.clock.now = 15
+        user = self.client.describe_user('user10')
+
+        assert_that(user.uid, equal_to(10))
+        assert_that(len(self.awsed_client.calls), equal_to(2))
+        assert_that(self.client.users.refreshes, equal_to(1))
+
+    def test_serves_stale_on_error(self):
+        self.client.describe_user('user10')
+        self.awsed_client.failing = True
+        self.clock.now = 50
+
+        assert_that(self.client.describe_user('user10').uid, equal_to(10))
+        assert_that(self.client.users.stale_hits, equal_to(1))
+
+    def test_not_found_expires_sooner(self):
+        self.client.describe_user('user11')
+        self.clock.now = 1
+        self.client.describe_user('user11')
+        self.clock.now = 3
+        self.client.describe_user('user11')
+        self.client.describe_user('user10')
+        self.clock.now = 6
+        self.client.describe_user('user10')
+
+        assert_that(self.awsed_client.requests, equal_to(
+            [('describe_user', 'user11'), ('describe_user', 'user11'), ('describe_user', 'user10')]))
+
+    def test_failed_lookups_are_not_cached(self):
+        self.awsed_client.failing = True
+        assert_that(calling(self.client.describe_user).with_args('user10'), raises(UnsuccessfulRequest))
+        self.awsed_client.failing = False
+
+        assert_that(self.client.describe_user('user10').uid, equal_to(10))
+        assert_that(len(self.awsed_client.calls), equal_to(2))
+
+    def test_raises_when_stale_window_passed(self):
+        self.client.describe_user('user10')
+        self.awsed_client.failing = True
+        self.clock.now = 200
+
+        assert_that(calling(self.client.describe_user).with_args('user10'), raises(UnsuccessfulRequest))
+
+
+class TestTimeoutSession:
+    def test_requests_time_out(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(1)
+        session = TimeoutSession(0.1)
+
+        try:
+            assert_that(calling(session.get).with_args(f'http://127.0.0.1:{sock.getsockname()[1]}/'),
+                        raises(requests.Timeout))
+        finally:
+            session.close()
+            sock.close()
+
+
+class TestTTLCache:
+    def test_interrupted_load_is_retried(self):
+        cache = TTLCache("test", ttl=10)
+
+        def interrupted():
+            raise KeyboardInterrupt()
+
+        assert_that(calling(cache.get).with_args('a', interrupted), raises(KeyboardInterrupt))
+        assert_that(cache.get('a', lambda: 1), equal_to(1))
+
+    def test_no_background_refresh(self):
+        clock = FakeClock()
+        cache = TTLCache("test", ttl=10, executor=ImmediateExecutor(), clock=clock, background_refresh=False)
+        cache.get('a', lambda: 1)
+        clock.now = 9.9
+        cache.get('a', lambda: 2)
+
+        assert_that((cache.get('a', lambda: 2), cache.refreshes), equal_to((1, 0)))
+
+    def test_lru_eviction(self):
+        cache = TTLCache("test", ttl=10, maxsize=2)
+        cache.get('a', lambda: 1)
+        cache.get('b', lambda: 2)
+        cache.get('a', lambda: 1)
+        cache.get('c', lambda: 3)
+
+        assert_that(cache.get('a', lambda: 'reloaded'), equal_to(1))
+        assert_that(cache.get('b', lambda: 'reloaded'), equal_to('reloaded'))
+        assert_that(cache.evictions, equal_to(2))
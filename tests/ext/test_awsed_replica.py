@@ -0,0 +1,103 @@
+from hamcrest import assert_that, calling, equal_to, raises
+
+from dsmlp.ext.awsed_replica import AwsedReplica
+from dsmlp.plugin.awsed import ListTeamsResponse, TeamJson, UnsuccessfulRequest, UserResponse
+from tests.fakes import CountingAwsedClient, FakeClock
+
+
+class TestAwsedReplica:
+    def setup_method(self) -> None:
+        self.clock = FakeClock()
+        self.awsed_client = CountingAwsedClient()
+        self.fallback = CountingAwsedClient()
+        self.usernames = ['user10', 'user11']
+        for client in (self.awsed_client, self.fallback):
+            client.add_user('user10', UserResponse(uid=10, enrollments=['CSE100']))
+            client.add_teams('user10', ListTeamsResponse(teams=[TeamJson(gid=1000)]))
+            client.add_user('user11', UserResponse(uid=11, enrollments=[]))
+            client.add_user('user12', UserResponse(uid=12, enrollments=[]))
+            client.assign_user_gpu_quota('user10', {"gpu": 4})
+
+        self.replica = AwsedReplica(self.awsed_client, lambda: self.usernames, fallback=self.fallback,
+                                    batch_size=1, clock=self.clock)
+        self.replica.start = lambda: None
+
+    def test_initial_load(self):
+        self.replica.sync()
+        self.awsed_client.calls.clear()
+
+        assert_that(self.replica.describe_user('user10'), equal_to(UserResponse(uid=10, enrollments=['CSE100'])))
+        assert_that(self.replica.list_user_teams('user10'), equal_to(ListTeamsResponse(teams=[TeamJson(gid=1000)])))
+        assert_that(self.replica.get_user_gpu_quota('user10'), equal_to(4))
+        assert_that(self.replica.list_user_teams('user11'), equal_to(ListTeamsResponse(teams=[])))
+        assert_that((self.awsed_client.calls, self.fallback.calls, self.replica.hits), equal_to(([], [], 4)))
+
+    def test_unknown_users_fall_back_and_are_added(self):
+        self.replica.sync()
+
+        assert_that(self.replica.describe_user('user12'), equal_to(UserResponse(uid=12, enrollments=[])))
+        assert_that(self.fallback.requests, equal_to([('describe_user', 'user12')]))
+
+        self.replica.sync()
+        self.replica.describe_user('user12')
+        assert_that((len(self.replica), len(self.fallback.calls)), equal_to((3, 1)))
+
+    def test_rolling_sync_refreshes_oldest(self):
+        self.replica.sync()
+        self.awsed_client.add_user('user10', UserResponse(uid=10, enrollments=['CSE100', 'CSE101']))
+        self.awsed_client.add_user('user11', UserResponse(uid=11, enrollments=['CSE101']))
+        self.clock.now = 10
+        self.awsed_client.requests.clear()
+
+        self.replica.sync()
+
+        refreshed = {username for _, username in self.awsed_client.requests}
+        assert_that(len(refreshed), equal_to(1))
+        assert_that(self.replica.lag(), equal_to(10))
+        self.clock.now = 20
+        self.replica.sync()
+        assert_that(self.replica.describe_user('user11').enrollments, equal_to(['CSE101']))
+        assert_that(self.replica.describe_user('user10').enrollments, equal_to(['CSE100', 'CSE101']))
+
+    def test_keeps_records_when_awsed_fails(self):
+        self.replica.sync()
+        self.awsed_client.failing = True
+        self.clock.now = 10
+
+        self.replica.sync()
+
+        assert_that(self.replica.describe_user('user10').uid, equal_to(10))
+        assert_that((self.replica.sync_errors, self.replica.age(), self.replica.lag()), equal_to((1, 10, 10)))
+
+    def test_failed_sync_is_not_a_sync(self):
+        self.awsed_client.failing = True
+        self.replica.sync()
+
+        assert_that((self.replica.has_synced(), self.replica.age(), len(self.replica)), equal_to((False, None, 0)))
+
+        self.awsed_client.failing = False
+        self.clock.now = 5
+        self.replica.sync()
+
+        assert_that((self.replica.has_synced(), self.replica.age(), len(self.replica)), equal_to((True, 0, 2)))
+
+    def test_removed_namespaces_are_dropped(self):
+        self.replica.relist_period = 0
+        self.replica.sync()
+        self.usernames = ['user10']
+
+        self.replica.sync()
+
+        assert_that(len(self.replica), equal_to(1))
+
+    def test_records_older_than_max_age_fall_back(self):
+        self.replica.max_age = 30
+        self.replica.sync()
+        self.awsed_client.failing = self.fallback.failing = True
+        self.clock.now = 20
+        self.replica.sync()
+
+        assert_that(self.replica.describe_user('user10').uid, equal_to(10))
+        self.clock.now = 31
+        assert_that(calling(self.replica.describe_user).with_args('user10'), raises(UnsuccessfulRequest))
+        assert_that(self.fallback.requests, equal_to([('describe_user', 'user10')]))
@@ -0,0 +1,97 @@
+import threading
+
+from hamcrest import assert_that, calling, equal_to, raises
+
+from dsmlp.ext.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, Guard, GuardedAwsedClient, is_kube_failure
+from dsmlp.plugin.awsed import UserResponse
+from dsmlp.plugin.errors import DependencyUnavailable
+from tests.fakes import CountingAwsedClient, FakeClock
+
+
+class TestCircuitBreaker:
+    def setup_method(self) -> None:
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker('awsed', failure_threshold=2, reset_timeout=10, clock=self.clock)
+
+    def test_opens_after_threshold(self):
+        self.breaker.record_failure()
+        self.breaker.before_call()
+        self.breaker.record_failure()
+
+        assert_that(calling(self.breaker.before_call), raises(DependencyUnavailable))
+        assert_that((self.breaker.state, self.breaker.rejections), equal_to((OPEN, 1)))
+
+    def test_half_open_lets_one_trial_through(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.clock.now = 10
+
+        self.breaker.before_call()
+
+        assert_that(self.breaker.state, equal_to(HALF_OPEN))
+        assert_that(calling(self.breaker.before_call), raises(DependencyUnavailable))
+        self.breaker.record_success()
+        assert_that(self.breaker.state, equal_to(CLOSED))
+
+    def test_failed_trial_reopens(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.clock.now = 10
+        self.breaker.before_call()
+
+        self.breaker.record_failure()
+
+        assert_that((self.breaker.state, self.breaker.opened_at, self.breaker.opens), equal_to((OPEN, 10, 2)))
+
+
+class TestGuard:
+    def setup_method(self) -> None:
+        self.awsed_client = CountingAwsedClient()
+        self.awsed_client.add_user('user10', UserResponse(uid=10, enrollments=[]))
+        self.guard = Guard(CircuitBreaker('awsed', failure_threshold=1), timeout=0.05)
+        self.client = GuardedAwsedClient(self.awsed_client, self.guard)
+
+    def test_passes_results_through(self):
+        assert_that(self.client.describe_user('user10').uid, equal_to(10))
+
+    def test_times_out_slow_calls(self):
+        release = threading.Event()
+        self.awsed_client.describe_user = lambda username: release.wait(5)
+
+        assert_that(calling(self.client.describe_user).with_args('user10'), raises(DependencyUnavailable))
+        release.set()
+        assert_that((self.guard.timeouts, self.guard.breaker.state), equal_to((1, OPEN)))
+
+    def test_open_breaker_fails_fast(self):
+        self.awsed_client.failing = True
+        assert_that(calling(self.client.describe_user).with_args('user10'), raises(Exception))
+        self.awsed_client.calls.clear()
+
+        assert_that(calling(self.client.describe_user).with_args('user10'), raises(DependencyUnavailable))
+        assert_that(self.awsed_client.calls, equal_to([]))
+
+    def test_saturated_guard_fails_fast(self):
+        guard = Guard(CircuitBreaker('awsed', failure_threshold=1), timeout=5, workers=1)
+        client = GuardedAwsedClient(self.awsed_client, guard)
+        release, started = threading.Event(), threading.Event()
+        self.awsed_client.list_user_teams = lambda username: started.set() or release.wait(5)
+        thread = threading.Thread(target=client.list_user_teams, args=('user10',))
+        thread.start()
+        started.wait(5)
+
+        try:
+            client.describe_user('user10')
+            reason = None
+        except DependencyUnavailable as ex:
+            reason = ex.reason
+        release.set()
+        thread.join(5)
+
+        assert_that((reason, guard.saturations, guard.breaker.state), equal_to(('saturated', 1, CLOSED)))
+        assert_that(client.describe_user('user10').uid, equal_to(10))
+
+    def test_client_errors_are_not_failures(self):
+        class NotFound(Exception):
+            status = 404
+
+        assert_that((is_kube_failure(NotFound()), is_kube_failure(Exception())), equal_to((False, True)))
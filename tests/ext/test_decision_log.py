@@ -0,0 +1,149 @@
+import json
+
+from hamcrest import assert_that, contains_string, equal_to, has_items
+
+from dsmlp.app.reservations import GpuReservations
+from dsmlp.app.validator import Validator
+from dsmlp.bench import replay
+from dsmlp.ext.cache import TTLCache
+from dsmlp.ext.decision_log import (FileDecisionLog, RecordReader, decode_lookup, decode_review, encode_lookup,
+                                    read_records)
+from dsmlp.plugin.awsed import ListTeamsResponse, TeamJson, UnsuccessfulRequest, UserResponse
+from dsmlp.plugin.errors import DependencyUnavailable
+from dsmlp.plugin.kube import Namespace
+from tests.app.test_async_validator import admission_review
+from tests.app.test_degraded import UnavailableAwsedClient
+from tests.fakes import FakeAwsedClient, FakeKubeClient, FakeLogger
+
+
+class TestDecisionLog:
+    def setup_method(self) -> None:
+        self.awsed_client = FakeAwsedClient()
+        self.kube_client = FakeKubeClient()
+        self.awsed_client.add_user('user10', UserResponse(uid=10, enrollments=[]))
+        self.awsed_client.add_teams('user10', ListTeamsResponse(teams=[TeamJson(gid=1000)]))
+        self.kube_client.add_namespace('user10', Namespace(name='user10', labels={'k8s-sync': 'true'}, gpu_quota=10))
+
+    def capture(self, path, *reviews, id_decision_cache=None, degraded_policies=None, gpu_reservations=None):
+        decision_log = FileDecisionLog(str(path))
+        validator = Validator(self.awsed_client, self.kube_client, FakeLogger(), decision_log=decision_log,
+                              id_decision_cache=id_decision_cache, degraded_policies=degraded_policies,
+                              gpu_reservations=gpu_reservations)
+        for review in reviews:
+            validator.validate_request(review)
+        decision_log.close()
+
+    def test_records(self, tmp_path):
+        path = tmp_path / 'decisions.log'
+        review = admission_review('user10', run_as_user=3)
+
+        self.capture(path, review)
+
+        [record] = list(read_records(str(path)))
+        assert_that(decode_review(record['review']), equal_to(review))
+        assert_that(record['allowed'], equal_to(False))
+        assert_that(list(record['timings']), has_items('decode', 'IDValidator', 'total'))
+        assert_that(decode_lookup('user', record['lookups']['user']), equal_to((UserResponse(uid=10, enrollments=[]), None)))
+        assert_that(list(record['lookups']), equal_to(['user']))
+
+    def test_lookup_errors(self):
+        result, error = decode_lookup('teams', {'error': 'UnsuccessfulRequest', 'message': 'down'})
+
+        assert_that((result, type(error), str(error)), equal_to((None, UnsuccessfulRequest, 'down')))
+
+    def test_replay_recorded(self, tmp_path, capsys):
+        path = tmp_path / 'decisions.log'
+        self.capture(path, admission_review('user10'), admission_review('user10', run_as_user=3),
+                     admission_review('user2'))
+
+        replay.main([str(path), '--json'])
+
+        results = json.loads(capsys.readouterr().out)
+        assert_that((results['requests'], results['mismatches']), equal_to((3, [])))
+
+    def test_replay_decision_cache_hits(self, tmp_path, capsys):
+        path = tmp_path / 'decisions.log'
+        self.capture(path, admission_review('user10', run_as_user=3), admission_review('user10', run_as_user=3),
+                     id_decision_cache=TTLCache('test-decisions', ttl=60))
+
+        records = list(read_records(str(path)))
+        replay.main([str(path), '--json'])
+
+        assert_that([list(record['lookups']) for record in records], equal_to([['user'], ['id_decision']]))
+        results = json.loads(capsys.readouterr().out)
+        assert_that((results['requests'], results['mismatches']), equal_to((2, [])))
+
+    def test_lookup_unavailable(self):
+        record = encode_lookup(None, DependencyUnavailable('awsed', 'circuit open'))
+
+        result, error = decode_lookup('user', json.loads(json.dumps(record)))
+
+        assert_that((result, type(error), error.dependency, error.reason),
+                    equal_to((None, DependencyUnavailable, 'awsed', 'circuit open')))
+
+    def test_replay_degraded_decisions(self, tmp_path, capsys, monkeypatch):
+        self.awsed_client = UnavailableAwsedClient()
+        results = {}
+        for policy in ('cache', 'deny', 'allow'):
+            path = tmp_path / f'{policy}.log'
+            self.capture(path, admission_review('user10', run_as_user=3), degraded_policies={'awsed': policy})
+            monkeypatch.setenv('AWSED_DEGRADED_POLICY', policy)
+
+            replay.main([str(path), '--json'])
+
+            [record] = list(read_records(str(path)))
+            results[policy] = (record['allowed'], json.loads(capsys.readouterr().out)['mismatches'])
+
+        assert_that(results, equal_to({'cache': (False, []), 'deny': (False, []), 'allow': (True, [])}))
+
+    def test_replay_gpu_reservations(self, tmp_path, capsys):
+        path = tmp_path / 'decisions.log'
+        self.awsed_client.assign_user_gpu_quota('user10', {"gpu": 2})
+        self.capture(path, admission_review('user10', gpus=2), admission_review('user10', gpus=2),
+                     gpu_reservations=GpuReservations(timeout=60))
+
+        records = list(read_records(str(path)))
+        replay.main([str(path), '--json'])
+
+        assert_that([(record['allowed'], record['lookups']['gpus_reserved']) for record in records],
+                    equal_to([(True, {'result': 0}), (False, {'result': 2})]))
+        results = json.loads(capsys.readouterr().out)
+        assert_that((results['requests'], results['mismatches']), equal_to((2, [])))
+
+    def test_replay_reports_differences(self, tmp_path, capsys):
+        path = tmp_path / 'decisions.log'
+        self.capture(path, admission_review('user10'))
+        record = json.loads(path.read_text())
+        record['response']['response']['allowed'] = False
+        path.write_text(json.dumps(record) + "\n")
+
+        replay.main([str(path)])
+
+        assert_that(capsys.readouterr().out, contains_string("1 requests, 1 decisions differ"))
+
+    def test_logs_sharing_a_file_do_not_interleave(self, tmp_path):
+        path = tmp_path / 'decisions.log'
+        logs = [FileDecisionLog(str(path)) for _ in range(4)]
+        review = admission_review('user10')
+        response = Validator(self.awsed_client, self.kube_client, FakeLogger()).validate_request(review)
+        lookups = {'user': (UserResponse(uid=10, enrollments=[]), None)}
+
+        for _ in range(200):
+            for decision_log in logs:
+                decision_log.record(review, response, {'total': 0.001}, lookups)
+        for decision_log in logs:
+            decision_log.close()
+
+        reader = RecordReader(str(path))
+        assert_that((len(list(reader)), reader.skipped), equal_to((800, 0)))
+
+    def test_unreadable_records_are_skipped_and_counted(self, tmp_path, capsys):
+        path = tmp_path / 'decisions.log'
+        self.capture(path, admission_review('user10'), admission_review('user2'))
+        lines = path.read_text().splitlines()
+        path.write_text('\n'.join([lines[0], lines[1][:40], '[]', lines[1]]) + '\n')
+
+        replay.main([str(path), '--json'])
+
+        results = json.loads(capsys.readouterr().out)
+        assert_that((results['requests'], results['skipped'], results['mismatches']), equal_to((2, 2, [])))
@@ -0,0 +1,111 @@
+from hamcrest import assert_that, calling, equal_to, raises
+from kubernetes.client import (V1Container, V1ListMeta, V1Namespace, V1ObjectMeta, V1Pod, V1PodList,
+                               V1PodSpec, V1PodStatus, V1ResourceRequirements)
+
+from dsmlp.ext.breaker import CircuitBreaker, Guard
+from dsmlp.ext.informer import NamespaceCache, PodGpuLedger
+from dsmlp.ext.kube import DefaultKubeClient
+from dsmlp.plugin.errors import DependencyUnavailable
+from dsmlp.plugin.kube import Namespace
+
+
+def gpu_pod(namespace: str, name: str, gpus: int, phase: str = "Running") -> V1Pod:
+    return V1Pod(
+        metadata=V1ObjectMeta(namespace=namespace, name=name),
+        spec=V1PodSpec(containers=[V1Container(
+            name="container1",
+            resources=V1ResourceRequirements(limits={"nvidia.com/gpu": str(gpus)}))]),
+        status=V1PodStatus(phase=phase))
+
+
+class FakeNamespacedClient:
+    def __init__(self, pods, namespaces=None):
+        self.pods = pods
+        self.namespaces = namespaces or {}
+
+    def read_namespace(self, name):
+        return self.namespaces.get(name, name)
+
+    def list_namespaced_pod(self, namespace):
+        return V1PodList(items=self.pods, metadata=V1ListMeta(resource_version="1"))
+
+
+class TestPodGpuLedger:
+    def setup_method(self) -> None:
+        self.ledger = PodGpuLedger(lambda: None)
+        self.ledger.replace([
+            gpu_pod('user10', 'pod1', 1),
+            gpu_pod('user10', 'pod2', 2),
+            gpu_pod('user10', 'done', 4, phase="Succeeded"),
+            gpu_pod('user11', 'pod1', 1),
+        ])
+
+    def test_sums_gpus_per_namespace(self):
+        assert_that(self.ledger.gpus_in_namespace('user10'), equal_to(3))
+        assert_that(self.ledger.gpus_in_namespace('user11'), equal_to(1))
+        assert_that(self.ledger.gpus_in_namespace('user12'), equal_to(0))
+
+    def test_applies_watch_events(self):
+        self.ledger.apply('ADDED', gpu_pod('user10', 'pod3', 1))
+        self.ledger.apply('MODIFIED', gpu_pod('user10', 'pod2', 2, phase="Failed"))
+        self.ledger.apply('DELETED', gpu_pod('user11', 'pod1', 1))
+
+        assert_that(self.ledger.gpus_in_namespace('user10'), equal_to(2))
+        assert_that(self.ledger.gpus_in_namespace('user11'), equal_to(0))
+
+    def test_kube_client_reads_from_synced_ledger(self):
+        self.ledger.start = lambda: None
+        self.ledger._synced.set()
+        client = DefaultKubeClient(gpu_ledger=self.ledger)
+        client.get_policy_api = None
+
+        assert_that(client.get_gpus_in_namespace('user10'), equal_to(3))
+
+    def test_kube_client_lists_pods_until_ledger_synced(self):
+        self.ledger.start = lambda: None
+        client = DefaultKubeClient(gpu_ledger=self.ledger)
+        client.get_policy_api = lambda: FakeNamespacedClient([gpu_pod('user10', 'pod1', 5)])
+
+        assert_that(client.get_gpus_in_namespace('user10'), equal_to(5))
+
+
+def namespace(name: str, gpu_limit: str = None) -> V1Namespace:
+    annotations = {'gpu-limit': gpu_limit} if gpu_limit is not None else None
+    return V1Namespace(metadata=V1ObjectMeta(name=name, labels={'k8s-sync': 'true'}, annotations=annotations))
+
+
+class TestNamespaceCache:
+    def setup_method(self) -> None:
+        self.cache = NamespaceCache(lambda: None)
+        self.cache.start = lambda: None
+        self.cache.replace([namespace('user10', gpu_limit='4'), namespace('user11')])
+        self.cache._synced.set()
+
+    def test_parses_gpu_limit(self):
+        assert_that(self.cache.get('user10'), equal_to(
+            Namespace(name='user10', labels={'k8s-sync': 'true'}, gpu_quota=4)))
+        assert_that(self.cache.get('user11').gpu_quota, equal_to(1))
+
+    def test_applies_watch_events(self):
+        self.cache.apply('MODIFIED', namespace('user11', gpu_limit='2'))
+        self.cache.apply('DELETED', namespace('user10'))
+
+        assert_that(self.cache.get('user11').gpu_quota, equal_to(2))
+        assert_that(self.cache.get('user10'), equal_to(None))
+
+    def test_kube_client_falls_back_on_miss(self):
+        client = DefaultKubeClient(namespace_cache=self.cache)
+        client.get_policy_api = lambda: FakeNamespacedClient([], {'user12': namespace('user12', gpu_limit='8')})
+
+        assert_that(client.get_namespace('user10').gpu_quota, equal_to(4))
+        assert_that(client.get_namespace('user12').gpu_quota, equal_to(8))
+        assert_that((self.cache.hits, self.cache.misses), equal_to((1, 1)))
+
+    def test_guard_covers_only_api_fallbacks(self):
+        breaker = CircuitBreaker('kube', failure_threshold=1)
+        breaker.record_failure()
+        client = DefaultKubeClient(namespace_cache=self.cache, guard=Guard(breaker, timeout=5))
+        client.get_policy_api = lambda: FakeNamespacedClient([], {'user12': namespace('user12', gpu_limit='8')})
+
+        assert_that(client.get_namespace('user10').gpu_quota, equal_to(4))
+        assert_that(calling(client.get_namespace).with_args('user12'), raises(DependencyUnavailable))
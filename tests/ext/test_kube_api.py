@@ -0,0 +1,54 @@
+from hamcrest import assert_that, equal_to, same_instance
+from kubernetes.client import Configuration
+
+from dsmlp.ext.kube_api import KubeApiProvider, PooledApiClient, TokenBucket
+from tests.fakes import FakeClock
+
+
+class TestTokenBucket:
+    def test_allows_burst_then_throttles(self):
+        clock = FakeClock()
+        bucket = TokenBucket(qps=10, burst=2, clock=clock, sleep=clock.sleep)
+
+        bucket.acquire()
+        bucket.acquire()
+        assert_that(clock.slept, equal_to([]))
+
+        bucket.acquire()
+        assert_that(clock.slept, equal_to([0.1]))
+
+    def test_refills_over_time(self):
+        clock = FakeClock()
+        bucket = TokenBucket(qps=10, burst=1, clock=clock, sleep=clock.sleep)
+
+        bucket.acquire()
+        clock.now += 1
+        bucket.acquire()
+
+        assert_that(clock.slept, equal_to([]))
+
+
+class TestPooledApiClient:
+    def setup_method(self) -> None:
+        self.client = PooledApiClient(Configuration(), TokenBucket(qps=0, burst=0), request_timeout=5)
+        self.timeouts = []
+        self.client.rest_client.GET = lambda url, **kwargs: self.timeouts.append(kwargs['_request_timeout'])
+
+    def test_applies_default_timeout(self):
+        self.client.request("GET", "http://localhost/api/v1/namespaces/user10")
+        self.client.request("GET", "http://localhost/api/v1/namespaces/user10", _request_timeout=1)
+
+        assert_that(self.timeouts, equal_to([5, 1]))
+
+    def test_watches_have_no_default_timeout(self):
+        self.client.request("GET", "http://localhost/api/v1/pods", query_params=[('watch', True)])
+
+        assert_that(self.timeouts, equal_to([None]))
+
+
+class TestKubeApiProvider:
+    def test_reuses_client(self):
+        provider = KubeApiProvider(pool_size=4)
+        provider.create_api_client = lambda: PooledApiClient(Configuration(), provider.limiter)
+
+        assert_that(provider.core_v1(), same_instance(provider.core_v1()))
@@ -1,12 +1,14 @@
 import inspect
+import json
 from operator import contains
 from dsmlp.app.validator import Validator
 from dsmlp.plugin.awsed import ListTeamsResponse, TeamJson, UserResponse
 from dsmlp.plugin.kube import Namespace
 from hamcrest import assert_that, contains_inanyorder, equal_to, has_item
 from tests.fakes import FakeAwsedClient, FakeLogger, FakeKubeClient
-from dsmlp.ext.kube import DefaultKubeClient
-from kubernetes.client import V1PodList, V1Pod, V1PodSpec, V1Container, V1ResourceRequirements
+from dsmlp.bench.kube import CannedApiClient, CannedResponse
+from dsmlp.ext.kube import NON_TERMINAL_PODS, DefaultKubeClient, raw_pod_gpus
+from kubernetes.client import CoreV1Api, V1PodList, V1Pod, V1PodSpec, V1Container, V1ResourceRequirements
 
 class FakeInternalClient:
     def read_namespace(self, name: str) -> Namespace:
@@ -89,3 +91,50 @@ class TestValidator:
         response = validator.validate_request(json)
 
         return response
+
+
+class FakeRawInternalClient:
+    def __init__(self, pods) -> None:
+        self.pods = pods
+        self.calls = []
+
+    def list_namespaced_pod(self, **kwargs):
+        self.calls.append(kwargs)
+        return CannedResponse(json.dumps({'items': self.pods}).encode())
+
+
+class TestRawReads:
+    def test_raw_pod_gpus(self):
+        def pod(resources, phase='Running'):
+            return {'spec': {'containers': [{'name': 'main', 'resources': resources}]}, 'status': {'phase': phase}}
+
+        assert_that([raw_pod_gpus(pod({'requests': {'nvidia.com/gpu': '1'}, 'limits': {'nvidia.com/gpu': '2'}})),
+                     raw_pod_gpus(pod({'requests': {'nvidia.com/gpu': '3'}})),
+                     raw_pod_gpus(pod({'limits': {'nvidia.com/gpu': '1'}, 'requests': {'cpu': '1'}})),
+                     raw_pod_gpus(pod({})),
+                     raw_pod_gpus(pod(None)),
+                     raw_pod_gpus({'spec': {'containers': [{'name': 'main'}]}}),
+                     raw_pod_gpus(pod({'limits': {'nvidia.com/gpu': '1'}}, phase='Failed'))],
+                    equal_to([2, 3, 1, 0, 0, 0, 0]))
+
+    def test_raw_reads_filter_server_side(self):
+        api = FakeRawInternalClient([{'metadata': {'name': 'a'}, 'spec': {'containers': [
+            {'name': 'main', 'resources': {'limits': {'nvidia.com/gpu': '2'}}}]}}])
+        observed = []
+        client = DefaultKubeClient(raw_reads=True, pod_observer=lambda namespace, pods, listed_at: observed.append((namespace, pods)))
+        client.get_policy_api = lambda: api
+
+        assert_that(client.get_gpus_in_namespace('user10'), equal_to(2))
+        assert_that(api.calls, equal_to([{'namespace': 'user10', 'field_selector': NON_TERMINAL_PODS,
+                                          'resource_version': '0', '_preload_content': False}]))
+        assert_that(observed, equal_to([('user10', ['a'])]))
+
+    def test_raw_reads_count_the_same_gpus(self):
+        api = CoreV1Api(CannedApiClient('user10', pods=12, terminal=4))
+        counts = []
+        for raw_reads in (False, True):
+            client = DefaultKubeClient(raw_reads=raw_reads)
+            client.get_policy_api = lambda: api
+            counts.append(client.get_gpus_in_namespace('user10'))
+
+        assert_that(counts, equal_to([8, 8]))
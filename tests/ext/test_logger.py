@@ -0,0 +1,38 @@
+import logging
+import queue
+
+from hamcrest import assert_that, equal_to
+
+from dsmlp.ext.logger import DeferredQueueHandler
+from dsmlp.plugin.logger import StructuredMessage
+
+
+class CountingValue:
+    def __init__(self):
+        self.rendered = 0
+
+    def __str__(self):
+        self.rendered += 1
+        return "value"
+
+
+class TestDeferredQueueHandler:
+    def setup_method(self) -> None:
+        self.queue = queue.Queue(maxsize=1)
+        self.handler = DeferredQueueHandler(self.queue)
+
+    def log(self, message):
+        self.handler.handle(logging.LogRecord('dsmlp', logging.INFO, __file__, 0, message, None, None))
+
+    def test_messages_are_not_formatted_on_the_calling_thread(self):
+        value = CountingValue()
+        self.log(StructuredMessage("Allowed request", {"username": value}))
+
+        assert_that(value.rendered, equal_to(0))
+        assert_that(self.queue.get_nowait().getMessage(), equal_to("Allowed request username=value"))
+
+    def test_drops_records_when_full(self):
+        self.log("first")
+        self.log("second")
+
+        assert_that(self.handler.dropped, equal_to(1))
@@ -0,0 +1,177 @@
+import os
+import signal
+import struct
+
+from hamcrest import assert_that, calling, equal_to, raises
+
+from dsmlp.ext.shm_cache import (SEQ_OFFSET, FILE_HEADER, SLOT_HEADER, SharedCacheAwsedClient, SharedCacheKubeClient,
+                                 SharedTable, key_hash)
+from dsmlp.plugin.awsed import ListTeamsResponse, TeamJson, UnsuccessfulRequest, UserResponse
+from dsmlp.plugin.kube import Namespace
+from tests.fakes import CountingAwsedClient, FakeClock, FakeKubeClient
+
+
+class SharedTableTest:
+    def setup_method(self, method) -> None:
+        self.path = f'/tmp/dsmlp-shm-test-{os.getpid()}'
+        self.clock = FakeClock(1000.0)
+        self.table = SharedTable(self.path, slots=8, slot_size=256, probe=2, clock=self.clock)
+
+    def teardown_method(self, method) -> None:
+        self.table.close()
+        for suffix in ('', '.awsed-shared.lock', '.namespaces-shared.lock'):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+
+class TestSharedTable(SharedTableTest):
+    def test_put_and_get(self):
+        self.table.put('user:alice', b'one')
+        self.table.put('user:alice', b'two')
+
+        assert_that(self.table.get('user:alice'), equal_to((b'two', 1000.0)))
+        assert_that(self.table.get('user:bob'), equal_to(None))
+        assert_that(len(self.table), equal_to(1))
+
+    def test_oversized_values_are_not_stored(self):
+        assert_that(self.table.put('user:alice', b'x' * 256), equal_to(False))
+        assert_that((self.table.get('user:alice'), self.table.oversized), equal_to((None, 1)))
+
+    def test_other_processes_see_writes(self):
+        other = SharedTable(self.path, slots=1, slot_size=1)
+
+        self.table.put('user:alice', b'one')
+
+        assert_that((other.slots, other.slot_size), equal_to((8, 256)))
+        assert_that(other.get('user:alice')[0], equal_to(b'one'))
+        other.close()
+
+    def test_least_recently_written_is_evicted(self):
+        table = SharedTable(self.path + '-small', slots=2, slot_size=256, probe=2, clock=self.clock)
+        for i in range(3):
+            self.clock.now += 1
+            table.put(f'user:{i}', str(i).encode())
+
+        assert_that([table.get(f'user:{i}') is not None for i in range(3)], equal_to([False, True, True]))
+        assert_that(table.evictions, equal_to(1))
+        table.close()
+        os.remove(self.path + '-small')
+
+    def test_slot_being_written_is_a_miss(self):
+        self.table.put('user:alice', b'one')
+        for index in range(self.table.slots):
+            offset = FILE_HEADER.size + index * self.table.slot_size + SEQ_OFFSET
+            seq, = struct.unpack_from('<I', self.table._mm, offset)
+            struct.pack_into('<I', self.table._mm, offset, seq | 1)
+
+        assert_that(self.table.get('user:alice'), equal_to(None))
+        assert_that(self.table.contended, equal_to(1))
+
+    def test_slot_left_odd_by_a_crashed_writer_is_repaired(self):
+        self.table.put('user:alice', b'one')
+        offset = next(offset for offset in self.table._candidates(key_hash(b'user:alice'))
+                      if self.table._mm[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + 10] == b'user:alice')
+        # Died after marking the slot and writing half the value
+        seq, = struct.unpack_from('<I', self.table._mm, offset + SEQ_OFFSET)
+        struct.pack_into('<I', self.table._mm, offset + SEQ_OFFSET, seq + 1)
+        self.table._mm[offset + SLOT_HEADER.size + 10:offset + SLOT_HEADER.size + 11] = b'x'
+        assert_that(self.table.get('user:alice'), equal_to(None))
+
+        self.table.put('user:alice', b'two')
+
+        assert_that(self.table.get('user:alice'), equal_to((b'two', 1000.0)))
+        seq, = struct.unpack_from('<I', self.table._mm, offset + SEQ_OFFSET)
+        assert_that(seq % 2, equal_to(0))
+
+    def test_readers_never_see_torn_writes(self):
+        self.table.put('key', b'0' * 100)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                writer = SharedTable(self.path)
+                i = 0
+                while True:
+                    i = (i + 1) % 10
+                    writer.put('key', str(i).encode() * 100)
+            finally:
+                os._exit(1)
+
+        try:
+            values = {entry[0] for entry in (self.table.get('key') for _ in range(20000)) if entry is not None}
+        finally:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+
+        assert_that(all(len(set(value)) == 1 and len(value) == 100 for value in values), equal_to(True))
+
+
+class TestSharedCacheClients(SharedTableTest):
+    def setup_method(self, method) -> None:
+        super().setup_method(method)
+        self.awsed = CountingAwsedClient()
+        self.awsed.add_user('alice', UserResponse(uid=1, enrollments=['CSE101']))
+        self.awsed.add_teams('alice', ListTeamsResponse(teams=[TeamJson(gid=2)]))
+
+    def test_lookups_are_shared_between_clients(self):
+        first = SharedCacheAwsedClient(self.awsed, self.table, user_ttl=60)
+        second = SharedCacheAwsedClient(self.awsed, SharedTable(self.path, clock=self.clock), user_ttl=60)
+        first.cache.start = second.cache.start = lambda: None
+
+        first.describe_user('alice')
+        user = second.describe_user('alice')
+
+        assert_that(user, equal_to(UserResponse(uid=1, enrollments=['CSE101'])))
+        assert_that((self.awsed.calls.count('describe_user'), second.cache.hits), equal_to((1, 1)))
+        assert_that(second.list_user_teams('alice'), equal_to(ListTeamsResponse(teams=[TeamJson(gid=2)])))
+
+    def test_not_found_expires_sooner(self):
+        client = SharedCacheAwsedClient(self.awsed, self.table, user_ttl=60, negative_ttl=5)
+        client.cache.start = lambda: None
+
+        client.describe_user('bob')
+        client.describe_user('bob')
+        self.clock.now += 6
+        user = client.describe_user('bob')
+
+        assert_that((user, self.awsed.calls.count('describe_user')), equal_to((None, 2)))
+
+    def test_expired_entries_are_served_while_the_client_fails(self):
+        client = SharedCacheAwsedClient(self.awsed, self.table, user_ttl=60, stale_ttl=100)
+        client.cache.start = lambda: None
+        client.describe_user('alice')
+        self.awsed.failing = True
+
+        self.clock.now += 120
+        assert_that(client.describe_user('alice').uid, equal_to(1))
+        self.clock.now += 50
+        assert_that(calling(client.describe_user).with_args('alice'), raises(UnsuccessfulRequest))
+        assert_that(client.cache.stale_hits, equal_to(1))
+
+    def test_refresh_fetches_entries_read_since_stored(self):
+        client = SharedCacheAwsedClient(self.awsed, self.table, user_ttl=60)
+        client.cache.start = lambda: None
+        self.awsed.add_user('bob', UserResponse(uid=3, enrollments=[]))
+        client.describe_user('alice')
+        client.describe_user('bob')
+        self.clock.now += 1
+        client.describe_user('alice')
+
+        self.clock.now += 50
+        client.cache.refresh()
+
+        assert_that((self.awsed.calls.count('describe_user'), client.cache.refreshes), equal_to((3, 1)))
+        assert_that(self.table.get('user:alice')[1], equal_to(self.clock.now))
+
+    def test_namespaces_are_shared_and_gpus_are_not(self):
+        kube = FakeKubeClient()
+        kube.add_namespace('alice', Namespace(name='alice', labels={'k8s-sync': 'true'}, gpu_quota=2))
+        kube.set_existing_gpus('alice', 1)
+        client = SharedCacheKubeClient(kube, self.table)
+        client.cache.start = lambda: None
+
+        client.get_namespace('alice')
+        kube.namespaces = {}
+
+        assert_that(client.get_namespace('alice'), equal_to(Namespace(name='alice', labels={'k8s-sync': 'true'},
+                                                                     gpu_quota=2)))
+        assert_that(client.get_gpus_in_namespace('alice'), equal_to(1))
@@ -0,0 +1,88 @@
+from hamcrest import assert_that, calling, equal_to, raises
+
+from dsmlp.ext.awsed import CachingAwsedClient
+from dsmlp.ext.awsed_replica import AwsedReplica
+from dsmlp.ext.snapshot import LookupSnapshot, SnapshotAwsedClient, SnapshotKubeClient, warm_cache, warm_replica
+from dsmlp.plugin.awsed import ListTeamsResponse, TeamJson, UnsuccessfulRequest, UserResponse
+from dsmlp.plugin.kube import Namespace
+from tests.fakes import CountingAwsedClient, FakeClock, FakeKubeClient
+
+
+class TestLookupSnapshot:
+    def setup_method(self) -> None:
+        self.clock = FakeClock()
+        self.clock.now = 1000
+        self.awsed_client = CountingAwsedClient()
+        self.awsed_client.add_user('user10', UserResponse(uid=10, enrollments=['CSE100']))
+        self.awsed_client.add_teams('user10', ListTeamsResponse(teams=[TeamJson(gid=1000)]))
+        self.awsed_client.assign_user_gpu_quota('user10', {"gpu": 4})
+
+    def record(self, path) -> None:
+        snapshot = LookupSnapshot(str(path), clock=self.clock)
+        client = SnapshotAwsedClient(self.awsed_client, snapshot)
+        client.describe_user('user10')
+        client.list_user_teams('user10')
+        client.get_user_gpu_quota('user10')
+        assert_that(snapshot.save(), equal_to(3))
+
+    def test_round_trip(self, tmp_path):
+        self.record(tmp_path / 'snapshot.db')
+        snapshot = LookupSnapshot(str(tmp_path / 'snapshot.db'), clock=self.clock)
+
+        assert_that(snapshot.load(), equal_to(3))
+        assert_that(snapshot.recall('user', 'user10'), equal_to((True, UserResponse(uid=10, enrollments=['CSE100']))))
+        assert_that(snapshot.recall('teams', 'user10'), equal_to((True, ListTeamsResponse(teams=[TeamJson(gid=1000)]))))
+        assert_that(snapshot.recall('gpu_quota', 'user10'), equal_to((True, 4)))
+
+    def test_old_entries_are_not_loaded(self, tmp_path):
+        self.record(tmp_path / 'snapshot.db')
+        self.clock.now += 86401
+
+        assert_that(LookupSnapshot(str(tmp_path / 'snapshot.db'), clock=self.clock).load(), equal_to(0))
+
+    def test_serves_snapshot_when_awsed_fails(self, tmp_path):
+        snapshot = LookupSnapshot(str(tmp_path / 'snapshot.db'), clock=self.clock)
+        client = SnapshotAwsedClient(self.awsed_client, snapshot)
+        client.describe_user('user10')
+        self.awsed_client.failing = True
+
+        assert_that(client.describe_user('user10').uid, equal_to(10))
+        assert_that(calling(client.describe_user).with_args('user11'), raises(UnsuccessfulRequest))
+
+    def test_serves_namespace_when_api_fails(self, tmp_path):
+        snapshot = LookupSnapshot(str(tmp_path / 'snapshot.db'), clock=self.clock)
+        kube_client = FakeKubeClient()
+        kube_client.add_namespace('user10', Namespace(name='user10', labels={}, gpu_quota=3))
+        client = SnapshotKubeClient(kube_client, snapshot)
+        client.get_namespace('user10')
+        del kube_client.namespaces['user10']
+
+        assert_that(client.get_namespace('user10').gpu_quota, equal_to(3))
+
+    def test_warm_cache_serves_without_awsed(self, tmp_path):
+        self.record(tmp_path / 'snapshot.db')
+        snapshot = LookupSnapshot(str(tmp_path / 'snapshot.db'), clock=self.clock)
+        snapshot.load()
+        self.awsed_client.calls.clear()
+        self.awsed_client.failing = True
+        client = CachingAwsedClient(self.awsed_client)
+        client.users._executor = None
+        client.users._submit_refresh = lambda key, loader: None
+
+        warm_cache(client.users, snapshot, 'user')
+
+        assert_that(client.describe_user('user10').uid, equal_to(10))
+        assert_that(self.awsed_client.calls, equal_to([]))
+
+    def test_warm_replica(self, tmp_path):
+        self.record(tmp_path / 'snapshot.db')
+        snapshot = LookupSnapshot(str(tmp_path / 'snapshot.db'), clock=self.clock)
+        snapshot.load()
+        self.clock.now += 60
+        replica = AwsedReplica(self.awsed_client, lambda: [], clock=self.clock)
+        replica.start = lambda: None
+
+        warm_replica(replica, snapshot)
+
+        assert_that(replica.get_user_gpu_quota('user10'), equal_to(4))
+        assert_that(replica.lag(), equal_to(60))
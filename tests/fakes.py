@@ -1,13 +1,13 @@
 from collections.abc import Mapping
 from dataclasses import dataclass
 from os import path
-from typing import List, TypedDict, Dict, Any
+from typing import List, Tuple, TypedDict, Dict, Any
 
 from dacite import from_dict
 
 from dsmlp.plugin.awsed import AwsedClient,  ListTeamsResponse, UnsuccessfulRequest, UserResponse, UserQuotaResponse, Quota
 from dsmlp.plugin.kube import KubeClient, Namespace, NotFound
-from dsmlp.plugin.logger import Logger
+from dsmlp.plugin.logger import Logger, StructuredMessage
 
 
 class FakeAwsedClient(AwsedClient):
@@ -54,6 +54,34 @@ class FakeAwsedClient(AwsedClient):
         self.teams[username] = teams
 
 
+class CountingAwsedClient(FakeAwsedClient):
+    """Records each call in `calls` by method and in `requests` by (method, username); fails while `failing`"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls: List[str] = []
+        self.requests: List[Tuple[str, str]] = []
+        self.failing = False
+
+    def describe_user(self, username):
+        self.record('describe_user', username)
+        return super().describe_user(username)
+
+    def list_user_teams(self, username):
+        self.record('list_user_teams', username)
+        return super().list_user_teams(username)
+
+    def get_user_gpu_quota(self, username):
+        self.record('get_user_gpu_quota', username)
+        return super().get_user_gpu_quota(username)
+
+    def record(self, method: str, username: str):
+        self.calls.append(method)
+        self.requests.append((method, username))
+        if self.failing:
+            raise UnsuccessfulRequest()
+
+
 class FakeKubeClient(KubeClient):
     def __init__(self):
         self.namespaces: TypedDict[str, Namespace] = {}
@@ -78,15 +106,44 @@ class FakeKubeClient(KubeClient):
         self.existing_gpus[name] = gpus
 
 
+class CountingKubeClient(FakeKubeClient):
+    def __init__(self):
+        super().__init__()
+        self.calls: List[str] = []
+
+    def get_namespace(self, name):
+        self.calls.append('get_namespace')
+        return super().get_namespace(name)
+
+    def get_gpus_in_namespace(self, name):
+        self.calls.append('get_gpus_in_namespace')
+        return super().get_gpus_in_namespace(name)
+
+
+class FakeClock:
+    """A clock for `clock=` parameters, moved by setting `now`; `sleep` advances it"""
+
+    def __init__(self, now: float = 0.0):
+        self.now = now
+        self.slept: List[float] = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
 class FakeLogger(Logger):
     def __init__(self) -> None:
         self.messages = []
 
-    def debug(self, message):
-        self.messages.append(f"DEBUG {message}")
+    def debug(self, message, **fields):
+        self.messages.append(f"DEBUG {StructuredMessage(message, fields)}")
 
-    def info(self, message):
-        self.messages.append(f"INFO {message}")
+    def info(self, message, **fields):
+        self.messages.append(f"INFO {StructuredMessage(message, fields)}")
 
     def exception(self, exception):
         self.messages.append(f"EXCEPTION {exception}")